@@ -1,141 +1,443 @@
+import src.columns as columns
 import pandas as pd
+import numpy as np
 import ast
+import bisect
 
 
-# function to calculate average X per genre
-def calculate_avg_per_genre(dataframe, col, per_genre):
+# function to split the genres column into one (row position, genre) pair per genre of every movie
+def explode_genres(dataframe):
     """
-    :param dataframe: dataframe object to find averages
-    :param col: column to calculate average
-    :param per_genre: dictionary of the count and sum per genre
-    :return: dataframe of averages per genre and dictionaries of the count and sum per genre
+    :param dataframe: dataframe object with a 'genres' list column
+    :return: tuple of the row position and genre of every pair, in order of first appearance
     """
-    # case that total and count have not been calculated before
-    if per_genre is None:
-        per_genre = {}  # {"horror": (sum, count), "comedy": (sum ,count), ...}
-        for genres, feature in zip(dataframe['genres'], dataframe[col]):
-            try:
-                feature = float(feature)
-            except (ValueError, TypeError):
-                feature = 0
-            for genre in genres:
-                if genre in per_genre:
-                    feature_sum, count = per_genre.get(genre)
-                    per_genre[genre] = (feature_sum + feature, count + 1)
-                else:
-                    per_genre[genre] = (feature, 1)
-    # calculates average (incremental case will always run below)
-    averages = {}
-    for genre in per_genre:
-        sum, count = per_genre.get(genre)
-        averages[genre] = sum / count
-    temp = 'average ' + col
-    df = pd.DataFrame(list(averages.items()), columns=['genre', temp])
-    return df, per_genre
-
-
-# function to update count and sum dictionaries when a movie is inserted
-def update_avgs_per_genre_insert(movie, revenue_per_genre, rating_per_genre, budget_per_genre):
+    genres = columns.ListColumn.from_series(dataframe['genres'])
+    return genres.positions(), genres.values()
+
+
+def genre_values(dataframe, cols):
     """
-    :param movie: row containing data of movie after an insert
-    :param revenue_per_genre: dictionary of the count and sum by genre for revenue
-    :param rating_per_genre: dictionary of the count and sum by genre for rating
-    :param budget_per_genre: dictionary of the count and sum by genre for budget
-    :return: dictionaries of the count and sum by genre for revenue, rating, and budget
+    :param dataframe: dataframe object with a 'genres' list column
+    :param cols: list of numeric columns
+    :return: tuple of the genre of every (movie, genre) pair and a dataframe of the columns for each pair, a genre
+             listed twice by one movie gives one pair and values that aren't numbers are NaN
     """
-    genre_val = movie[9]
-    print(movie)
-    revenue_val = float(movie[4])
-    budget_val = float(movie[0])
-    rating_val = float(movie[7])
-    # for every genre, increment count and add value of newly added item to sum for revenue, rating, budget
-    for genre in genre_val:
-        # print(genre)
-        if genre in revenue_per_genre:
-            feature_sum, count = revenue_per_genre.get(genre)
-            revenue_per_genre[genre] = (feature_sum + revenue_val, count + 1)
-        if genre in rating_per_genre:
-            feature_sum, count = rating_per_genre.get(genre)
-            rating_per_genre[genre] = (feature_sum + rating_val, count + 1)
-        if genre in budget_per_genre:
-            feature_sum, count = budget_per_genre.get(genre)
-            budget_per_genre[genre] = (feature_sum + budget_val, count + 1)
-        else:  # new genre, not found in current data
-            revenue_per_genre[genre] = (revenue_val, 1)
-            rating_per_genre[genre] = (rating_val, 1)
-            budget_per_genre[genre] = (budget_val, 1)
-    return revenue_per_genre, rating_per_genre, budget_per_genre
-
-
-# function to update sum and count dictionaries when a movie is removed
-def update_avgs_per_genre_delete(movie, revenue_per_genre, rating_per_genre, budget_per_genre):
+    positions, genres = explode_genres(dataframe)
+    pairs = pd.DataFrame({'position': positions, 'genre': genres}).drop_duplicates()
+    values = dataframe[cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+    return pairs['genre'].to_numpy(), pd.DataFrame(values[pairs['position'].to_numpy()], columns=cols)
+
+
+# function to calculate the sum and count per genre of several columns in one groupby
+def calculate_per_genre(dataframe, cols):
     """
-    :param movie: row containing data of a movie
-    :param revenue_per_genre: dictionary of the count and sum by genre for revenue
-    :param rating_per_genre: dictionary of the count and sum by genre for rating
-    :param budget_per_genre: dictionary of the count and sum by genre for budget
-    :return: dictionaries of the updated count and sum by genre for revenue, rating, and budget after removing old data
+    :param dataframe: dataframe object to find sums and counts
+    :param cols: list of columns to sum
+    :return: dictionary of column to dictionary of the sum and count per genre, in the format of
+             GenreAggregates.per_genre so the recompute and the incremental updates can be compared
     """
-    genre_val = movie[9]
-    revenue_val = float(movie[4])
-    budget_val = float(movie[0])
-    rating_val = float(movie[7])
-    # for every genre, decrement count and the subtract value of old item from sum for revenue, rating, budget
-    for genre in genre_val:
-        if genre in revenue_per_genre:
-            feature_sum, count = revenue_per_genre.get(genre)
-            revenue_per_genre[genre] = (feature_sum - revenue_val, count - 1)
-        if genre in rating_per_genre:
-            feature_sum, count = rating_per_genre.get(genre)
-            rating_per_genre[genre] = (feature_sum - rating_val, count - 1)
-        if genre in budget_per_genre:
-            feature_sum, count = budget_per_genre.get(genre)
-            budget_per_genre[genre] = (feature_sum - budget_val, count - 1)
-    return revenue_per_genre, rating_per_genre, budget_per_genre
-
-
-# function to update sum and count dictionaries after an edit is made
-def update_avgs_per_genre_edit(old_movie, updated_movie, revenue_per_genre, rating_per_genre, budget_per_genre):
+    genres, values = genre_values(dataframe, cols)
+    # missing values are left out of both the sum and the count, as GenreAggregates does
+    grouped = values.groupby(genres, sort=False)
+    sums = grouped.sum()
+    counts = grouped.count()
+    genre_names = sums.index.tolist()
+    return {col: dict(zip(genre_names, zip(sums[col].tolist(), counts[col].tolist()))) for col in cols}
+
+
+def as_float(value):
     """
-    :param old_movie: row containing data of the movie before edit
-    :param updated_movie: row containing data of the movie after edit
-    :param revenue_per_genre: dictionary of the count and sum by genre for revenue
-    :param rating_per_genre: dictionary of the count and sum by genre for rating
-    :param budget_per_genre: dictionary of the count and sum by genre for budget
-    :return: dictionaries of the updated count and sum by genre for revenue, rating, and budget after removing old data
+    :param value: number or numeric string
+    :return: value as a float, NaN if it is not a number
     """
-    # once edit is made, remove old data and update the count and sum
-    deleted_result = update_avgs_per_genre_delete(old_movie, revenue_per_genre, rating_per_genre, budget_per_genre)
-    # add the new data and update the count and sum
-    edited_result = update_avgs_per_genre_insert(updated_movie, deleted_result[0], deleted_result[1], deleted_result[2])
-    return edited_result[0], edited_result[1], edited_result[2]
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
 
 
-def calculate_pop_feature_count(df, feature_name):
-    features = []
-    for i in df[feature_name]:
-        for j in i:
-            features.append(j)
-    pop_features = pd.DataFrame(columns=[feature_name])
-    pop_features[feature_name] = features
-    temp = pop_features.value_counts().rename_axis(feature_name).reset_index(name='count', drop=False)
-    temp = temp.set_index(feature_name).to_dict()['count']
-    return temp
-
-
-def add_count(dictionary, features):
-    for i in features:
-        if i in dictionary:
-            count = dictionary.get(i)
-            dictionary[i] = count + 1
+# sum, count, sum of squares, min and max of several numeric columns per genre, in one set of arrays
+class GenreAggregates:
+    def __init__(self, columns):
+        """
+        :param columns: list of numeric columns to aggregate (i.e. ['revenue', 'rating', 'budget'])
+        """
+        self.columns = list(columns)
+        self.genre_ids = {}  # {"Horror": 0, "Comedy": 1, ...}, row of each genre in the arrays below
+        self.genres = []  # genre name per row, None for rows of evicted genres
+        self.free = []  # rows of evicted genres that a new genre can reuse
+        shape = (0, len(self.columns))
+        self.movies = np.zeros(0, dtype=np.int64)  # movies per genre, a genre is evicted when it reaches 0
+        self.count = np.zeros(shape, dtype=np.int64)  # movies per genre with a value in each column
+        self.sum = np.zeros(shape)
+        self.sum_sq = np.zeros(shape)
+        self.min = np.zeros(shape)
+        self.max = np.zeros(shape)
+        # min/max can't be undone by a delete, so a deleted extreme marks its cell until recompute_extremes
+        self.stale = np.zeros(shape, dtype=bool)
+
+    @classmethod
+    def from_dataframe(cls, dataframe, columns):
+        """
+        :param dataframe: dataframe object with a 'genres' list column
+        :param columns: list of numeric columns to aggregate
+        :return: aggregates over every movie in dataframe
+        """
+        aggregates = cls(columns)
+        genres, values = genre_values(dataframe, columns)
+        # every statistic of every column comes out of the same grouping of the exploded pairs
+        grouped = values.groupby(genres, sort=False)
+        movies = grouped.size()
+        for genre in movies.index:
+            aggregates.genre_id(genre)
+        rows = len(movies)
+        aggregates.movies[:rows] = movies.to_numpy()
+        aggregates.count[:rows] = grouped.count().to_numpy()
+        aggregates.sum[:rows] = grouped.sum().to_numpy()
+        aggregates.sum_sq[:rows] = (values * values).groupby(genres, sort=False).sum().to_numpy()
+        aggregates.min[:rows] = grouped.min().fillna(np.inf).to_numpy()
+        aggregates.max[:rows] = grouped.max().fillna(-np.inf).to_numpy()
+        return aggregates
+
+    def genre_id(self, genre):
+        """
+        :param genre: genre name, registered if it has not been seen before
+        :return: row of the genre in the arrays
+        """
+        row = self.genre_ids.get(genre)
+        if row is not None:
+            return row
+        if self.free:
+            row = self.free.pop()
+            self.genres[row] = genre
+        else:
+            row = len(self.genres)
+            self.genres.append(genre)
+            if row == len(self.movies):
+                # double the capacity so registering genres one at a time stays amortized O(1)
+                extra = max(row, 8)
+                self.movies = np.concatenate([self.movies, np.zeros(extra, dtype=np.int64)])
+                empty = np.zeros((extra, len(self.columns)))
+                self.count = np.vstack([self.count, empty.astype(np.int64)])
+                self.sum = np.vstack([self.sum, empty])
+                self.sum_sq = np.vstack([self.sum_sq, empty])
+                self.min = np.vstack([self.min, empty])
+                self.max = np.vstack([self.max, empty])
+                self.stale = np.vstack([self.stale, empty.astype(bool)])
+        self.min[row] = np.inf
+        self.max[row] = -np.inf
+        self.genre_ids[genre] = row
+        return row
+
+    def pairs(self, genre_lists, values, register):
+        """
+        :param genre_lists: list of genre lists, one per movie
+        :param values: 2d array of the aggregated columns, one row per movie
+        :param register: flag for whether unseen genres get a row
+        :return: tuple of the genre row and the values for every (movie, genre) pair
+        """
+        values = np.asarray(values)
+        if values.dtype.kind not in 'biuf':
+            # rows typed into the edit/insert forms can hold strings
+            values = np.vectorize(as_float, otypes=[np.float64])(values)
+        values = values.astype(np.float64)
+        movie_rows, genre_rows = [], []
+        for i, genres in enumerate(genre_lists):
+            for genre in set(genres):
+                row = self.genre_id(genre) if register else self.genre_ids.get(genre)
+                if row is not None:
+                    movie_rows.append(i)
+                    genre_rows.append(row)
+        return np.array(genre_rows, dtype=np.int64), values.reshape(-1, len(self.columns))[movie_rows]
+
+    def insert_many(self, genre_lists, values):
+        """
+        :param genre_lists: list of genre lists, one per inserted movie
+        :param values: 2d array of the aggregated columns, one row per inserted movie
+        """
+        rows, values = self.pairs(genre_lists, values, register=True)
+        present = ~np.isnan(values)
+        filled = np.where(present, values, 0)
+        np.add.at(self.movies, rows, 1)
+        np.add.at(self.count, rows, present)
+        np.add.at(self.sum, rows, filled)
+        np.add.at(self.sum_sq, rows, filled * filled)
+        np.minimum.at(self.min, rows, np.where(present, values, np.inf))
+        np.maximum.at(self.max, rows, np.where(present, values, -np.inf))
+
+    def delete_many(self, genre_lists, values):
+        """
+        :param genre_lists: list of genre lists, one per deleted movie
+        :param values: 2d array of the aggregated columns, one row per deleted movie
+        """
+        rows, values = self.pairs(genre_lists, values, register=False)
+        present = ~np.isnan(values)
+        filled = np.where(present, values, 0)
+        np.subtract.at(self.movies, rows, 1)
+        np.subtract.at(self.count, rows, present)
+        np.subtract.at(self.sum, rows, filled)
+        np.subtract.at(self.sum_sq, rows, filled * filled)
+        np.logical_or.at(self.stale, rows, present & ((values <= self.min[rows]) | (values >= self.max[rows])))
+        # genres left without any movie are evicted and their row is freed for reuse
+        for row in np.unique(rows[self.movies[rows] <= 0]):
+            del self.genre_ids[self.genres[row]]
+            self.genres[row] = None
+            self.free.append(int(row))
+            self.movies[row] = 0
+            self.count[row] = 0
+            self.sum[row] = 0
+            self.sum_sq[row] = 0
+            self.stale[row] = False
+
+    def copy(self):
+        """
+        :return: aggregates that can be changed without changing these
+        """
+        aggregates = GenreAggregates(self.columns)
+        aggregates.genre_ids = dict(self.genre_ids)
+        aggregates.genres = list(self.genres)
+        aggregates.free = list(self.free)
+        for name in ['movies', 'count', 'sum', 'sum_sq', 'min', 'max', 'stale']:
+            setattr(aggregates, name, getattr(self, name).copy())
+        return aggregates
+
+    def insert(self, genres, values):
+        """
+        :param genres: list of genres of the inserted movie
+        :param values: list of the aggregated columns of the inserted movie
+        """
+        self.insert_many([genres], [values])
+
+    def delete(self, genres, values):
+        """
+        :param genres: list of genres of the deleted movie
+        :param values: list of the aggregated columns of the deleted movie
+        """
+        self.delete_many([genres], [values])
+
+    def edit(self, old_genres, old_values, new_genres, new_values):
+        """
+        :param old_genres: list of genres of the movie before edit
+        :param old_values: list of the aggregated columns of the movie before edit
+        :param new_genres: list of genres of the movie after edit
+        :param new_values: list of the aggregated columns of the movie after edit
+        """
+        self.delete(old_genres, old_values)
+        self.insert(new_genres, new_values)
+
+    def recompute_extremes(self, dataframe):
+        """
+        :param dataframe: dataframe object the aggregates describe, used to rebuild min/max of stale cells
+        """
+        stale_rows = np.flatnonzero(self.stale.any(axis=1))
+        if len(stale_rows) == 0:
+            return
+        # only the movies of the stale genres are aggregated again
+        stale_genres = {self.genres[row] for row in stale_rows}
+        listed = columns.ListColumn.from_series(dataframe['genres']).contains_any(stale_genres)
+        fresh = GenreAggregates.from_dataframe(dataframe[listed], self.columns)
+        for row in stale_rows:
+            fresh_row = fresh.genre_ids.get(self.genres[row])
+            if fresh_row is not None:
+                self.min[row], self.max[row] = fresh.min[fresh_row], fresh.max[fresh_row]
+        self.stale[stale_rows] = False
+
+    def per_genre(self, col):
+        """
+        :param col: aggregated column
+        :return: dictionary of the sum and count of col per genre, in the format of one column of
+                 calculate_per_genre
+        """
+        j = self.columns.index(col)
+        return {genre: (float(self.sum[row, j]), int(self.count[row, j])) for genre, row in self.genre_ids.items()}
+
+    def averages(self, col):
+        """
+        :param col: aggregated column
+        :return: dataframe of the 'genre' and 'average <col>' of every genre
+        """
+        j = self.columns.index(col)
+        rows = [self.genre_ids[genre] for genre in self.genre_ids]
+        count = self.count[rows, j]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            average = self.sum[rows, j] / count
+        return pd.DataFrame({'genre': list(self.genre_ids), 'average ' + col: average})
+
+    def variances(self, col):
+        """
+        :param col: aggregated column
+        :return: dataframe of the population variance of col per genre
+        """
+        j = self.columns.index(col)
+        rows = [self.genre_ids[genre] for genre in self.genre_ids]
+        count = self.count[rows, j]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.sum[rows, j] / count
+            variance = self.sum_sq[rows, j] / count - mean * mean
+        return pd.DataFrame({'genre': list(self.genre_ids), 'variance ' + col: variance})
+
+
+# feature -> count map that keeps its ranking sorted, for the most popular genres/keywords/companies pages
+class FeatureCounter:
+    def __init__(self):
+        self.counts = {}  # {"Drama": 20265, "Comedy": 13182, ...}
+        self.buckets = {}  # {20265: {"Drama": None}, ...}, features sharing a count, in the order they got it
+        self.ranks = []  # distinct counts held by at least one feature, ascending
+
+    @classmethod
+    def from_counts(cls, counts):
+        """
+        :param counts: dictionary of feature to count
+        :return: counter holding the same counts, ties keep the order of counts
+        """
+        counter = cls()
+        for feature, count in counts.items():
+            if count > 0:
+                counter.counts[feature] = count
+                counter.buckets.setdefault(count, {})[feature] = None
+        counter.ranks = sorted(counter.buckets)
+        return counter
+
+    def move(self, feature, old, new):
+        """
+        :param feature: feature whose count changes
+        :param old: count before the change, 0 if the feature is new
+        :param new: count after the change, 0 to drop the feature
+        """
+        if old > 0:
+            bucket = self.buckets[old]
+            del bucket[feature]
+            if not bucket:
+                del self.buckets[old]
+                self.ranks.pop(bisect.bisect_left(self.ranks, old))
+        if new > 0:
+            bucket = self.buckets.get(new)
+            if bucket is None:
+                bucket = self.buckets[new] = {}
+                bisect.insort(self.ranks, new)
+            bucket[feature] = None
+            self.counts[feature] = new
         else:
-            dictionary[i] = 1
-    return dictionary
+            self.counts.pop(feature, None)
+
+    def add(self, features):
+        """
+        :param features: list of features to increment, unseen features start at 1
+        """
+        for feature in features:
+            old = self.counts.get(feature, 0)
+            self.move(feature, old, old + 1)
 
+    def subtract(self, features):
+        """
+        :param features: list of features to decrement, a feature reaching 0 is dropped
+        """
+        for feature in features:
+            old = self.counts.get(feature, 0)
+            if old > 0:
+                self.move(feature, old, old - 1)
 
-def subtract_count(dictionary, features):
-    for i in features:
-        if i in dictionary:
-            count = dictionary.get(i)
-            dictionary[i] = count - 1
-    return dictionary
+    def update(self, deltas):
+        """
+        :param deltas: dictionary of feature to net change in its count, each feature is moved once
+        """
+        for feature, delta in deltas.items():
+            old = self.counts.get(feature, 0)
+            new = max(old + delta, 0)
+            if new != old:
+                self.move(feature, old, new)
+
+    def copy(self):
+        """
+        :return: counter that can be changed without changing this one
+        """
+        counter = FeatureCounter()
+        counter.counts = dict(self.counts)
+        counter.buckets = {count: dict(bucket) for count, bucket in self.buckets.items()}
+        counter.ranks = list(self.ranks)
+        return counter
+
+    def top(self, k=None):
+        """
+        :param k: number of features to return, None for all of them
+        :return: list of (feature, count) from the highest count down
+        """
+        ranking = []
+        # walk the buckets from the highest count and stop after k features, nothing else is sorted
+        for count in reversed(self.ranks):
+            for feature in self.buckets[count]:
+                if k is not None and len(ranking) >= k:
+                    return ranking
+                ranking.append((feature, count))
+        return ranking
+
+    def get(self, feature, default=None):
+        return self.counts.get(feature, default)
+
+    def __getitem__(self, feature):
+        return self.counts[feature]
+
+    def __contains__(self, feature):
+        return feature in self.counts
+
+    def __len__(self):
+        return len(self.counts)
+
+
+def calculate_pop_feature_counts(df, feature_names):
+    """
+    :param df: dataframe object with list columns
+    :param feature_names: list of list columns to count (i.e. genres, keywords, production_companies)
+    :return: dictionary of column to counter of how many times each feature is listed
+    """
+    lists = [columns.ListColumn.from_series(df[name]) for name in feature_names]
+    # one factorize of the categories of every column gives each distinct feature a single code,
+    # the codes of each column are mapped onto it and one bincount counts every (column, code) pair
+    category_codes, uniques = pd.factorize(
+        pd.Series(np.concatenate([np.empty(0, dtype=object)] + [column.categories for column in lists]), dtype=object))
+    starts = np.cumsum([0] + [len(column.categories) for column in lists])
+    codes = np.concatenate([np.empty(0, dtype=np.int64)] +
+                           [category_codes[start + column.codes] for start, column in zip(starts, lists)])
+    tags = np.repeat(np.arange(len(feature_names)), [len(column.codes) for column in lists])
+    counts = np.bincount(tags * len(uniques) + codes,
+                         minlength=len(feature_names) * len(uniques)).reshape(len(feature_names), len(uniques))
+    counters = {}
+    for i, name in enumerate(feature_names):
+        present = np.flatnonzero(counts[i])
+        # most common first, ties keep the order the features first appeared in
+        order = present[np.argsort(-counts[i][present], kind='stable')]
+        counters[name] = FeatureCounter.from_counts(dict(zip(uniques[order].tolist(), counts[i][order].tolist())))
+    return counters
+
+
+def calculate_pop_feature_count(df, feature_name):
+    """
+    :param df: dataframe object with list columns
+    :param feature_name: list column to count
+    :return: counter of how many times each feature is listed
+    """
+    return calculate_pop_feature_counts(df, [feature_name])[feature_name]
+
+
+# columns derived from a single source column of the same row, computed once and kept next to metadata
+def list_length(series):
+    return pd.Series(columns.ListColumn.from_series(series).lengths(), index=series.index)
+
+
+def release_year(series):
+    return pd.to_datetime(series, errors='coerce').dt.year.astype('float64')
+
+
+derived_columns = {'num_languages': ('spoken_languages', list_length),
+                   'num_genres': ('genres', list_length),
+                   'num_keywords': ('keywords', list_length),
+                   'release_year': ('release_date', release_year)}
+
+
+def calculate_derived(dataframe):
+    """
+    :param dataframe: dataframe object holding the source columns
+    :return: dataframe of every derived column, with the same index as dataframe
+    """
+    return pd.DataFrame({name: function(dataframe[source]) for name, (source, function) in derived_columns.items()},
+                        index=dataframe.index)
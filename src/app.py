@@ -1,38 +1,266 @@
 import src.utils as utils
-import src.analysis as analysis
+import src.snapshot as snapshot
+import src.indexes as indexes
+import src.planner as planner
+import src.cache as cache
+import src.plots as plots
+import src.store as store
+import src.records as records
+import src.loader as loader
+import src.broadcast as broadcast
 import dash
 import dash_core_components as dcc
 import dash_table
 import dash_html_components as html
 import dash_bootstrap_components as dbc
-import ast
+import pandas as pd
+import flask
 import time
+import threading
 import plotly.express as px
 from dash.dependencies import Input, Output, State
 
 app = dash.Dash(external_stylesheets=[dbc.themes.FLATLY, "assets/stylesheet.css"])
 app.title = 'Movie Analytics'
 app.config['suppress_callback_exceptions'] = True
-metadata = utils.load_data()
-
-# set dataframe that is returned to '_' because not used
-_, revenue_per_genre = analysis.calculate_avg_per_genre(metadata, 'revenue', per_genre=None)
-_, rating_per_genre = analysis.calculate_avg_per_genre(metadata, 'rating', per_genre=None)
-_, budget_per_genre = analysis.calculate_avg_per_genre(metadata, 'budget', per_genre=None)
-
-pop_genres_count = analysis.calculate_pop_feature_count(metadata, "genres")
-pop_keys_count = analysis.calculate_pop_feature_count(metadata, "keywords")
-pop_companies_count = analysis.calculate_pop_feature_count(metadata, "production_companies")
-
-
-def display_table(df):
+# metadata, the derived columns, the per genre aggregates and the popularity counters, changed only in batches,
+# None until the background load below has finished
+movies = None
+# mutation log offset of the backup (or 0 for the csv snapshot) the frames of movies were mapped from
+movies_base_offset = None
+
+
+def build_search_indexes(metadata, text_indexes=None):
+    """
+    :param metadata: cleaned dataframe whose index holds the integer row ids
+    :param text_indexes: dictionary of text column to the trigram index over metadata loaded with it, the columns
+                         missing from it are indexed here
+    :return: dictionary of column name to the index search() and the planner use for it
+    """
+    # token -> row id lookups for the list columns, trigram lookups for the text columns and sorted lookups for
+    # the numeric columns
+    search_indexes = indexes.build_inverted_indexes(metadata, ['genres', 'keywords', 'production_companies'])
+    text_indexes = text_indexes or {}
+    search_indexes.update(text_indexes)
+    search_indexes.update(indexes.build_trigram_indexes(metadata, [column for column in snapshot.text_columns
+                                                                   if column not in text_indexes]))
+    search_indexes.update(indexes.build_sorted_indexes(metadata, ['budget', 'revenue', 'rating', 'runtime',
+                                                                  'vote_count']))
+    return search_indexes
+
+
+# figures are keyed on the load generation and the store version, so figures built from older data are never served
+# from the cache
+figure_cache = cache.FigureCache(maxsize=64)
+
+# every worker process appends its changes to one shared log and applies the whole log in order,
+# so the stores of all workers go through the same batches
+mutation_log = broadcast.MutationLog("../data/mutations")
+# a worker that fell behind another worker's compaction reloads from the backup holding the lines it missed
+mutation_follower = broadcast.LogFollower(mutation_log, on_behind=lambda: dataset_loader.start())
+
+# seconds between two backups by the timer, the Backup button makes one right away
+backup_interval = 600
+
+
+def build_store(report):
+    """
+    :param report: function of (phase, progress) the load reports its steps to
+    :return: tuple of the store over the dataset with every index built, the log offset of the dataset it was loaded
+             from, the log offset it is up to date with and the results of the replayed batches by token
+    """
+    for attempt in range(3):
+        report('loading snapshot', 0.1)
+        dataset, base_offset = load_movies()
+        offset = base_offset
+        new_movies = store.MovieStore.from_dataset(dataset)
+        served = mutation_follower.checkpoint() if movies is not None else None
+        # changes made by any worker since the backup or the csv files are replayed, only the mutation follower
+        # registers this worker's offset, so compaction follows the store being served
+        try:
+            replayed = {}
+            if served is not None and served[1] >= base_offset:
+                # a rebase onto a backup, which keeps the row ids: once the new store is at the offset of the served
+                # one they hold the same rows, so the served store's indexes are taken over instead of rebuilt
+                report('replaying mutation log', 0.3)
+                replayed, offset = broadcast.replay(new_movies, mutation_log, offset, end=served[1])
+                new_movies.share_indexes(served[0])
+            else:
+                # added before the replay, which keeps them current, the trigram indexes come mapped with the dataset
+                report('building search indexes', 0.3)
+                new_movies.add_indexes('search', build_search_indexes,
+                                       build_search_indexes(dataset['metadata'], dataset.get('text_indexes')))
+                report('building slider indexes', 0.5)
+                new_movies.add_indexes('slider', build_slider_indexes)
+            report('replaying mutation log', 0.7)
+            tail, offset = broadcast.replay(new_movies, mutation_log, offset)
+            replayed.update(tail)
+            break
+        except ValueError:
+            # another worker compacted the log into a newer backup while this one was loading, which holds the lines
+            if attempt == 2 or offset >= mutation_log.start():
+                raise
+    return new_movies, base_offset, offset, replayed
+
+
+def load_movies():
+    """
+    :return: tuple of the dataset in the format of snapshot.load_dataset and the mutation log offset it is up to
+             date with
+    """
+    # the last backup holds every change up to its log offset, without one the cleaned data and aggregates come
+    # from the snapshot of the csv files, which is only rebuilt when they change
+    start = mutation_log.start()
+    try:
+        backup = snapshot.load_backup()
+    except ValueError as error:
+        if start > 0:
+            raise ValueError("{}, the mutation log before offset {} was compacted into it, restore the backup to "
+                             "start".format(error, start))
+        print("Ignoring backup: {}".format(error))
+        backup = None
+    if backup is not None:
+        return backup
+    if start > 0:
+        # starting from the csv files would silently drop every change compacted out of the log
+        raise ValueError("no backup in {}, but the mutation log before offset {} was compacted into one, restore the "
+                         "backup to start".format(snapshot.backup_dir, start))
+    return snapshot.load_dataset(), 0
+
+
+def swap_movies(loaded):
+    """
+    :param loaded: tuple returned by build_store, its store replaces the one callbacks read from in one assignment
+    """
+    global movies, movies_base_offset
+    new_movies, base_offset, offset, replayed = loaded
+    mutation_follower.attach(new_movies, offset, replayed)
+    movies_base_offset = base_offset
+    movies = new_movies
+    # figures of the previous store can't be served anymore, their memory is freed right away
+    figure_cache.clear()
+
+
+# the server binds its port right away, the dataset is built on a background thread started at the end of the module
+dataset_loader = loader.DatasetLoader(build_store, on_ready=swap_movies)
+
+
+def backup_movies():
+    """
+    :return: tuple of the number of movies saved and the log offset the backup covers, None if there is nothing
+             newer to save than the last backup
+    """
+    if movies is None:
+        return None
+    data, offset = mutation_follower.checkpoint()
+    written = snapshot.write_backup(data, offset)
+    if written:
+        # the log up to the backup is not needed to recover anymore
+        mutation_log.compact(offset)
+    rebase_movies()
+    if not written:
+        return None
+    return len(data.metadata), offset
+
+
+def rebase_movies():
+    """
+    :return: flag for whether a reload from the backup was started
+    """
+    # the rows changed since the load are kept next to the mapped frames, once a backup (of any worker) holds them
+    # the store is reloaded from it, so the workers map the same files again and the changed rows are dropped
+    latest = snapshot.backup_offset()
+    if movies is None or latest is None or latest <= movies_base_offset:
+        return False
+    return dataset_loader.start()
+
+
+def run_backups():
+    while True:
+        time.sleep(backup_interval)
+        try:
+            backup_movies()
+        except Exception as error:
+            print("Backup failed: {}".format(error))
+
+
+def current_snapshot():
+    """
+    :return: snapshot of the dataset being served, raises PreventUpdate until the first load has finished
+    """
+    if movies is None:
+        # i.e. a tab left open across a restart fires its callbacks before the background load is done
+        raise dash.exceptions.PreventUpdate()
+    return movies.snapshot()
+
+
+def cached_figure(page, parameters, data, build):
+    """
+    :param page: pathname of the page the figure belongs to
+    :param parameters: tuple of the inputs the figure depends on (i.e. slider range)
+    :param data: snapshot the figure is built from
+    :param build: function returning the plotly figure, only called on a cache miss
+    :return: serialized figure
+    """
+    # a figure of the previous load finishing after the swap is stored under its own generation, never under a version
+    # the new store reaches later
+    return figure_cache.get((page, parameters, data.generation, data.version), lambda: build().to_dict())
+
+
+@app.server.route('/cache-stats')
+def cache_stats():
+    return flask.jsonify(figure_cache.stats())
+
+
+# health check, 200 once a dataset is being served and 503 with the load phase before that
+@app.server.route('/ready')
+def ready():
+    status = dataset_loader.status()
+    return flask.jsonify(status), 200 if status['ready'] else 503
+
+
+# loads the dataset again in the background, the current one keeps serving until the new one is swapped in
+@app.server.route('/reload', methods=['POST'])
+def reload():
+    started = dataset_loader.start()
+    return flask.jsonify(dataset_loader.status()), 202 if started else 409
+
+
+# bulk entry point for nightly data drops, the body is a json list of operations or a csv read by store.read_batch
+@app.server.route('/batch', methods=['POST'])
+def apply_batch():
+    if movies is None:
+        return flask.jsonify(dataset_loader.status()), 503
+    try:
+        if flask.request.is_json:
+            batch = flask.request.get_json()
+        else:
+            batch = store.read_batch(flask.request.get_data(as_text=True))
+        return flask.jsonify(mutation_follower.apply(batch))
+    except (ValueError, KeyError) as error:
+        # malformed operations are refused before they reach the mutation log
+        return flask.jsonify({'error': str(error)}), 400
+
+
+def display_table(columns, query=None):
+    """
+    :param columns: list of the columns shown in the table
+    :param query: dictionary describing the rows behind the table, in the format read by query_positions
+    :return: div holding the table and the stores its callbacks read
+    """
+    # data is left empty, only the requested page is sent to the browser by update_table_page
     table = dash_table.DataTable(
         id='table',
-        columns=[{"name": i, "id": i} for i in df.columns],
-        data=df.to_dict('records'),
+        columns=[{"name": i, "id": i} for i in columns],
+        data=[],
         css=[{'selector': '.row', 'rule': 'margin: 0'}],
         fixed_rows={'headers': True},
-        virtualization=True,
+        page_action='custom',
+        sort_action='custom',
+        sort_mode='multi',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
         page_size=10,
         page_current=0,
         row_deletable=True,
@@ -60,7 +288,28 @@ def display_table(df):
         # ],
         # tooltip_duration=None
     )
-    return html.Div(id='data_table', children=table, style={'height': 800})
+    # the query behind the table lives in the browser session, so every user and every worker pages the results that
+    # user searched for, and only the query travels with each page request, whatever the number of results
+    table_query = dcc.Store(id='table-query', data=query)
+    # ids of the rows update_table_page last sent to the table, a row deleted in the browser is missing from data
+    page_ids = dcc.Store(id='table-page-ids', data=[])
+    return html.Div(id='data_table', children=[table, table_query, page_ids], style={'height': 800})
+
+
+def query_positions(data, query):
+    """
+    :param data: snapshot to search
+    :param query: None for every movie, {'expression': ...} for a planner filter expression, or
+                  {'text': ..., 'columns': [...]} for a search of the text in the dropdown columns
+    :return: array of the positions in data.metadata of the matching rows, None for every row
+    """
+    if query is None:
+        return None
+    search_indexes = data.index_group('search')
+    if 'expression' in query:
+        # rows deleted since the search are gone from the snapshot, so they drop out of the results by themselves
+        return data.metadata.index.get_indexer(planner.execute(data.metadata, query['expression'], search_indexes))
+    return utils.search_positions(data.metadata, query['text'], query['columns'], search_indexes)
 
 
 @app.callback(
@@ -68,10 +317,75 @@ def display_table(df):
     [Input('button1', "n_clicks")],
     [State('search-bar', "value"), State('dropdown', "value")])
 def search(n_clicks, search_val, dropdown_vals):
+    data = current_snapshot()
     if n_clicks is not None:
         print(search_val)
-        result = utils.search(metadata, query=search_val, dropdown_vals=dropdown_vals)
-        return display_table(result)
+        if search_val is not None and '{' in search_val:
+            # structured filters such as "{budget} ge 1e8 && {genres} contains Action" go through the planner
+            query = {'expression': search_val}
+            try:
+                query_plan = planner.explain(data.metadata, search_val, data.index_group('search'))
+                # run once here so a filter that can't run is reported before the table asks for its first page
+                matches = len(query_positions(data, query))
+            except KeyError as error:
+                return html.Div('Invalid filter: unknown column {}'.format(error), style={"color": "white"})
+            except (ValueError, TypeError) as error:
+                # unsupported operators and unparsable clauses are shown instead of crashing the callback
+                return html.Div('Invalid filter: {}'.format(error), style={"color": "white"})
+        else:
+            query_plan = None
+            query = {'text': search_val, 'columns': dropdown_vals}
+        table = display_table(data.metadata.columns, query)
+        if query_plan is None:
+            return table
+        summary = 'Query plan ({} movies)'.format(matches)
+        return html.Div([html.Details([html.Summary(summary), html.Pre(query_plan)], style={"color": "white"}),
+                         table])
+
+
+@app.callback(
+    [Output('table', 'data'), Output('table', 'page_count'), Output('table-page-ids', 'data')],
+    [Input('table', 'page_current'), Input('table', 'page_size'),
+     Input('table', 'sort_by'), Input('table', 'filter_query'),
+     Input('edit-version', 'data'), Input('insert-version', 'data')],
+    [State('table-query', 'data')])
+def update_table_page(page_current, page_size, sort_by, filter_query, edit_version, insert_version, query):
+    data = current_snapshot()
+    try:
+        # the query is run again on the current snapshot, so the page reflects every change made since the search
+        page, page_count = planner.table_page(data.metadata, query_positions(data, query), page_current, page_size,
+                                              sort_by, filter_query)
+    except (KeyError, ValueError, TypeError) as error:
+        # filters the parser doesn't know (i.e. 'is blank') show an empty table instead of crashing the callback
+        print("Invalid table filter {!r}: {}".format(filter_query, error))
+        return [], 1, []
+    # dates are stored as datetime64, the table shows them as the dates the csv files hold (i.e. 1995-10-30)
+    page = page.assign(**{column: page[column].dt.strftime('%Y-%m-%d')
+                          for column in page.columns if page[column].dtype.kind == 'M'})
+    records = page.to_dict('records')
+    # 'id' is the DataTable row id, it isn't a displayed column but comes back in active_cell and data_previous
+    for row_id, record in zip(page.index, records):
+        record['id'] = int(row_id)
+    return records, page_count, [int(row_id) for row_id in page.index]
+
+
+# type-ahead shows at most suggestion_limit titles, once the prefix has suggestion_min_length characters
+suggestion_limit = 10
+suggestion_min_length = 2
+
+
+@app.callback(
+    Output('search-suggestions', "children"),
+    [Input('search-bar', "value")])
+def suggest_titles(prefix):
+    data = current_snapshot()
+    # type-ahead on titles, answered from the title trigram index, a single letter narrows nothing so it waits
+    # for the second one
+    if not prefix or len(prefix) < suggestion_min_length:
+        return []
+    row_ids = data.index_group('search')['original_title'].search(prefix, prefix=True, case=False,
+                                                                  limit=suggestion_limit)
+    return [html.Option(value=title) for title in data.metadata.loc[row_ids, 'original_title']]
 
 
 @app.callback(
@@ -86,37 +400,37 @@ def toggle_navbar_collapse(n, is_open):
 
 
 @app.callback(
-    Output('table', 'data'),
-    [Input('table', 'data_previous')],  # data_previous stores the initial dataframe only after an edit is made
-    [State('table', 'data')]  # data holds the current data of the datatable
+    Output('delete-output', 'children'),
+    # data_timestamp is only set when the user changes the data, never when a callback replaces the page
+    [Input('table', 'data_timestamp')],
+    [State('table', 'data'), State('table-page-ids', 'data')]
 )
-def row_delete(previous_data, current_data):
-    # declare it global in function to modify
-    global metadata, revenue_per_genre, rating_per_genre, budget_per_genre
-    # if the table has not been modified
-    if previous_data is None:
-        dash.exceptions.PreventUpdate()
-    else:
-        # find difference between previous_data and current_data
-        diff_row = []
-        for row in previous_data + current_data:
-            if row not in previous_data or row not in current_data:
-                diff_row.append(row)
-        # redefine the dataframe to exclude any entry with the title of the movie that is to be deleted
-        metadata = metadata[metadata.original_title != diff_row[0].get('original_title')]
-        # update analytics
-        for row in diff_row:
-            row = list(row.values())
-            global revenue_per_genre, rating_per_genre, budget_per_genre, pop_genres_count, pop_keys_count
-            revenue_per_genre, rating_per_genre, budget_per_genre = analysis.update_avgs_per_genre_delete(
-                row, revenue_per_genre, rating_per_genre, budget_per_genre
-            )
-            update_start_time = time.time()
-            pop_genres_count = analysis.subtract_count(pop_genres_count, row[9])
-            pop_keys_count = analysis.subtract_count(pop_keys_count, row[10])
-            print("Incremental Most Popular Genre Calculation Runtime: ")
-            print(time.time() - update_start_time)
-    return current_data
+def row_delete(data_timestamp, current_data, page_ids):
+    if data_timestamp is None or not page_ids:
+        raise dash.exceptions.PreventUpdate()
+    # every row carries its metadata id, the deleted rows are the served ids missing from the table,
+    # ids deleted earlier are no longer in the snapshot and are not deleted twice
+    metadata = current_snapshot().metadata
+    deleted = {row_id for row_id in set(page_ids) - {row['id'] for row in current_data} if row_id in metadata.index}
+    if not deleted:
+        raise dash.exceptions.PreventUpdate()
+    delete_movies(deleted)
+    return []
+
+
+# function to delete many movies by id as one batch
+def delete_movies(row_ids):
+    """
+    :param row_ids: iterable of metadata ids to delete, ids that are already gone are skipped
+    """
+    update_start_time = time.time()
+    try:
+        result = mutation_follower.apply([{'op': 'delete', 'id': row_id} for row_id in row_ids])
+    except ValueError as error:
+        print("Delete refused: {}".format(error))
+        return
+    print("Incremental Delete Runtime for {} movies: ".format(len(result['deleted'])))
+    print(time.time() - update_start_time)
 
 
 @app.callback(
@@ -124,12 +438,17 @@ def row_delete(previous_data, current_data):
     [Input("table", "active_cell")]
 )
 def edit_row(active_cell):
+    data = current_snapshot()
     if active_cell is not None:
-        row = active_cell.get('row')
+        row = active_cell.get('row_id')
+        if row not in data.metadata.index:
+            # deleted since the page was served, by another session or another worker
+            raise dash.exceptions.PreventUpdate()
         inputs = []
-        for column in metadata.columns:
+        # the row is read once and formatted so MovieRecord.from_inputs reads every value back unchanged
+        current_values = records.MovieRecord.from_row(data.metadata.loc[row]).to_inputs()
+        for column, current_value in zip(records.columns, current_values):
             input_id = "edit-row-input-" + column
-            current_value = str(metadata.at[row, column])
             input_group = dbc.InputGroup(
                 [
                     dbc.InputGroupAddon(column, addon_type="prepend"),
@@ -152,53 +471,30 @@ def edit_row(active_cell):
 
 
 @app.callback(
-    Output("edit-output", "children"),
+    [Output("edit-output", "children"), Output("edit-version", "data")],
     [Input("edit-submit", "n_clicks")],
-    [State("edit-body", "children")]
+    [State("edit-body", "children"), State("edit-version", "data")]
 )
-def submit_edit(n_clicks, inputs):
+def submit_edit(n_clicks, inputs, edit_version):
     if n_clicks is not None:
-        row_index = None
-        updated_row = []
-        for input_group in inputs:
-            input_dict = input_group.get('props').get('children')[1].get('props')
-            input_value = input_dict.get('value')
-            row_index = input_group.get('props').get('key')
-            if input_value.isdigit():
-                updated_row.append(int(input_value))
-            elif "[" in input_value:
-                updated_row.append(ast.literal_eval(input_value))
-            else:
-                updated_row.append(input_value)
-
-        # assigns old_row to the row containing data of the movie before edit
-        old_row = metadata.loc[row_index]
-        global revenue_per_genre, rating_per_genre, budget_per_genre
-        revenue_per_genre, rating_per_genre, budget_per_genre = analysis.update_avgs_per_genre_edit(
-            old_row, updated_row, revenue_per_genre, rating_per_genre, budget_per_genre
-        )
-
-        before_edit_genre = metadata.loc[row_index, 'genres']  # Set before value
-        after_edit_genre = updated_row[9]  # Find the appropriate genre column in row
-        added_genres = list(set(after_edit_genre) - set(before_edit_genre))  # Added genres is the after - before
-        analysis.add_count(pop_genres_count, added_genres)  # Update the inserted genres count
-        removed_genres = list(set(before_edit_genre) - set(after_edit_genre))  # Removed genres is the before - after
-        analysis.subtract_count(pop_genres_count, removed_genres)  # Decrement the count for each removed genre
-
-        before_edit_keywords = metadata.loc[row_index, 'keywords']  # Set before value
-        after_edit_keywords = updated_row[10]  # Set after value
-        added_keywords = list(
-            set(after_edit_keywords) - set(before_edit_keywords))  # Added genres is the after - before
-        analysis.add_count(pop_keys_count, added_keywords)  # Update the inserted genres count
-        removed_keywords = list(
-            set(before_edit_keywords) - set(after_edit_keywords))  # Removed genres is the before - after
-        analysis.subtract_count(pop_keys_count, removed_keywords)  # Decrement the count for each removed genre
-
-        metadata.loc[row_index] = updated_row
+        row_index = inputs[0].get('props').get('key')
+        values = [input_group.get('props').get('children')[1].get('props').get('value') for input_group in inputs]
+        # every value is converted to its column's type once, here
+        try:
+            updated_record = records.MovieRecord.from_inputs(values)
+        except ValueError as error:
+            # i.e. an unclosed list literal, the movie is left as it was
+            print("Edit refused: {}".format(error))
+            raise dash.exceptions.PreventUpdate()
+        try:
+            mutation_follower.apply([{'op': 'edit', 'id': row_index, 'row': updated_record}])
+        except ValueError as error:
+            print("Edit refused: {}".format(error))
+            raise dash.exceptions.PreventUpdate()
         print("finished edit")
-        updated_table = display_table(metadata)
-        print("finished generating table")
-        return updated_table
+        # the table shown asks update_table_page for its page again, nothing else is sent
+        return [], (edit_version or 0) + 1
+    raise dash.exceptions.PreventUpdate()
 
 
 @app.callback(
@@ -210,7 +506,7 @@ def insert(n_clicks):
     if n_clicks is not None:
         inputs = []
 
-        for column in metadata.columns:
+        for column in records.columns:
             input_id = "insert-row-input" + column
             input_group = dbc.InputGroup(
                 [
@@ -234,40 +530,28 @@ def insert(n_clicks):
 
 
 @app.callback(
-    Output("insert-output", "children"),
+    [Output("insert-output", "children"), Output("insert-version", "data")],
     [Input("insert-submit", "n_clicks")],
-    [State("insert-body", "children")]
+    [State("insert-body", "children"), State("insert-version", "data")]
 )
-def submit_insert(n_clicks, inputs):
+def submit_insert(n_clicks, inputs, insert_version):
     if n_clicks is not None:
-        row = []
-        for input_group in inputs:
-            input_dict = input_group.get('props').get('children')[1].get('props')
-            input_value = input_dict.get('value')
-            # print(input_value)
-            if input_value.isdigit():
-                row.append(int(input_value))
-            elif "[" in input_value:
-                row.append(ast.literal_eval(input_value))
-            else:
-                row.append(input_value)
-
-        # update analytics
-        global pop_genres_count, pop_keys_count
+        values = [input_group.get('props').get('children')[1].get('props').get('value') for input_group in inputs]
+        try:
+            record = records.MovieRecord.from_inputs(values)
+        except ValueError as error:
+            print("Insert refused: {}".format(error))
+            raise dash.exceptions.PreventUpdate()
         update_start_time = time.time()
-        added_genres = row[9]  # Find the appropriate genre column in row
-        pop_genres_count = analysis.add_count(pop_genres_count, added_genres)  # Update the inserted genres count
-        added_keywords = row[10]
-        pop_keys_count = analysis.add_count(pop_keys_count, added_keywords)
-        print("Incremental Most Popular Genre Calculation Runtime: ")
+        try:
+            mutation_follower.apply([{'op': 'insert', 'row': record}])
+        except ValueError as error:
+            print("Insert refused: {}".format(error))
+            raise dash.exceptions.PreventUpdate()
+        print("Incremental Insert Runtime: ")
         print(time.time() - update_start_time)
-
-        global revenue_per_genre, rating_per_genre, budget_per_genre
-        revenue_per_genre, rating_per_genre, budget_per_genre = analysis.update_avgs_per_genre_insert(
-            row, revenue_per_genre, rating_per_genre, budget_per_genre
-        )
-        metadata.loc[len(metadata)] = row
-        return display_table(metadata)
+        return [], (insert_version or 0) + 1
+    raise dash.exceptions.PreventUpdate()
 
 
 navbar = dbc.NavbarSimple(
@@ -305,7 +589,8 @@ navbar = dbc.NavbarSimple(
 
 
 def display_home():
-    headers = list(metadata.columns)
+    data = current_snapshot()
+    headers = list(data.metadata.columns)
     dd_options = [{"label": i, "value": i} for i in headers]
     return html.Div(
         children=[
@@ -315,7 +600,8 @@ def display_home():
             html.Div(id="insert-modal-div", children=[]),
             dbc.Row(children=[
                 dbc.Col(dcc.Dropdown(id='dropdown', options=dd_options, searchable=True, multi=True), width=3),
-                dbc.Col(dbc.Input(id="search-bar", placeholder="Search...", type="text"), width=6),
+                dbc.Col([dbc.Input(id="search-bar", placeholder="Search...", type="text", list="search-suggestions"),
+                         html.Datalist(id="search-suggestions", children=[])], width=6),
                 dbc.Col(dbc.Button('Search', id='button1', color="info", className="mr-1", block=True),
                         width={"size": 1, "order": "1"}),
                 dbc.Col(dbc.Button('Insert', id='button2', color="info", className="mr-1", block=True),
@@ -326,12 +612,33 @@ def display_home():
             dbc.Row(dbc.Col(html.Div(id='search-output', children=[], style={"margin-top": "10px"}), width=12)),
             dbc.Row(dbc.Col(html.Div(id='edit-output', children=[], style={"display": "none"}), width=12)),
             dbc.Row(dbc.Col(html.Div(id='insert-output', children=[], style={"display": "none"}), width=12)),
+            dbc.Row(dbc.Col(html.Div(id='delete-output', children=[], style={"display": "none"}), width=12)),
+            dbc.Row(dbc.Col(html.Div(id='backup-output', children=[], style={"color": "white"}), width=12)),
+            # bumped by every edit and every insert of this session, so the table shown loads its page again, one store
+            # per callback since a Dash output belongs to a single callback
+            dcc.Store(id='edit-version', data=0),
+            dcc.Store(id='insert-version', data=0),
             html.Hr()
         ],
         style={"margin-left": "5%", "margin-right": "5%", "margin-top": "5%"}
     )
 
 
+@app.callback(
+    Output('backup-output', "children"),
+    [Input('button3', "n_clicks")])
+def backup(n_clicks):
+    if n_clicks is None:
+        raise dash.exceptions.PreventUpdate()
+    backup_start_time = time.time()
+    saved = backup_movies()
+    print("Backup Runtime: ")
+    print(time.time() - backup_start_time)
+    if saved is None:
+        return 'The last backup is already up to date'
+    return 'Backed up {} movies'.format(saved[0])
+
+
 revenue_values = {0: '0', 200000000: '200M', 400000000: '400M', 600000000: '600M', 800000000: '800M',
                   1000000000: '1B', 1200000000: '1.2B', 1400000000: '1.4B', 1600000000: '1.6B', 1800000000: '1.8B',
                   2000000000: '2B'
@@ -341,6 +648,14 @@ budget_values = {0: '0', 50000000: '50M', 100000000: '100M', 150000000: '150M',
                  300000000: '300M', 350000000: '350M', 400000000: '400M'
                  }
 
+# the sliders only stop on their marks, so rows are partitioned at the marks once and kept current by the mutations
+def build_slider_indexes(metadata):
+    """
+    :param metadata: cleaned dataframe whose index holds the integer row ids
+    :return: dictionary of column name to the bucket index partitioned at its slider marks
+    """
+    return indexes.build_bucket_indexes(metadata, {'budget': list(budget_values), 'revenue': list(revenue_values)})
+
 
 def display_rating_budget():
     # scatter_plot = px.scatter(metadata, x="budget", y="rating")
@@ -369,9 +684,13 @@ def display_rating_budget():
     [Input('range_budget', 'value')]
 )
 def update_rating_budget(budget_interval):
-    new_df = metadata[(metadata['budget'] >= budget_interval[0]) & (metadata['budget'] <= budget_interval[1])]
-    scatter_plot = px.scatter(data_frame=new_df, x='budget', y='rating', height=550, color_discrete_sequence=['darkorange'])
-    return scatter_plot
+    data = current_snapshot()
+
+    def build():
+        row_ids = data.index_group('slider')['budget'].range(budget_interval[0], budget_interval[1])
+        new_df = data.metadata.loc[row_ids]
+        return plots.scatter(data_frame=new_df, x='budget', y='rating', height=550, color_discrete_sequence=['darkorange'])
+    return cached_figure('/rating-budget', tuple(budget_interval), data, build)
 
 
 def display_rating_revenue():
@@ -400,9 +719,13 @@ def display_rating_revenue():
     [Input('range_revenue', 'value')]
 )
 def update_rating_revenue(revenue_interval):
-    new_df = metadata[(metadata['revenue'] >= revenue_interval[0]) & (metadata['revenue'] <= revenue_interval[1])]
-    scatter_plot = px.scatter(data_frame=new_df, x='revenue', y='rating', height=550, color_discrete_sequence=['darkorange'])
-    return scatter_plot
+    data = current_snapshot()
+
+    def build():
+        row_ids = data.index_group('slider')['revenue'].range(revenue_interval[0], revenue_interval[1])
+        new_df = data.metadata.loc[row_ids]
+        return plots.scatter(data_frame=new_df, x='revenue', y='rating', height=550, color_discrete_sequence=['darkorange'])
+    return cached_figure('/rating-revenue', tuple(revenue_interval), data, build)
 
 
 def display_revenue_budget():
@@ -431,9 +754,13 @@ def display_revenue_budget():
     [Input('range_budget2', 'value')]
 )
 def update_revenue_budget(budget_interval):
-    new_df = metadata[(metadata['budget'] >= budget_interval[0]) & (metadata['budget'] <= budget_interval[1])]
-    scatter_plot = px.scatter(data_frame=new_df, x='budget', y='revenue', height=550, color_discrete_sequence=['darkorange'])
-    return scatter_plot
+    data = current_snapshot()
+
+    def build():
+        row_ids = data.index_group('slider')['budget'].range(budget_interval[0], budget_interval[1])
+        new_df = data.metadata.loc[row_ids]
+        return plots.scatter(data_frame=new_df, x='budget', y='revenue', height=550, color_discrete_sequence=['darkorange'])
+    return cached_figure('/revenue-budget', tuple(budget_interval), data, build)
 
 
 def display_rating_release_time():
@@ -461,18 +788,19 @@ def display_rating_release_time():
     [Input('rating-time-radio', 'value')]
 )
 def update_rating_release_time(value_choice):
-    if value_choice == 'Scatter':
-        return px.scatter(metadata, x="release_date", y="rating", color_discrete_sequence=['darkorange'])
-    else:
-        return px.line(metadata, x="release_date", y="rating", color_discrete_sequence=['darkorange'])
+    data = current_snapshot()
+
+    def build():
+        if value_choice == 'Scatter':
+            return plots.scatter(data.metadata, x="release_date", y="rating", color_discrete_sequence=['darkorange'])
+        else:
+            # mean rating per release month, downsampled so the line stays readable as movies are added
+            return plots.line(data.metadata, x="release_date", y="rating", freq='M',
+                              color_discrete_sequence=['darkorange'])
+    return cached_figure('/rating-release', (value_choice,), data, build)
 
 
 def display_popularity_released_language():
-    languages_votes = metadata[["spoken_languages", "rating"]]
-    num_languages = []
-    for i in metadata["spoken_languages"]:
-        num_languages.append(len(i))
-    languages_votes["num_languages"] = num_languages
     return html.Div(
         children=[
             html.H3('Correlation between Popularity and Released Language', style={"color": "white", "font-weight": "bold"}),
@@ -497,25 +825,32 @@ def display_popularity_released_language():
     [Input('popularity-language-radio', 'value')]
 )
 def update_popularity_released_language(chosen_value):
-    languages_votes = metadata[["spoken_languages", "rating"]]
-    num_languages = []
-    for i in metadata["spoken_languages"]:
-        num_languages.append(len(i))
-    languages_votes["num_languages"] = num_languages
-
-    if chosen_value == 'Scatter':
-        return px.scatter(data_frame=languages_votes, x="num_languages", y="rating", color_discrete_sequence=['darkorange'])
-    else:
-        return px.line(data_frame=languages_votes, x="num_languages", y="rating", color_discrete_sequence=['darkorange'])
+    data = current_snapshot()
+
+    def build():
+        languages_votes = pd.DataFrame({"num_languages": data.derived["num_languages"],
+                                        "rating": data.metadata["rating"]})
+        if chosen_value == 'Scatter':
+            return plots.scatter(data_frame=languages_votes, x="num_languages", y="rating",
+                                 color_discrete_sequence=['darkorange'])
+        else:
+            return plots.line(data_frame=languages_votes, x="num_languages", y="rating",
+                              color_discrete_sequence=['darkorange'])
+    return cached_figure('/popularity-language', (chosen_value,), data, build)
 
 
 def display_average_revenue():
-    df, _ = analysis.calculate_avg_per_genre(metadata, 'revenue', revenue_per_genre)
-    fig = px.bar(
-        data_frame=df, x=df['genre'], y=df['average revenue'],
-        title='Average Revenue by Genre', color_discrete_sequence=['darkorange']*len(df)
-    )
-    fig.update_layout(title_x=0.5)
+    data = current_snapshot()
+
+    def build():
+        df = data.genre_aggregates.averages('revenue')
+        fig = px.bar(
+            data_frame=df, x=df['genre'], y=df['average revenue'],
+            title='Average Revenue by Genre', color_discrete_sequence=['darkorange']*len(df)
+        )
+        fig.update_layout(title_x=0.5)
+        return fig
+    fig = cached_figure('/avg-revenue', (), data, build)
     return html.Div(
         children=[
             html.H3('Average Revenue', style={"color": "white", "font-weight": "bold"}),
@@ -535,8 +870,9 @@ def display_average_revenue():
     [Input('SortAvgRev', 'n_clicks')]
 )
 def revenue_high_to_low(n_clicks):
+    data = current_snapshot()
     if n_clicks is not None:
-        df, _ = analysis.calculate_avg_per_genre(metadata, 'revenue', revenue_per_genre)
+        df = data.genre_aggregates.averages('revenue')
         fig = px.bar(
             data_frame=df, x=df['genre'], y=df['average revenue'],
             title='Average Revenue by Genre', color_discrete_sequence=['darkorange'] * len(df)
@@ -546,12 +882,17 @@ def revenue_high_to_low(n_clicks):
 
 
 def display_average_rating():
-    df, _ = analysis.calculate_avg_per_genre(metadata, 'rating', rating_per_genre)
-    fig = px.bar(
-        data_frame=df, x=df['genre'], y=df['average rating'],
-        title='Average Rating by Genre', color_discrete_sequence=['darkorange'] * len(df)
-    )
-    fig.update_layout(title_x=0.5)
+    data = current_snapshot()
+
+    def build():
+        df = data.genre_aggregates.averages('rating')
+        fig = px.bar(
+            data_frame=df, x=df['genre'], y=df['average rating'],
+            title='Average Rating by Genre', color_discrete_sequence=['darkorange'] * len(df)
+        )
+        fig.update_layout(title_x=0.5)
+        return fig
+    fig = cached_figure('/avg-rating', (), data, build)
     return html.Div(
         children=[
             html.H3('Average Rating', style={"color": "white", "font-weight": "bold"}),
@@ -571,8 +912,9 @@ def display_average_rating():
     [Input('SortAvgRat', 'n_clicks')]
 )
 def rating_high_to_low(n_clicks):
+    data = current_snapshot()
     if n_clicks is not None:
-        df, _ = analysis.calculate_avg_per_genre(metadata, 'rating', rating_per_genre)
+        df = data.genre_aggregates.averages('rating')
         fig = px.bar(
             data_frame=df, x=df['genre'], y=df['average rating'],
             title='Average Rating by Genre', color_discrete_sequence=['darkorange'] * len(df)
@@ -582,12 +924,17 @@ def rating_high_to_low(n_clicks):
 
 
 def display_average_budget():
-    df, _ = analysis.calculate_avg_per_genre(metadata, 'budget', budget_per_genre)
-    fig = px.bar(
-        data_frame=df, x=df['genre'], y=df['average budget'],
-        title='Average Budget by Genre', color_discrete_sequence=['darkorange'] * len(df)
-    )
-    fig.update_layout(title_x=0.5)
+    data = current_snapshot()
+
+    def build():
+        df = data.genre_aggregates.averages('budget')
+        fig = px.bar(
+            data_frame=df, x=df['genre'], y=df['average budget'],
+            title='Average Budget by Genre', color_discrete_sequence=['darkorange'] * len(df)
+        )
+        fig.update_layout(title_x=0.5)
+        return fig
+    fig = cached_figure('/avg-budget', (), data, build)
     return html.Div(
         children=[
             html.H3('Average Budget', style={"color": "white", "font-weight": "bold"}),
@@ -607,8 +954,9 @@ def display_average_budget():
     [Input('SortAvgBud', 'n_clicks')]
 )
 def rating_high_to_low(n_clicks):
+    data = current_snapshot()
     if n_clicks is not None:
-        df, _ = analysis.calculate_avg_per_genre(metadata, 'budget', budget_per_genre)
+        df = data.genre_aggregates.averages('budget')
         fig = px.bar(
             data_frame=df, x=df['genre'], y=df['average budget'],
             title='Average Budget by Genre', color_discrete_sequence=['darkorange'] * len(df)
@@ -618,10 +966,16 @@ def rating_high_to_low(n_clicks):
 
 
 def display_popular_movies():
-    fig = px.bar(x=list(pop_genres_count.keys()), y=list(pop_genres_count.values()), title='Most Frequent Genres',
-                 color_discrete_sequence=['darkorange'] * len(pop_genres_count)
-                 )
-    fig.update_layout(title_x=0.5, xaxis_title="genre", yaxis_title="count")
+    data = current_snapshot()
+
+    def build():
+        genres, counts = zip(*data.counters['genres'].top()) if len(data.counters['genres']) else ((), ())
+        fig = px.bar(x=list(genres), y=list(counts), title='Most Frequent Genres',
+                     color_discrete_sequence=['darkorange'] * len(data.counters['genres'])
+                     )
+        fig.update_layout(title_x=0.5, xaxis_title="genre", yaxis_title="count")
+        return fig
+    fig = cached_figure('/popular-movies', (), data, build)
     return html.Div(
         children=[
             html.H3('Most Popular Movies', style={"color": "white", "font-weight": "bold"}),
@@ -633,9 +987,15 @@ def display_popular_movies():
 
 
 def display_common_keywords():
-    fig = px.bar(x=list(pop_keys_count.keys())[0:15], y=list(pop_keys_count.values())[0:15],
-                 title='Most Common Keywords (TOP 15)', color_discrete_sequence=['darkorange'] * 15)
-    fig.update_layout(xaxis_title="keyword", yaxis_title="count")
+    data = current_snapshot()
+
+    def build():
+        keywords, counts = zip(*data.counters['keywords'].top(15)) if len(data.counters['keywords']) else ((), ())
+        fig = px.bar(x=list(keywords), y=list(counts),
+                     title='Most Common Keywords (TOP 15)', color_discrete_sequence=['darkorange'] * 15)
+        fig.update_layout(xaxis_title="keyword", yaxis_title="count")
+        return fig
+    fig = cached_figure('/common-keywords', (), data, build)
     return html.Div(
         children=[
             html.H3('Most Common Keywords', style={"color": "white", "font-weight": "bold"}),
@@ -647,9 +1007,15 @@ def display_common_keywords():
 
 
 def display_popular_production_companies():
-    fig = px.bar(x=list(pop_companies_count.keys())[0:10], y=list(pop_companies_count.values())[0:10],
-                 title='Most Popular Production Companies (TOP 10)', color_discrete_sequence=['darkorange'] * 10)
-    fig.update_layout(xaxis_title="production_companies", yaxis_title="count")
+    data = current_snapshot()
+
+    def build():
+        companies, counts = zip(*data.counters['production_companies'].top(10)) if len(data.counters['production_companies']) else ((), ())
+        fig = px.bar(x=list(companies), y=list(counts),
+                     title='Most Popular Production Companies (TOP 10)', color_discrete_sequence=['darkorange'] * 10)
+        fig.update_layout(xaxis_title="production_companies", yaxis_title="count")
+        return fig
+    fig = cached_figure('/popular-companies', (), data, build)
     return html.Div(
         children=[
             html.H3('Most Popular Production Companies', style={"color": "white", "font-weight": "bold"}),
@@ -660,11 +1026,32 @@ def display_popular_production_companies():
     )
 
 
+@app.callback(Output('loading-poll', 'disabled'),
+              [Input('loading-poll', 'n_intervals')])
+def poll_loading(n_intervals):
+    return dataset_loader.ready()
+
+
+def display_loading():
+    status = dataset_loader.status()
+    message = 'Loading failed, see /ready' if status['phase'] == 'failed' else \
+        'Loading movies: {} ({:.0%})'.format(status['phase'], status['progress'])
+    return html.Div(
+        children=[
+            html.H3(message, style={"color": "white", "font-weight": "bold"}),
+            dbc.Progress(value=100 * status['progress'], striped=True, animated=True)
+        ],
+        style={"margin-left": "5%", "margin-right": "5%", "margin-top": "5%"}
+    )
+
+
 @app.callback(Output('page-content', 'children'),
-              [Input('url', 'pathname')])
-def display_page(pathname):
+              [Input('url', 'pathname'), Input('loading-poll', 'disabled')])
+def display_page(pathname, loading_done):
     print(pathname)
-    if pathname == "/rating-budget":
+    if movies is None:
+        page = display_loading()
+    elif pathname == "/rating-budget":
         page = display_rating_budget()
     elif pathname == "/rating-revenue":
         page = display_rating_revenue()
@@ -697,6 +1084,8 @@ app.layout = html.Div(
         html.Div([
             # represents the URL bar, doesn't render anything
             dcc.Location(id='url', refresh=False),
+            # polls until the first dataset is loaded, then disables itself and the page is rendered again
+            dcc.Interval(id='loading-poll', interval=500),
             html.Div(id='page-content')
         ])
     ],
@@ -711,5 +1100,8 @@ app.layout = html.Div(
     }
 )
 
+dataset_loader.start()
+threading.Thread(target=run_backups, name='movie-backups', daemon=True).start()
+
 if __name__ == '__main__':
     app.run_server(debug=True)
@@ -0,0 +1,827 @@
+import src.utils as utils
+import src.analysis as analysis
+import src.snapshot as snapshot
+import src.indexes as indexes
+import src.columns as columns
+import src.store as store
+import src.records as records
+import src.broadcast as broadcast
+import collections
+import mmap
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+import random
+import re
+import shutil
+import threading
+import time
+
+
+# csv parser as it was before utils.parse_csv, one regex split per line
+def legacy_parse_csv(filepath, contains_header=False):
+    """
+    :param filepath: location of csv data file
+    :param contains_header: flag for whether csv has headers or not
+    :return: dataframe object of csv data
+    """
+    # open csv file with open() and call it file
+    with open(filepath, 'r', encoding="utf8") as file:
+        data = []
+        headers = []
+        # case for when file contains headers
+        if contains_header:
+            # reading first line with readline()
+            # splitting line (separated by commas) to get each column header
+            headers = file.readline().strip('\n').split(',')
+        # use for loop to read in rest of file
+        # split data into corresponding columns using regex expression
+        for line in file:
+            line = line.strip('\n')
+            words = re.split(r',(?=(?:[^\"]*\"[^\"]*\")*(?![^\"]*\"))', line)
+            row = []
+            for word in words:
+                if word.replace('.', '', 1).isdigit():
+                    row.append(float(word))
+                else:
+                    row.append(word)
+            data.append(row)
+    # case for when file contains header when creating dataframe
+    if contains_header:
+        dataframe = pd.DataFrame(data, columns=headers)
+    else:
+        dataframe = pd.DataFrame(data)
+    return dataframe
+
+
+# function to time the old and new csv parsers on the same file
+def bench_parse_csv(filepath, contains_header=True, dtypes=None, repeat=3):
+    """
+    :param filepath: location of csv data file
+    :param contains_header: flag for whether csv has headers or not
+    :param dtypes: dictionary of column name to dtype passed to the new parser
+    :param repeat: number of runs per parser, the fastest run is reported
+    :return: dictionary of rows per second for each parser
+    """
+    parsers = {
+        'regex': lambda: legacy_parse_csv(filepath, contains_header),
+        'c tokenizer': lambda: utils.parse_csv(filepath, contains_header, dtypes),
+        'c tokenizer (chunked)': lambda: sum(len(chunk) for chunk in
+                                             utils.iter_csv(filepath, contains_header, dtypes)),
+    }
+    results = {}
+    for name, parser in parsers.items():
+        best = None
+        rows = 0
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            parsed = parser()
+            elapsed = time.perf_counter() - start_time
+            rows = parsed if isinstance(parsed, int) else len(parsed)
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = rows / best
+        print("{}: {:.0f} rows/sec".format(name, results[name]))
+    return results
+
+
+# function to time clean_dataframe on the list columns and report the name cache hit rate
+def bench_clean_dataframe(filepath, columns, repeat=3):
+    """
+    :param filepath: location of csv data file
+    :param columns: list of stringified list-of-dict columns to clean
+    :param repeat: number of runs, the first run is the only one that fills the cache
+    :return: dictionary of the first and fastest repeated runtime and the name cache stats
+    """
+    raw = utils.parse_csv(filepath, True)
+    utils.extract_names.cache_clear()
+    runtimes = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        utils.clean_dataframe(raw, columns)
+        runtimes.append(time.perf_counter() - start_time)
+    stats = utils.name_cache_stats()
+    print("clean_dataframe: cold {:.3f}s, warm {:.3f}s, cache hit rate {:.1%}".format(
+        runtimes[0], min(runtimes[1:] or runtimes), stats['hit_rate']))
+    return {'cold': runtimes[0], 'warm': min(runtimes[1:] or runtimes), 'cache': stats}
+
+
+# function to compare startup with no snapshot against startup from an existing snapshot
+def bench_startup(directory=snapshot.snapshot_dir, repeat=3):
+    """
+    :param directory: location of snapshot directory, it is deleted before the cold run
+    :param repeat: number of warm runs, the fastest run is reported
+    :return: dictionary of cold and warm startup times in seconds
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+    start_time = time.perf_counter()
+    snapshot.load_dataset(directory)
+    cold = time.perf_counter() - start_time
+    warm = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        snapshot.load_dataset(directory)
+        elapsed = time.perf_counter() - start_time
+        warm = elapsed if warm is None else min(warm, elapsed)
+    print("startup: cold {:.3f}s, warm {:.3f}s".format(cold, warm))
+    return {'cold': cold, 'warm': warm}
+
+
+def latency_percentiles(function, queries, repeat=5):
+    """
+    :param function: function called with each query
+    :param queries: list of queries
+    :param repeat: number of times every query is run
+    :return: tuple of p50 and p99 latency in milliseconds
+    """
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            start_time = time.perf_counter()
+            function(query)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+    return np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+# search on a list column as it was before the inverted index, a frame of the lists checked cell by cell,
+# queries joined by '&&' or '||' are matched as one feature like they were then
+def legacy_list_search(dataframe, query, column):
+    """
+    :param dataframe: dataframe object to perform search on
+    :param query: feature to find
+    :param column: list-valued column
+    :return: dataframe of the rows listing the feature
+    """
+    series = dataframe[column].dropna()
+    return dataframe[pd.DataFrame(series.tolist()).isin([query]).any(axis=1).values]
+
+
+# function to compare search on list columns with and without the inverted index
+def bench_list_search(dataframe, column, queries, repeat=5):
+    """
+    :param dataframe: dataframe object to search
+    :param column: list-valued column to search
+    :param queries: list of query strings
+    :param repeat: number of times every query is run
+    :return: dictionary of (p50, p99) latency in milliseconds per path
+    """
+    list_indexes = indexes.build_inverted_indexes(dataframe, [column])
+    paths = {
+        'DataFrame isin scan': lambda query: legacy_list_search(dataframe, query, column),
+        'ListColumn scan': lambda query: utils.search(dataframe, query, [column]),
+        'inverted index': lambda query: utils.search(dataframe, query, [column], indexes=list_indexes),
+    }
+    results = {}
+    for name, path in paths.items():
+        results[name] = latency_percentiles(path, queries, repeat)
+        print("{} search on {}: p50 {:.2f}ms, p99 {:.2f}ms".format(name, column, *results[name]))
+    return results
+
+
+# function to compare search on text columns with and without the trigram index
+def bench_text_search(dataframe, column, queries, repeat=5):
+    """
+    :param dataframe: dataframe object to search
+    :param column: text column to search
+    :param queries: list of query strings
+    :param repeat: number of times every query is run
+    :return: dictionary of (p50, p99) latency in milliseconds per path
+    """
+    text_indexes = indexes.build_trigram_indexes(dataframe, [column])
+    paths = {
+        'full scan': lambda query: utils.search(dataframe, query, [column]),
+        'trigram index': lambda query: utils.search(dataframe, query, [column], indexes=text_indexes),
+        'trigram prefix': lambda query: text_indexes[column].search(query, prefix=True, case=False),
+        'trigram prefix, first 10': lambda query: text_indexes[column].search(query, prefix=True, case=False,
+                                                                               limit=10),
+    }
+    results = {}
+    for name, path in paths.items():
+        results[name] = latency_percentiles(path, queries, repeat)
+        print("{} search on {}: p50 {:.2f}ms, p99 {:.2f}ms".format(name, column, *results[name]))
+    return results
+
+
+# function to compare the slider range filter with and without the sorted index
+def bench_range_filter(dataframe, column, intervals, repeat=5):
+    """
+    :param dataframe: dataframe object to filter
+    :param column: numeric column to filter on
+    :param intervals: list of (low, high) ranges
+    :param repeat: number of times every range is run
+    :return: dictionary of (p50, p99) latency in milliseconds per path
+    """
+    sorted_index = indexes.SortedIndex.from_series(dataframe[column])
+    # bucket edges are every bound the intervals use, as the slider marks are in app.py
+    bucket_index = indexes.BucketIndex.from_series(dataframe[column], sorted({bound for interval in intervals
+                                                                              for bound in interval}))
+    paths = {
+        'boolean mask': lambda interval: dataframe[(dataframe[column] >= interval[0]) &
+                                                   (dataframe[column] <= interval[1])],
+        'sorted index': lambda interval: dataframe.loc[sorted_index.range(interval[0], interval[1])],
+        'bucket index': lambda interval: dataframe.loc[bucket_index.range(interval[0], interval[1])],
+    }
+    results = {}
+    for name, path in paths.items():
+        results[name] = latency_percentiles(path, intervals, repeat)
+        print("{} range on {}: p50 {:.2f}ms, p99 {:.2f}ms".format(name, column, *results[name]))
+    return results
+
+
+# search as it was before search_positions, growing the result one column at a time
+def legacy_search(dataframe, query, dropdown_vals):
+    """
+    :param dataframe: dataframe object to perform search on
+    :param query: query string to filter
+    :param dropdown_vals: list of column headers
+    :return: dataframe of query results, with a row repeated for every column it matched
+    """
+    result = pd.DataFrame()
+    for header in dropdown_vals:
+        series = dataframe[header].dropna()
+        if isinstance(series.iloc[0], list):
+            df_filtered = dataframe[pd.DataFrame(series.tolist()).isin([query]).any(axis=1).values]
+            result = pd.concat([result, df_filtered])
+        if isinstance(series.iloc[0], str) \
+                and not query.replace('.', '', 1).isdigit() \
+                and not series.iloc[0].replace('.', '', 1).isdigit():
+            df_filtered = dataframe[series.str.contains(query)]
+            result = pd.concat([result, df_filtered])
+        if isinstance(series.iloc[0], float) and query.replace('.', '', 1).isdigit():
+            bools = [float(query) == x if x is not None else False for x in dataframe[header]]
+            df_filtered = dataframe[bools]
+            result = pd.concat([result, df_filtered])
+    return result
+
+
+# function to compare result assembly when many columns are selected
+def bench_multi_column_search(dataframe, columns, queries, column_indexes=None, repeat=5):
+    """
+    :param dataframe: dataframe object to search
+    :param columns: list of selected columns, 5 or more to show the cost of repeated appends
+    :param queries: list of query strings
+    :param column_indexes: dictionary of column name to index, None to scan every column
+    :param repeat: number of times every query is run
+    :return: dictionary of (p50, p99) latency in milliseconds per path
+    """
+    paths = {
+        'append per column': lambda query: legacy_search(dataframe, query, columns),
+        'single take': lambda query: utils.search(dataframe, query, columns, indexes=column_indexes),
+        'single take, first page': lambda query: utils.search(dataframe, query, columns, indexes=column_indexes,
+                                                              limit=10),
+    }
+    results = {}
+    for name, path in paths.items():
+        results[name] = latency_percentiles(path, queries, repeat)
+        print("{} search on {} columns: p50 {:.2f}ms, p99 {:.2f}ms".format(name, len(columns), *results[name]))
+    return results
+
+
+# per genre dictionary update of an insert as it was before GenreAggregates
+def legacy_update_avgs_per_genre_insert(movie, revenue_per_genre, rating_per_genre, budget_per_genre):
+    """
+    :param movie: MovieRecord of the movie after an insert
+    :param revenue_per_genre: dictionary of the count and sum by genre for revenue
+    :param rating_per_genre: dictionary of the count and sum by genre for rating
+    :param budget_per_genre: dictionary of the count and sum by genre for budget
+    :return: dictionaries of the count and sum by genre for revenue, rating, and budget
+    """
+    genre_val = movie.genres
+    revenue_val = float(movie.revenue)
+    budget_val = float(movie.budget)
+    rating_val = float(movie.rating)
+    # for every genre, increment count and add value of newly added item to sum for revenue, rating, budget
+    for genre in genre_val:
+        # each dictionary registers a new genre on its own, they are not guaranteed to hold the same genres
+        for per_genre, value in [(revenue_per_genre, revenue_val), (rating_per_genre, rating_val),
+                                 (budget_per_genre, budget_val)]:
+            feature_sum, count = per_genre.get(genre, (0, 0))
+            per_genre[genre] = (feature_sum + value, count + 1)
+    return revenue_per_genre, rating_per_genre, budget_per_genre
+
+
+# per genre dictionary update of a delete as it was before GenreAggregates
+def legacy_update_avgs_per_genre_delete(movie, revenue_per_genre, rating_per_genre, budget_per_genre):
+    """
+    :param movie: MovieRecord of the removed movie
+    :param revenue_per_genre: dictionary of the count and sum by genre for revenue
+    :param rating_per_genre: dictionary of the count and sum by genre for rating
+    :param budget_per_genre: dictionary of the count and sum by genre for budget
+    :return: dictionaries of the updated count and sum by genre for revenue, rating, and budget after removing old data
+    """
+    genre_val = movie.genres
+    revenue_val = float(movie.revenue)
+    budget_val = float(movie.budget)
+    rating_val = float(movie.rating)
+    # for every genre, decrement count and the subtract value of old item from sum for revenue, rating, budget
+    for genre in genre_val:
+        for per_genre, value in [(revenue_per_genre, revenue_val), (rating_per_genre, rating_val),
+                                 (budget_per_genre, budget_val)]:
+            if genre in per_genre:
+                feature_sum, count = per_genre.get(genre)
+                if count <= 1:
+                    # the last movie of a genre is gone, so the genre is evicted instead of averaging 0 / 0
+                    del per_genre[genre]
+                else:
+                    per_genre[genre] = (feature_sum - value, count - 1)
+    return revenue_per_genre, rating_per_genre, budget_per_genre
+
+
+# function to compare insert/delete throughput of the per genre dictionaries and GenreAggregates
+def bench_genre_updates(dataframe, movies=1000):
+    """
+    :param dataframe: dataframe object returned by utils.load_data
+    :param movies: number of movies inserted then deleted on each path
+    :return: dictionary of updates per second per path
+    """
+    sample = dataframe.head(movies)
+    rows = [records.MovieRecord.from_row(row) for row in sample.to_dict('records')]
+    columns = ['revenue', 'rating', 'budget']
+    per_genre = [legacy_per_genre(dataframe, col) for col in columns]
+    aggregates = analysis.GenreAggregates.from_dataframe(dataframe, columns)
+    genre_lists, values = sample['genres'].tolist(), sample[columns].to_numpy()
+
+    def dictionaries():
+        for row in rows:
+            legacy_update_avgs_per_genre_insert(row, *per_genre)
+        for row in rows:
+            legacy_update_avgs_per_genre_delete(row, *per_genre)
+
+    def one_at_a_time():
+        for genres, movie in zip(genre_lists, values):
+            aggregates.insert(genres, movie)
+        for genres, movie in zip(genre_lists, values):
+            aggregates.delete(genres, movie)
+
+    def batch():
+        aggregates.insert_many(genre_lists, values)
+        aggregates.delete_many(genre_lists, values)
+
+    results = {}
+    for name, path in [('dict of tuples', dictionaries), ('GenreAggregates', one_at_a_time),
+                       ('GenreAggregates batch', batch)]:
+        start_time = time.perf_counter()
+        path()
+        results[name] = 2 * len(rows) / (time.perf_counter() - start_time)
+        print("{}: {:.0f} updates/sec".format(name, results[name]))
+    return results
+
+
+# the per genre full recompute as it was before calculate_per_genre, one movie and genre at a time
+def legacy_per_genre(dataframe, col):
+    """
+    :param dataframe: dataframe object to find sums and counts
+    :param col: column to sum
+    :return: dictionary of the sum and count per genre
+    """
+    per_genre = {}
+    for genres, feature in zip(dataframe['genres'], dataframe[col]):
+        try:
+            feature = float(feature)
+        except (ValueError, TypeError):
+            feature = 0
+        for genre in genres:
+            if genre in per_genre:
+                feature_sum, count = per_genre.get(genre)
+                per_genre[genre] = (feature_sum + feature, count + 1)
+            else:
+                per_genre[genre] = (feature, 1)
+    return per_genre
+
+
+# function to compare the three startup recomputes of the per genre sums against the single groupby
+def bench_genre_recompute(dataframe, repeat=3):
+    """
+    :param dataframe: dataframe object in load_data column order
+    :param repeat: number of runs per path, the fastest run is reported
+    :return: dictionary of runtime in seconds per path
+    """
+    columns = ['revenue', 'rating', 'budget']
+    paths = {
+        'loop per column': lambda: [legacy_per_genre(dataframe, col) for col in columns],
+        'one groupby': lambda: analysis.calculate_per_genre(dataframe, columns),
+        'GenreAggregates.from_dataframe': lambda: analysis.GenreAggregates.from_dataframe(dataframe, columns),
+    }
+    results = {}
+    for name, path in paths.items():
+        best = None
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            path()
+            elapsed = time.perf_counter() - start_time
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+        print("{}: {:.4f}s".format(name, best))
+    return results
+
+
+def compare_per_genre(aggregates, dataframe, columns):
+    """
+    :param aggregates: GenreAggregates kept up to date incrementally
+    :param dataframe: dataframe object the aggregates should describe
+    :param columns: list of aggregated columns
+    :return: list of the (column, genre) whose incremental sum or count differs from the full recompute
+    """
+    recomputed = analysis.calculate_per_genre(dataframe, columns)
+    mismatches = []
+    for col in columns:
+        incremental = aggregates.per_genre(col)
+        for genre in set(incremental) | set(recomputed[col]):
+            expected, actual = recomputed[col].get(genre), incremental.get(genre)
+            # sums that went through many subtractions only agree up to rounding
+            if expected is None or actual is None or expected[1] != actual[1] \
+                    or not np.isclose(expected[0], actual[0], rtol=1e-9, atol=1e-3):
+                mismatches.append((col, genre))
+    return mismatches
+
+
+# function to cross-check GenreAggregates after batches of deletes and inserts against calculate_per_genre
+def check_genre_aggregates(dataframe, movies=1000):
+    """
+    :param dataframe: dataframe object returned by utils.load_data
+    :param movies: number of movies deleted then inserted again
+    :return: list of the (column, genre) that differ after the deletes and after the inserts, empty if both agree
+    """
+    columns = ['revenue', 'rating', 'budget']
+    aggregates = analysis.GenreAggregates.from_dataframe(dataframe, columns)
+    sample = dataframe.head(movies)
+    aggregates.delete_many(sample['genres'].tolist(), sample[columns].to_numpy())
+    mismatches = compare_per_genre(aggregates, dataframe.iloc[movies:], columns)
+    aggregates.insert_many(sample['genres'].tolist(), sample[columns].to_numpy())
+    mismatches += compare_per_genre(aggregates, dataframe, columns)
+    print("incremental per genre sums and counts: {}".format(
+        "match the recompute" if not mismatches else "{} differ from the recompute".format(len(mismatches))))
+    return mismatches
+
+
+# calculate_pop_feature_count as it was before calculate_pop_feature_counts, one value_counts per column
+def legacy_pop_feature_count(df, feature_name):
+    """
+    :param df: dataframe object with list columns
+    :param feature_name: list column to count
+    :return: dictionary of feature to count, most common first
+    """
+    features = []
+    for i in df[feature_name]:
+        for j in i:
+            features.append(j)
+    pop_features = pd.DataFrame(columns=[feature_name])
+    pop_features[feature_name] = features
+    temp = pop_features.value_counts().rename_axis(feature_name).reset_index(name='count', drop=False)
+    return temp.set_index(feature_name).to_dict()['count']
+
+
+# function to profile the popularity counts built at startup
+def bench_feature_counts(dataframe, feature_names=('genres', 'keywords', 'production_companies'), repeat=3):
+    """
+    :param dataframe: dataframe object with list columns
+    :param feature_names: list columns counted at startup
+    :param repeat: number of runs per path, the fastest run is reported
+    :return: dictionary of runtime in seconds per path
+    """
+    feature_names = list(feature_names)
+    paths = {
+        'value_counts per column': lambda: [legacy_pop_feature_count(dataframe, name) for name in feature_names],
+        'single pass bincount': lambda: analysis.calculate_pop_feature_counts(dataframe, feature_names),
+    }
+    results = {}
+    for name, path in paths.items():
+        best = None
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            path()
+            elapsed = time.perf_counter() - start_time
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+        print("{} ({} columns): {:.4f}s".format(name, len(feature_names), best))
+    return results
+
+
+def bench_memory(dataframe, list_columns=('genres', 'keywords', 'production_companies', 'production_countries',
+                                          'spoken_languages')):
+    """
+    :param dataframe: dataframe object returned by utils.load_data
+    :param list_columns: list columns of the frame, stored in the CSR layout
+    :return: dataframe of bytes per column held by the pandas frame and taken by the same data as python lists
+    """
+    report = columns.memory_report(dataframe, list(list_columns))
+    print(report.to_string())
+    total = report.loc['total']
+    print("the frame takes {:.1f}MB, with python lists in the list columns it took {:.1f}MB".format(
+        total['frame bytes'] / 1e6, total['object bytes'] / 1e6))
+    return report
+
+
+def bench_batch_apply(batch_size=500):
+    """
+    :param batch_size: number of inserts in the batch
+    :return: tuple of runtime of applying the inserts one per apply() call, and as one batch
+    """
+    def fresh_store():
+        movies = store.MovieStore.from_dataset(snapshot.load_dataset())
+        movies.add_indexes('search', lambda metadata: indexes.build_inverted_indexes(metadata, ['genres', 'keywords']))
+        return movies
+
+    movies = fresh_store()
+    rows = movies.snapshot().metadata.head(batch_size).values.tolist()
+    start_time = time.time()
+    for row in rows:
+        movies.apply([{'op': 'insert', 'row': row}])
+    one_by_one = time.time() - start_time
+    movies = fresh_store()
+    start_time = time.time()
+    movies.apply([{'op': 'insert', 'row': row} for row in rows])
+    batched = time.time() - start_time
+    print("{} inserts one at a time: {:.4f}s".format(batch_size, one_by_one))
+    print("{} inserts in one batch: {:.4f}s".format(batch_size, batched))
+    return one_by_one, batched
+
+
+def check_snapshot(data):
+    """
+    :param data: snapshot read while writers are running
+    :return: list of the ways the snapshot is inconsistent, empty if it is consistent
+    """
+    problems = []
+    metadata = data.metadata
+    if not data.derived.index.equals(metadata.index):
+        problems.append('derived rows differ from metadata rows')
+    counts = collections.Counter(genre for genres in metadata['genres'] for genre in genres)
+    if dict(data.counters['genres'].counts) != dict(counts):
+        problems.append('genre counter differs from metadata')
+    genre_rows = data.index_group('search')['genres'].lookup('Drama')
+    drama = metadata['genres'].array.contains_any(['Drama'])
+    if not np.array_equal(genre_rows, np.sort(metadata.index[drama])):
+        problems.append('genre index differs from metadata')
+    if len(data.index_group('search')['budget'].values) != metadata['budget'].notna().sum():
+        problems.append('budget index differs from metadata')
+    return problems
+
+
+# stress test: readers search and check every snapshot they see while writers insert, edit and delete
+def bench_concurrency(seconds=5, readers=4, writers=2):
+    """
+    :param seconds: how long readers and writers run
+    :param readers: number of reader threads
+    :param writers: number of writer threads
+    :return: dictionary of reads, writes and inconsistent snapshots seen
+    """
+    movies = store.MovieStore.from_dataset(snapshot.load_dataset())
+    movies.add_indexes('search', lambda metadata: dict(
+        indexes.build_inverted_indexes(metadata, ['genres', 'keywords']),
+        **indexes.build_sorted_indexes(metadata, ['budget'])))
+    template = movies.snapshot().metadata.head(200).values.tolist()
+    stop = threading.Event()
+    results = {'reads': 0, 'writes': 0, 'inconsistent': 0, 'problems': collections.Counter()}
+    lock = threading.Lock()
+
+    def read():
+        while not stop.is_set():
+            data = movies.snapshot()
+            utils.search_positions(data.metadata, 'Drama', ['genres'], data.index_group('search'))
+            problems = check_snapshot(data)
+            with lock:
+                results['reads'] += 1
+                if problems:
+                    results['inconsistent'] += 1
+                    results['problems'].update(problems)
+
+    def write(seed):
+        generator = random.Random(seed)
+        while not stop.is_set():
+            row_ids = movies.snapshot().metadata.index
+            operation = generator.choice(['insert', 'edit', 'delete'])
+            if operation == 'insert':
+                movies.apply([{'op': 'insert', 'row': generator.choice(template)}])
+            elif operation == 'edit':
+                movies.apply([{'op': 'edit', 'id': generator.choice(row_ids), 'row': generator.choice(template)}])
+            else:
+                movies.apply([{'op': 'delete', 'id': generator.choice(row_ids)}])
+            with lock:
+                results['writes'] += 1
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    threads += [threading.Thread(target=write, args=(seed,)) for seed in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    problems = check_snapshot(movies.snapshot())
+    print("{} reads and {} writes in {}s, {} inconsistent snapshots, final snapshot {}".format(
+        results['reads'], results['writes'], seconds, results['inconsistent'],
+        'consistent' if not problems else problems))
+    return results
+
+
+def process_memory():
+    """
+    :return: dictionary of the resident kilobytes of the process backed by files (shared mmap pages) and private
+             to it (anonymous), read from /proc
+    """
+    memory = {}
+    with open('/proc/self/status') as file:
+        for line in file:
+            if line.startswith(('RssFile:', 'RssAnon:')):
+                name, value = line.split(':')
+                memory[name] = int(value.split()[0])
+    return memory
+
+
+def is_mapped(array):
+    """
+    :param array: numpy array
+    :return: flag for whether the array is a view of a memory-mapped file
+    """
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+
+def run_worker(log_path, seed, writes, barrier, results):
+    """
+    :param log_path: location of the mutation log shared by the workers
+    :param seed: seed of the random changes the worker makes
+    :param writes: number of changes the worker makes
+    :param barrier: multiprocessing.Barrier every worker waits at before the final catch up
+    :param results: multiprocessing queue the worker puts its final state, memory and whether its base frames are
+                    still mapped in
+    """
+    movies = store.MovieStore.from_dataset(snapshot.load_dataset())
+    movies.add_indexes('search', lambda metadata: indexes.build_inverted_indexes(metadata, ['genres']))
+    log = broadcast.MutationLog(log_path)
+    follower = broadcast.LogFollower(log, interval=0.05)
+    _, offset = broadcast.replay(movies, log)
+    follower.attach(movies, offset)
+    template = movies.snapshot().metadata.head(100).values.tolist()
+    generator = random.Random(seed)
+    for _ in range(writes):
+        row_ids = movies.snapshot().metadata.index
+        operation = generator.choice(['insert', 'edit', 'delete'])
+        if operation == 'insert':
+            follower.apply([{'op': 'insert', 'row': generator.choice(template)}])
+        elif operation == 'edit':
+            follower.apply([{'op': 'edit', 'id': generator.choice(row_ids), 'row': generator.choice(template)}])
+        else:
+            follower.apply([{'op': 'delete', 'id': generator.choice(row_ids)}])
+    barrier.wait()
+    follower.stop()
+    follower.catch_up()
+    data = movies.snapshot()
+    metadata = data.metadata
+    state = (tuple(metadata.index), tuple(metadata['original_title'].fillna('')),
+             tuple(sorted(data.counters['genres'].counts.items())))
+    # the changes are kept next to the base frames, whose columns must still be the mapped snapshot files
+    base = data.metadata_rows.base
+    mapped = all(is_mapped(base[column].to_numpy()) for column in ['budget', 'rating', 'release_date']) \
+        and is_mapped(base['genres'].array.codes) and is_mapped(data.derived_rows.base['num_genres'].to_numpy())
+    results.put((seed, hash(state), process_memory(), mapped))
+
+
+# several processes attach to the same snapshot files and make changes through one mutation log
+def bench_workers(workers=3, writes=30, log_path="../data/bench_mutations"):
+    """
+    :param workers: number of worker processes
+    :param writes: number of changes made by every worker
+    :param log_path: location of the mutation log directory, removed before and after the run
+    :return: list of (seed, state hash, memory, base frames mapped) per worker, every state hash is the same if the
+             workers agree
+    """
+    # the snapshot is built once up front, like a loader process would before starting the workers
+    snapshot.load_dataset()
+    shutil.rmtree(log_path, ignore_errors=True)
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=run_worker, args=(log_path, seed, writes, barrier, results))
+                 for seed in range(workers)]
+    start_time = time.time()
+    for process in processes:
+        process.start()
+    outcome = sorted(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    shutil.rmtree(log_path)
+    for seed, state, memory, mapped in outcome:
+        print("worker {}: {} kB shared file pages, {} kB private, base columns {}".format(
+            seed, memory.get('RssFile'), memory.get('RssAnon'), 'still mapped' if mapped else 'copied'))
+    print("{} workers made {} changes each in {:.4f}s, final states {}".format(
+        workers, writes, time.time() - start_time,
+        'agree' if len({state for _, state, _, _ in outcome}) == 1 else 'differ'))
+    return outcome
+
+
+def bench_log_overhead(mutations=200, writers=(1, 4), log_path="../data/bench_mutations"):
+    """
+    :param mutations: number of single movie edits per run
+    :param writers: numbers of threads making the edits, more threads share more fsyncs
+    :param log_path: location of the mutation log directory, removed before and after every run
+    :return: dictionary of threads to tuple of mean edit latency without and with the log
+    """
+    movies = store.MovieStore.from_dataset(snapshot.load_dataset())
+    row_ids = movies.snapshot().metadata.index[:mutations]
+    template = movies.snapshot().metadata.head(mutations).values.tolist()
+    results = {}
+    for threads in writers:
+        shutil.rmtree(log_path, ignore_errors=True)
+        log = broadcast.MutationLog(log_path)
+        follower = broadcast.LogFollower(log)
+        follower.attach(movies, log.end())
+        latencies = {}
+        for name, apply in [('store', movies.apply), ('log', follower.apply)]:
+            timings = []
+
+            def edit(part):
+                for row_id, row in list(zip(row_ids, template))[part::threads]:
+                    start_time = time.time()
+                    apply([{'op': 'edit', 'id': row_id, 'row': records.MovieRecord.from_inputs(row)}])
+                    timings.append(time.time() - start_time)
+
+            workers = [threading.Thread(target=edit, args=(part,)) for part in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            latencies[name] = np.mean(timings)
+        follower.stop()
+        print("{} edits from {} threads: {:.6f}s each without log, {:.6f}s with log, {} fsyncs".format(
+            mutations, threads, latencies['store'], latencies['log'], log.syncs))
+        results[threads] = (latencies['store'], latencies['log'])
+    shutil.rmtree(log_path)
+    return results
+
+
+def bench_recovery(lengths=(0, 100, 1000, 5000), log_path="../data/bench_mutations",
+                   backup_path="../data/bench_backup"):
+    """
+    :param lengths: numbers of logged batches to recover from
+    :param log_path: location of the mutation log directory, removed before and after every run
+    :param backup_path: location of the backup directory, removed after the run
+    :return: dictionary of log length to tuple of recovery time from the csv snapshot and from a backup
+    """
+    dataset = snapshot.load_dataset()
+    template = dataset['metadata'].head(100).values.tolist()
+    row_ids = dataset['metadata'].index
+    results = {}
+    for length in lengths:
+        shutil.rmtree(log_path, ignore_errors=True)
+        shutil.rmtree(backup_path, ignore_errors=True)
+        log = broadcast.MutationLog(log_path)
+        generator = random.Random(length)
+        for i in range(length):
+            if i % 3 == 0:
+                log.append([{'op': 'insert', 'row': generator.choice(template)}])
+            else:
+                log.append([{'op': 'edit', 'id': generator.choice(row_ids), 'row': generator.choice(template)}])
+        # replaying the whole log on top of the csv snapshot
+        start_time = time.time()
+        movies = store.MovieStore.from_dataset(snapshot.load_dataset())
+        broadcast.replay(movies, log)
+        from_log = time.time() - start_time
+        # compacting it into a backup, after which only the tail written since has to be replayed
+        snapshot.write_backup(movies.snapshot(), log.end(), directory=backup_path)
+        log.compact(log.end())
+        start_time = time.time()
+        backup, offset = snapshot.load_backup(directory=backup_path)
+        recovered = store.MovieStore.from_dataset(backup)
+        broadcast.replay(recovered, log, offset)
+        from_backup = time.time() - start_time
+        same = recovered.snapshot().metadata.equals(movies.snapshot().metadata)
+        print("recovery with {} logged batches: {:.4f}s replaying the log, {:.4f}s from a backup ({})".format(
+            length, from_log, from_backup, 'same movies' if same else 'movies differ'))
+        results[length] = (from_log, from_backup)
+    shutil.rmtree(log_path)
+    shutil.rmtree(backup_path)
+    os.remove(backup_path + '.lock')
+    return results
+
+
+if __name__ == '__main__':
+    bench_parse_csv("../data/movies_metadata.csv", dtypes=utils.metadata_dtypes)
+    bench_parse_csv("../data/keywords.csv", dtypes=utils.keywords_dtypes)
+    bench_clean_dataframe("../data/movies_metadata.csv",
+                          ['genres', 'production_companies', 'production_countries', 'spoken_languages'])
+    bench_startup()
+    metadata = snapshot.load_dataset()['metadata']
+    bench_list_search(metadata, 'genres', ['Action', 'Drama', 'Comedy && Romance', 'Horror || Thriller'])
+    bench_list_search(metadata, 'keywords', ['woman director', 'independent film', 'murder && revenge'])
+    bench_text_search(metadata, 'overview', ['love', 'detective', 'New York', 'world war'])
+    bench_text_search(metadata, 'original_title', ['The', 'Star', 'Harry Potter'])
+    bench_range_filter(metadata, 'budget', [(0, 50000000), (100000000, 200000000), (0, 400000000)])
+    bench_multi_column_search(metadata, ['original_title', 'overview', 'tagline', 'genres', 'keywords',
+                                         'production_companies'], ['love', 'war', 'Drama', 'Warner Bros.'])
+    bench_genre_updates(metadata)
+    bench_genre_recompute(metadata)
+    check_genre_aggregates(metadata)
+    bench_feature_counts(metadata)
+    bench_feature_counts(metadata, ('genres', 'keywords', 'production_companies', 'production_countries',
+                                    'spoken_languages'))
+    bench_memory(metadata)
+    bench_batch_apply()
+    bench_concurrency()
+    bench_workers()
+    bench_log_overhead()
+    bench_recovery()
@@ -0,0 +1,431 @@
+import src.records as records
+import src.store as store
+import bisect
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import uuid
+
+
+def as_row_id(value):
+    """
+    :param value: id of an edited or deleted row, as given in a batch
+    :return: value as an int
+    """
+    if value is None or isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError("row id {!r} is not an integer".format(value))
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError("row id {!r} is not an integer".format(value))
+
+
+def as_record(row):
+    """
+    :param row: row of an inserted or edited movie, as given in a batch
+    :return: row as a MovieRecord
+    """
+    if isinstance(row, records.MovieRecord):
+        return row
+    if isinstance(row, dict) or (isinstance(row, (list, tuple)) and len(row) == len(records.columns)):
+        return records.MovieRecord.from_inputs(row)
+    raise ValueError("row must be a dictionary or a list of {} values, got {!r}".format(len(records.columns), row))
+
+
+def normalize_batch(batch):
+    """
+    :param batch: list of operations, in the format of store.MovieSnapshot.apply
+    :return: list of the operations with ids as ints and rows as MovieRecord, raises ValueError for any operation
+             MovieSnapshot.apply can't run
+    """
+    # checked before anything is logged, one logged batch that can't be applied would stop every worker
+    if not isinstance(batch, list):
+        raise ValueError("a batch is a list of operations, got {!r}".format(batch))
+    operations = []
+    for operation in batch:
+        if not isinstance(operation, dict) or operation.get('op') not in ('insert', 'edit', 'delete'):
+            raise ValueError("operation {!r} needs an 'op' of insert, edit or delete".format(operation))
+        normalized = {'op': operation['op']}
+        if operation['op'] != 'insert':
+            normalized['id'] = as_row_id(operation.get('id'))
+        if operation['op'] != 'delete':
+            normalized['row'] = as_record(operation.get('row'))
+        operations.append(normalized)
+    return operations
+
+
+def encode_batch(batch, token=None):
+    """
+    :param batch: list of operations, in the format of store.MovieSnapshot.apply
+    :param token: string the writer recognizes its own batch by when it reads the log back
+    :return: one line of json, rows written as the form strings of MovieRecord.to_inputs
+    """
+    operations = normalize_batch(batch)
+    for operation in operations:
+        if 'row' in operation:
+            operation['row'] = operation['row'].to_inputs()
+    return json.dumps({'token': token, 'batch': operations}) + '\n'
+
+
+def decode_batch(line):
+    """
+    :param line: line written by encode_batch
+    :return: tuple of the token and the list of operations for store.MovieStore.apply
+    """
+    entry = json.loads(line)
+    return entry['token'], normalize_batch(entry['batch'])
+
+
+# append-only log of batches shared by every worker process, the order of its lines is the one order all workers
+# apply the batches in. It is split into segment files named after the offset of their first byte, so offsets stay
+# valid when segments already saved in a backup are removed by compact
+class MutationLog:
+    def __init__(self, directory):
+        """
+        :param directory: location of the directory holding the segment files, created if it is missing
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # per segment, the end of the last line written by this process and the end its last fsync covered
+        self.written = {}
+        self.synced = {}
+        self.syncs = 0
+        # sync_lock is held through an fsync, state_lock only around the two dictionaries, so lines can still be
+        # written while an fsync runs
+        self.sync_lock = threading.Lock()
+        self.state_lock = threading.Lock()
+
+    def segment_path(self, start):
+        return os.path.join(self.directory, '{:020d}.log'.format(start))
+
+    def segments(self):
+        """
+        :return: sorted list of the start offsets of the segments
+        """
+        return sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.log'))
+
+    @contextlib.contextmanager
+    def locked(self):
+        # one lock file for appends and compaction, held across processes
+        with open(os.path.join(self.directory, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def start(self):
+        """
+        :return: offset of the first line still in the log, above 0 once compact has removed segments
+        """
+        starts = self.segments()
+        return starts[0] if starts else 0
+
+    def end(self):
+        """
+        :return: offset right after the last line of the log
+        """
+        starts = self.segments()
+        if not starts:
+            return 0
+        return starts[-1] + os.path.getsize(self.segment_path(starts[-1]))
+
+    def append(self, batch, token=None):
+        """
+        :param batch: list of operations, in the format of store.MovieSnapshot.apply
+        :param token: string stored with the batch, see encode_batch
+        :return: offset of the line the batch was written to, once the line is on disk
+        """
+        line = encode_batch(batch, token).encode()
+        with self.locked():
+            starts = self.segments() or [0]
+            path = self.segment_path(starts[-1])
+            file = open(path, 'a+b')
+            size = file.seek(0, os.SEEK_END)
+            if size and not self.ends_with_newline(file, size):
+                # a writer killed halfway through a line left it torn, it was never acknowledged so it is dropped
+                file.seek(0)
+                size = file.read().rfind(b'\n') + 1
+                file.truncate(size)
+            offset = starts[-1] + size
+            file.write(line)
+            file.flush()
+            with self.state_lock:
+                self.written[path] = max(self.written.get(path, 0), offset + len(line))
+        with file:
+            self.sync(file, path, offset + len(line))
+        return offset
+
+    @staticmethod
+    def ends_with_newline(file, size):
+        file.seek(size - 1)
+        return file.read(1) == b'\n'
+
+    def sync(self, file, path, end):
+        """
+        :param file: open segment file a line was just written to
+        :param path: location of the segment file
+        :param end: offset right after the line
+        """
+        # writers queue up here while one fsync runs, the next fsync then covers every line written meanwhile,
+        # so a burst of mutations costs a few fsyncs instead of one each
+        with self.sync_lock:
+            with self.state_lock:
+                if self.synced.get(path, 0) >= end:
+                    return
+                target = self.written[path]
+            os.fsync(file.fileno())
+            with self.state_lock:
+                self.synced[path] = target
+                self.syncs += 1
+
+    def read(self, offset):
+        """
+        :param offset: position to read from, 0 for the start of the log
+        :return: tuple of the list of (offset, line) of every complete line after offset and the offset to read from
+                 next time
+        """
+        starts = self.segments()
+        if not starts:
+            return [], offset
+        if offset < starts[0]:
+            raise ValueError("mutation log before offset {} was compacted into a backup".format(starts[0]))
+        first = bisect.bisect_right(starts, offset) - 1
+        entries = []
+        for start in starts[first:]:
+            offset = max(offset, start)
+            try:
+                with open(self.segment_path(start), 'rb') as file:
+                    file.seek(offset - start)
+                    data = file.read()
+            except FileNotFoundError:
+                raise ValueError("mutation log segment at offset {} was compacted while being read".format(start))
+            # a line still being written has no newline yet and is left for the next read
+            for line in data.splitlines(keepends=True):
+                if not line.endswith(b'\n'):
+                    break
+                entries.append((offset, line))
+                offset += len(line)
+        return entries, offset
+
+    def worker_path(self, pid):
+        return os.path.join(self.directory, 'workers', str(pid))
+
+    def register(self, offset):
+        """
+        :param offset: position in the log this process has read up to, compact keeps every line after it
+        """
+        path = self.worker_path(os.getpid())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as file:
+            file.write(str(offset))
+        os.replace(path + '.tmp', path)
+
+    def unregister(self):
+        try:
+            os.remove(self.worker_path(os.getpid()))
+        except FileNotFoundError:
+            pass
+
+    def consumed(self):
+        """
+        :return: smallest offset registered by a running process, None if no process is registered
+        """
+        directory = os.path.dirname(self.worker_path(0))
+        if not os.path.isdir(directory):
+            return None
+        offsets = []
+        for name in os.listdir(directory):
+            if not name.isdigit():
+                continue
+            try:
+                os.kill(int(name), 0)
+            except ProcessLookupError:
+                # the worker exited without unregistering, its offset holds nothing back anymore
+                os.remove(os.path.join(directory, name))
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(os.path.join(directory, name)) as file:
+                    offsets.append(int(file.read()))
+            except (OSError, ValueError):
+                continue
+        return min(offsets) if offsets else None
+
+    def compact(self, offset):
+        """
+        :param offset: position in the log a backup is up to date with
+        :return: number of segments removed, every one of them ends before offset and before the offset of every
+                 running worker
+        """
+        with self.locked():
+            # a worker still replaying an older part of the log keeps it
+            consumed = self.consumed()
+            if consumed is not None:
+                offset = min(offset, consumed)
+            starts = self.segments()
+            if not starts:
+                return 0
+            # later appends go to a new segment, so the current one can be removed once a backup covers it
+            end = starts[-1] + os.path.getsize(self.segment_path(starts[-1]))
+            if end > starts[-1]:
+                open(self.segment_path(end), 'ab').close()
+                starts.append(end)
+            removed = 0
+            for start, next_start in zip(starts, starts[1:]):
+                if next_start <= offset:
+                    os.remove(self.segment_path(start))
+                    removed += 1
+            return removed
+
+
+def replay(movies, log, offset=0, end=None):
+    """
+    :param movies: store.MovieStore the logged batches are applied to
+    :param log: MutationLog to read
+    :param offset: position in the log the store is already up to date with
+    :param end: position of a line in the log to stop before, None to read to the end of the log
+    :return: tuple of the dictionary of the token of every replayed batch to its result, {'error': message} for batches
+             that were skipped, and the offset the store is now at
+    """
+    lines, offset = log.read(offset)
+    if end is not None and end < offset:
+        lines = [(entry_offset, line) for entry_offset, line in lines if entry_offset < end]
+        offset = end
+    entries = []
+    for entry_offset, line in lines:
+        try:
+            token, batch = decode_batch(line)
+        except (ValueError, KeyError, TypeError) as error:
+            # every worker reads the same line and skips it the same way
+            print("Skipped mutation log entry at offset {}: {}".format(entry_offset, error))
+            continue
+        entries.append((entry_offset, token, batch))
+    if not entries:
+        return {}, offset
+    try:
+        # every batch goes into one copy of the snapshot, so a long log tail is published once
+        results = movies.write(lambda snapshot: [snapshot.apply(batch) for _, _, batch in entries])
+    except Exception:
+        # a failed copy is never published, the batches are applied again one copy each and the failing ones skipped
+        results = []
+        for entry_offset, token, batch in entries:
+            try:
+                results.append(movies.apply(batch))
+            except Exception as error:
+                print("Skipped mutation log entry at offset {}: {!r}".format(entry_offset, error))
+                results.append({'error': repr(error)})
+    return {token: result for (_, token, _), result in zip(entries, results)}, offset
+
+
+# keeps the store of one worker in step with the shared log, local changes are appended to the log and applied
+# when the log reaches them, in the same order as on every other worker
+class LogFollower:
+    def __init__(self, log, interval=0.2, on_behind=None):
+        """
+        :param log: MutationLog shared by the workers
+        :param interval: number of seconds between two polls of the log for batches of other workers
+        :param on_behind: function called when the lines after the store's offset were compacted away, i.e. to load
+                          the backup that holds them
+        """
+        self.log = log
+        self.interval = interval
+        self.on_behind = on_behind
+        self.error = None
+        self.movies = None
+        self.offset = 0
+        # results of batches appended by this worker by token, None until the log has been replayed up to them
+        self.own = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def attach(self, movies, offset, replayed=None):
+        """
+        :param movies: store.MovieStore to keep in step, replacing the previous one
+        :param offset: position in the log the store is already up to date with (i.e. returned by replay)
+        :param replayed: dictionary of token to result returned by the replay that brought movies up to offset
+        """
+        with self.lock:
+            self.movies = movies
+            self.offset = offset
+            # a reload may have replayed a batch of this worker that the previous store never reached
+            for token, result in (replayed or {}).items():
+                if token in self.own:
+                    self.own[token] = result
+            self.log.register(offset)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='mutation-log-follower', daemon=True)
+                self.thread.start()
+
+    def checkpoint(self):
+        """
+        :return: tuple of the current snapshot and the log offset it is up to date with
+        """
+        with self.lock:
+            return self.movies.snapshot(), self.offset
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.catch_up()
+                self.error = None
+            except Exception as error:
+                # the thread keeps polling, a failed read is retried on the next poll
+                self.error = repr(error)
+                print("Mutation log follower: {}".format(self.error))
+                if self.on_behind is not None and self.offset < self.log.start():
+                    self.on_behind()
+
+    def stop(self):
+        self.stopped.set()
+        self.log.unregister()
+
+    def catch_up(self, token=None):
+        """
+        :param token: token of a batch of this worker, nothing is read if an earlier catch up already applied it
+        """
+        with self.lock:
+            if self.movies is None or self.own.get(token) is not None:
+                return
+            results, offset = replay(self.movies, self.log, self.offset)
+            if offset != self.offset:
+                self.offset = offset
+                self.log.register(offset)
+            for token, result in results.items():
+                if token in self.own:
+                    self.own[token] = result
+
+    def apply(self, batch):
+        """
+        :param batch: list of operations, in the format of store.MovieSnapshot.apply
+        :return: dictionary of the inserted, edited and deleted row ids, once the change is on disk and visible
+                 to readers, raises ValueError for a batch that can't be applied
+        """
+        batch = normalize_batch(batch)
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.own[token] = None
+        # appends from several threads run side by side, so their fsyncs can be shared
+        entry_offset = self.log.append(batch, token)
+        # batches logged before this one by other workers are applied first, a catch up of another thread may
+        # already have applied this one along with its own
+        self.catch_up(token)
+        with self.lock:
+            result = self.own.pop(token)
+            if result is None and self.offset > entry_offset:
+                # the store was swapped for one loaded from a backup that already holds the batch, its ids are
+                # not known here
+                result = {'inserted': [], 'edited': [], 'deleted': []}
+        if result is None or 'error' in result:
+            raise ValueError("batch could not be applied: {}".format(result and result['error']))
+        return result
+
+    def load_drop(self, filepath):
+        """
+        :param filepath: location of a data drop csv in the format read by store.read_batch
+        :return: dictionary of the inserted, edited and deleted row ids
+        """
+        # logged like every other change, so the drop reaches every worker and survives a restart
+        with open(filepath) as file:
+            return self.apply(store.read_batch(file.read()))
@@ -0,0 +1,53 @@
+import collections
+import threading
+
+
+# least recently used cache of built figures, keyed by (page, parameters, load generation, dataset version)
+class FigureCache:
+    def __init__(self, maxsize=64):
+        """
+        :param maxsize: number of figures kept before the least recently used one is evicted
+        """
+        self.maxsize = maxsize
+        self.figures = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # flask serves requests on several threads, every access to figures and the counters goes through the lock
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        """
+        :param key: hashable key that changes whenever the figure would change
+        :param build: function returning the serialized figure, only called on a miss
+        :return: serialized figure for key
+        """
+        with self.lock:
+            figure = self.figures.get(key)
+            if figure is not None:
+                self.hits += 1
+                self.figures.move_to_end(key)
+                return figure
+            self.misses += 1
+        # built outside the lock so a slow figure doesn't hold up hits on other pages
+        figure = build()
+        with self.lock:
+            self.figures[key] = figure
+            self.figures.move_to_end(key)
+            if len(self.figures) > self.maxsize:
+                self.figures.popitem(last=False)
+        return figure
+
+    def clear(self):
+        with self.lock:
+            self.figures.clear()
+
+    def stats(self):
+        """
+        :return: dictionary of hits, misses, size and hit rate of the cache
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self.figures),
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
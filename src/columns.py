@@ -0,0 +1,296 @@
+import itertools
+import sys
+import numpy as np
+import pandas as pd
+
+
+# dtype of the list columns of the movie table, whose cells read as python lists of strings
+@pd.api.extensions.register_extension_dtype
+class ListDtype(pd.api.extensions.ExtensionDtype):
+    name = 'list'
+    type = list
+    kind = 'O'
+    na_value = np.nan
+
+    @classmethod
+    def construct_array_type(cls):
+        return ListColumn
+
+
+# list-valued column as one flat array of category codes plus row offsets (CSR layout),
+# the features of row i are categories[codes[offsets[i]:offsets[i + 1]]].
+# it is the storage of the list columns of the movie table: cells read as python lists, so the table, the edit forms
+# and MovieRecord see lists, while the vectorized passes (explode_genres, InvertedIndex.from_series, the popularity
+# counts, the list filters) run on the codes. The arrays are never written to, so they can be memory-mapped from a
+# snapshot, and a missing cell is an empty list
+class ListColumn(pd.api.extensions.ExtensionArray):
+    def __init__(self, categories, codes, offsets):
+        """
+        :param categories: object array of the distinct features
+        :param codes: int32 array of the position in categories of every listed feature, row after row
+        :param offsets: int64 array of where each row starts in codes, from 0 with one extra entry for the end
+        """
+        self.categories = categories
+        self.codes = codes
+        self.offsets = offsets
+        # index of the categories, built by the first concat that maps features into them
+        self.lookup = None
+
+    @classmethod
+    def from_lists(cls, lists):
+        """
+        :param lists: iterable of the lists (or tuples) of features of every row, other cells are empty rows
+        :return: list column holding the same features, categories in order of first appearance
+        """
+        lists = [value if isinstance(value, (list, tuple)) else () for value in lists]
+        lengths = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        codes, categories = pd.factorize(pd.Series(list(itertools.chain.from_iterable(lists)), dtype=object))
+        return cls(np.asarray(categories, dtype=object), codes.astype(np.int32), offsets)
+
+    @classmethod
+    def from_series(cls, series):
+        """
+        :param series: list-valued column, stored as a ListColumn or as python lists
+        :return: the list column behind the series, built from its cells if it has none
+        """
+        if isinstance(series.array, cls):
+            return series.array
+        return cls.from_lists(series)
+
+    # pandas extension array interface, what the frame needs to slice, take, concat and compare the column
+
+    @classmethod
+    def _from_sequence(cls, scalars, *, dtype=None, copy=False):
+        if isinstance(scalars, cls):
+            return scalars.copy() if copy else scalars
+        return cls.from_lists(scalars)
+
+    @classmethod
+    def _from_factorized(cls, values, original):
+        return cls.from_lists(values)
+
+    @classmethod
+    def _concat_same_type(cls, to_concat):
+        to_concat = list(to_concat)
+        lengths = np.concatenate([part.lengths() for part in to_concat])
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        largest = max(to_concat, key=lambda part: len(part.categories))
+        if all(part.categories is largest.categories for part in to_concat):
+            # parts taken from the same column keep their codes
+            return cls(largest.categories, np.concatenate([part.codes for part in to_concat]), offsets)
+        # otherwise the features the largest part lacks go after its categories, and the codes of the other parts are
+        # mapped into them (i.e. the few changed rows of store.FrameOverlay next to the whole column)
+        if largest.lookup is None:
+            largest.lookup = pd.Index(largest.categories, dtype=object)
+        others = [part for part in to_concat if part.categories is not largest.categories]
+        features = pd.Index(pd.unique(np.concatenate([part.categories for part in others])), dtype=object)
+        extra = features[largest.lookup.get_indexer(features) < 0]
+        categories = np.concatenate([largest.categories, extra.to_numpy(dtype=object)]) if len(extra) \
+            else largest.categories
+        codes = []
+        for part in to_concat:
+            if part.categories is largest.categories:
+                codes.append(part.codes)
+                continue
+            mapping = largest.lookup.get_indexer(part.categories)
+            missing = mapping < 0
+            mapping[missing] = len(largest.categories) + extra.get_indexer(part.categories[missing])
+            codes.append(mapping.astype(np.int32)[part.codes])
+        return cls(categories, np.concatenate(codes), offsets)
+
+    @property
+    def dtype(self):
+        return ListDtype()
+
+    @property
+    def nbytes(self):
+        # the distinct feature strings are counted once each, like the arrays
+        strings = sum(sys.getsizeof(category) for category in self.categories)
+        return self.codes.nbytes + self.offsets.nbytes + self.categories.nbytes + strings
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, item):
+        if pd.api.types.is_integer(item):
+            return self.row(item + len(self) if item < 0 else item)
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                return self.take(np.arange(start, stop, step))
+            stop = max(start, stop)
+            if start == 0:
+                # a leading slice is a view of both arrays
+                return ListColumn(self.categories, self.codes[: self.offsets[stop]], self.offsets[: stop + 1])
+            offsets = self.offsets[start: stop + 1]
+            return ListColumn(self.categories, self.codes[offsets[0]: offsets[-1]], offsets - offsets[0])
+        item = pd.api.indexers.check_array_indexer(self, item)
+        if item.dtype == bool:
+            item = np.flatnonzero(item)
+        return self.take(item)
+
+    def __iter__(self):
+        # the features are converted to python strings once, rows are slices of that list
+        features = self.values().tolist()
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield features[start: end]
+
+    def __array__(self, dtype=None, copy=None):
+        array = np.empty(len(self), dtype=object)
+        for i, row in enumerate(self):
+            array[i] = row
+        return array if dtype is None else array.astype(dtype)
+
+    def __eq__(self, other):
+        """
+        :param other: list column of the same length, or a list compared with every row
+        :return: boolean array of the rows holding the same features in the same order
+        """
+        if isinstance(other, ListColumn):
+            return np.array([mine == theirs for mine, theirs in zip(self, other)], dtype=bool)
+        return np.array([row == other for row in self], dtype=bool)
+
+    def isna(self):
+        return np.zeros(len(self), dtype=bool)
+
+    def take(self, indices, allow_fill=False, fill_value=None):
+        """
+        :param indices: array of row positions, with allow_fill -1 is an empty row, otherwise it counts from the end
+        :param allow_fill: flag for whether -1 marks a missing row
+        :param fill_value: ignored, missing rows are empty lists
+        :return: list column of the rows at indices, sharing the categories
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if allow_fill:
+            if (indices < -1).any():
+                raise ValueError("invalid row position {} to take".format(indices.min()))
+            missing = indices == -1
+        else:
+            indices = np.where(indices < 0, indices + len(self), indices)
+            missing = None
+        if len(indices) and (indices.max() >= len(self) or (missing is None and indices.min() < 0)):
+            raise IndexError("row position out of bounds for a list column of {} rows".format(len(self)))
+        starts = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - starts
+        if missing is not None:
+            lengths[missing] = 0
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # position in codes of every taken feature, row after row
+        entries = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return ListColumn(self.categories, self.codes[entries], offsets)
+
+    def copy(self):
+        return ListColumn(self.categories.copy(), self.codes.copy(), self.offsets.copy())
+
+    def view(self, dtype=None):
+        return ListColumn(self.categories, self.codes, self.offsets)
+
+    def astype(self, dtype, copy=True):
+        if isinstance(pd.api.types.pandas_dtype(dtype), ListDtype):
+            return self.copy() if copy else self
+        return super().astype(dtype, copy=copy)
+
+    def _values_for_factorize(self):
+        # rows as tuples, so equal lists factorize, group and sort together
+        values = np.empty(len(self), dtype=object)
+        for i, row in enumerate(self):
+            values[i] = tuple(row)
+        return values, np.nan
+
+    def _values_for_argsort(self):
+        return self._values_for_factorize()[0]
+
+    def _explode(self):
+        """
+        :return: tuple of the array of every listed feature, with NaN for an empty row, and the values per row
+        """
+        lengths = self.lengths()
+        counts = np.maximum(lengths, 1)
+        values = np.full(counts.sum(), np.nan, dtype=object)
+        values[np.repeat(lengths > 0, counts)] = self.values()
+        return values, counts
+
+    # vectorized reads of the layout
+
+    def lengths(self):
+        """
+        :return: array of the number of features in every row
+        """
+        return np.diff(self.offsets)
+
+    def positions(self):
+        """
+        :return: array of the row position of every entry in codes
+        """
+        return np.repeat(np.arange(len(self)), self.lengths())
+
+    def values(self):
+        """
+        :return: array of every listed feature, row after row
+        """
+        return self.categories[self.codes]
+
+    def row(self, position):
+        """
+        :param position: row position
+        :return: list of the features of the row
+        """
+        return self.categories[self.codes[self.offsets[position]: self.offsets[position + 1]]].tolist()
+
+    def contains_any(self, features):
+        """
+        :param features: iterable of features
+        :return: boolean array of the rows listing at least one of the features
+        """
+        wanted = np.flatnonzero(pd.Series(self.categories, dtype=object).isin(list(features)).to_numpy())
+        listed = np.isin(self.codes, wanted)
+        return np.bincount(self.positions()[listed], minlength=len(self)) > 0
+
+    def search(self, query):
+        """
+        :param query: single feature, or features joined by '&&' (all must match) or '||' (any may match)
+        :return: boolean array of the rows matching the query, as indexes.InvertedIndex.search matches it
+        """
+        features, match_all = split_list_query(query)
+        if not match_all:
+            return self.contains_any(features)
+        return np.logical_and.reduce([self.contains_any([feature]) for feature in features])
+
+
+def split_list_query(query):
+    """
+    :param query: single feature, or features joined by '&&' (all must match) or '||' (any may match)
+    :return: tuple of the list of features and the flag for whether all of them must match
+    """
+    if '&&' in query:
+        return [feature.strip() for feature in query.split('&&')], True
+    if '||' in query:
+        return [feature.strip() for feature in query.split('||')], False
+    return [query.strip()], False
+
+
+def memory_report(dataframe, list_columns):
+    """
+    :param dataframe: dataframe object returned by utils.load_data
+    :param list_columns: list of the list columns, stored as ListColumn
+    :return: dataframe of bytes per column held by the frame and the bytes the same data took as python lists in an
+             object column, with a total row
+    """
+    frame_bytes = dataframe.memory_usage(deep=True, index=False)
+    object_bytes = frame_bytes.copy()
+    for column in list_columns:
+        lists = pd.Series(np.asarray(dataframe[column].array), dtype=object)
+        # pandas sizes each list but not the strings inside it, so those are added here once per distinct object
+        strings = {id(item): item for value in lists for item in value}
+        object_bytes[column] = lists.memory_usage(deep=True, index=False) + sum(map(sys.getsizeof, strings.values()))
+    report = pd.DataFrame({'dtype': [str(dataframe[column].dtype) for column in dataframe.columns],
+                           'frame bytes': frame_bytes.to_numpy(),
+                           'object bytes': object_bytes.to_numpy()},
+                          index=dataframe.columns)
+    report.loc['total'] = ['', report['frame bytes'].sum(), report['object bytes'].sum()]
+    return report
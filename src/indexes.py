@@ -0,0 +1,640 @@
+import src.columns as columns
+import numpy as np
+import pandas as pd
+
+
+# inverted index for list-valued columns (i.e. genres, keywords)
+class InvertedIndex:
+    def __init__(self, tokens=None, offsets=None, rows=None):
+        """
+        :param tokens: list of the indexed tokens
+        :param offsets: array where the rows of tokens[i] are rows[offsets[i]: offsets[i + 1]]
+        :param rows: array of the row ids listing each token, sorted within each token
+        """
+        # posting lists as built or loaded, in csr like columns.ListColumn so a snapshot can store them as two arrays
+        # and memory-map them back, never written
+        self.tokens = [] if tokens is None else list(tokens)
+        self.slots = {token: slot for slot, token in enumerate(self.tokens)}
+        self.offsets = np.zeros(1, dtype=np.int64) if offsets is None else offsets
+        self.rows = np.empty(0, dtype=np.int64) if rows is None else rows
+        # {"Action": array([3, 17, 42]), ...}, posting lists changed since, an empty one for a token no row lists
+        self.postings = {}
+
+    @classmethod
+    def from_series(cls, series):
+        """
+        :param series: list-valued column whose index holds the integer row ids
+        :return: inverted index of every token in the column
+        """
+        column = columns.ListColumn.from_series(series)
+        if len(column.codes) == 0:
+            return cls()
+        codes, tokens = column.codes, column.categories
+        row_ids = series.index.to_numpy(dtype=np.int64)[column.positions()]
+        # sort by token then row id so each token's rows form one contiguous, sorted run
+        order = np.lexsort((row_ids, codes))
+        codes, row_ids = codes[order], row_ids[order]
+        # a row listing a token twice is indexed once
+        first = np.r_[True, (codes[1:] != codes[:-1]) | (row_ids[1:] != row_ids[:-1])]
+        codes, row_ids = codes[first], row_ids[first]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        return cls(tokens[codes[starts]].tolist(), np.r_[starts, len(codes)].astype(np.int64), row_ids)
+
+    def to_csr(self):
+        """
+        :return: tuple of the tokens, offsets and rows of the current posting lists, in the format of the constructor
+        """
+        if not self.postings:
+            return self.tokens, self.offsets, self.rows
+        tokens = [token for token in self.tokens if token not in self.postings]
+        tokens += [token for token, rows in self.postings.items() if len(rows)]
+        postings = [self.lookup(token) for token in tokens]
+        offsets = np.r_[0, np.cumsum([len(rows) for rows in postings], dtype=np.int64)].astype(np.int64)
+        return tokens, offsets, np.concatenate([np.empty(0, dtype=np.int64)] + postings)
+
+    def add(self, row_id, tokens):
+        """
+        :param row_id: id of the row the tokens belong to
+        :param tokens: list of tokens in the row
+        """
+        self.add_many([row_id], [tokens])
+
+    def remove(self, row_id, tokens):
+        """
+        :param row_id: id of the row the tokens belong to
+        :param tokens: list of tokens in the row
+        """
+        self.remove_many([row_id], [tokens])
+
+    def add_many(self, row_ids, token_lists):
+        """
+        :param row_ids: list of ids of the rows
+        :param token_lists: list of the tokens in each row
+        """
+        # each posting list touched by the batch is merged with its new rows once
+        for token, rows in group_by_token(row_ids, token_lists).items():
+            current = self.lookup(token)
+            self.postings[token] = rows if len(current) == 0 else np.union1d(current, rows)
+
+    def remove_many(self, row_ids, token_lists):
+        """
+        :param row_ids: list of ids of the rows
+        :param token_lists: list of the tokens in each row
+        """
+        for token, rows in group_by_token(row_ids, token_lists).items():
+            current = self.lookup(token)
+            if len(current):
+                self.postings[token] = current[~np.isin(current, rows, assume_unique=True)]
+
+    def copy(self):
+        """
+        :return: index that can be changed without changing this one
+        """
+        # add/remove replace posting arrays instead of writing into them, so the arrays themselves can be shared
+        index = InvertedIndex()
+        index.tokens, index.slots, index.offsets, index.rows = self.tokens, self.slots, self.offsets, self.rows
+        index.postings = dict(self.postings)
+        return index
+
+    def lookup(self, token):
+        """
+        :param token: token to find
+        :return: sorted array of row ids containing the token
+        """
+        rows = self.postings.get(token)
+        if rows is not None:
+            return rows
+        slot = self.slots.get(token)
+        if slot is None:
+            return np.empty(0, dtype=np.int64)
+        return self.rows[self.offsets[slot]: self.offsets[slot + 1]]
+
+    def lookup_all(self, tokens):
+        """
+        :param tokens: list of tokens that must all be present
+        :return: sorted array of row ids containing every token
+        """
+        # intersect the shortest posting lists first so the running result shrinks fastest
+        postings = sorted((self.lookup(token) for token in tokens), key=len)
+        if not postings:
+            return np.empty(0, dtype=np.int64)
+        result = postings[0]
+        for rows in postings[1:]:
+            if len(result) == 0:
+                break
+            result = np.intersect1d(result, rows, assume_unique=True)
+        return result
+
+    def lookup_any(self, tokens):
+        """
+        :param tokens: list of tokens of which at least one must be present
+        :return: sorted array of row ids containing any of the tokens
+        """
+        postings = [self.lookup(token) for token in tokens]
+        if not postings:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(postings))
+
+    def search(self, query):
+        """
+        :param query: single token, or tokens joined by '&&' (all must match) or '||' (any may match)
+        :return: sorted array of row ids matching the query
+        """
+        tokens, match_all = columns.split_list_query(query)
+        if match_all:
+            return self.lookup_all(tokens)
+        return self.lookup_any(tokens) if len(tokens) > 1 else self.lookup(tokens[0])
+
+
+def group_by_token(row_ids, token_lists):
+    """
+    :param row_ids: list of ids of the rows
+    :param token_lists: list of the tokens in each row
+    :return: dictionary of token to the sorted array of the ids of the rows listing it
+    """
+    grouped = {}
+    for row_id, tokens in zip(row_ids, token_lists):
+        for token in set(tokens):
+            grouped.setdefault(token, []).append(row_id)
+    return {token: np.unique(np.asarray(rows, dtype=np.int64)) for token, rows in grouped.items()}
+
+
+# texts are verified without a python loop by the np.strings functions on variable length numpy strings, both
+# added in numpy 2.0, older numpy keeps them in object arrays checked one string at a time
+if hasattr(np, 'strings'):
+    text_dtype = np.dtypes.StringDType()
+
+    def lower_texts(texts):
+        return np.strings.lower(texts)
+
+    def texts_starting(texts, query):
+        return np.strings.startswith(texts, query)
+
+    def texts_containing(texts, query):
+        return np.strings.find(texts, query) >= 0
+else:
+    text_dtype = object
+
+    def lower_texts(texts):
+        return np.array([text.lower() for text in texts], dtype=object)
+
+    def texts_starting(texts, query):
+        return np.fromiter((text.startswith(query) for text in texts), dtype=bool, count=len(texts))
+
+    def texts_containing(texts, query):
+        return np.fromiter((query in text for text in texts), dtype=bool, count=len(texts))
+
+# number of candidates a limited trigram search verifies at a time
+verify_chunk = 4096
+
+# marks the start of a string so prefix queries can be answered from the same grams as substring queries
+start_marker = '\x02'
+
+
+def trigrams(text, anchored=True):
+    """
+    :param text: string to split
+    :param anchored: flag for whether to include the grams that start at the start marker
+    :return: set of lowercase three character grams in the text
+    """
+    if not isinstance(text, str):
+        return set()
+    text = text.lower()
+    if anchored:
+        text = start_marker + text
+    return {text[i: i + 3] for i in range(len(text) - 2)}
+
+
+# trigram index for substring and prefix search on text columns (i.e. overview, tagline)
+class TrigramIndex:
+    def __init__(self):
+        # grams are stored in an inverted index, texts are kept to verify candidates
+        self.grams = InvertedIndex()
+        # texts sorted by row id in a numpy string array, so candidates are verified in one call
+        self.row_ids = np.empty(0, dtype=np.int64)
+        self.texts = np.empty(0, dtype=text_dtype)
+        # lowercase texts, only built by the first case insensitive search (i.e. title type-ahead)
+        self.lowered = None
+
+    @classmethod
+    def from_series(cls, series, grams=None):
+        """
+        :param series: text column whose index holds the integer row ids
+        :param grams: inverted index of the grams of the column (i.e. mapped from a snapshot), None to build it
+        :return: trigram index of every string in the column
+        """
+        index = cls()
+        if grams is None:
+            grams = InvertedIndex.from_series(series.map(lambda text: list(trigrams(text))))
+        index.grams = grams
+        present = series.map(lambda text: isinstance(text, str)).to_numpy(dtype=bool)
+        row_ids = series.index.to_numpy(dtype=np.int64)[present]
+        order = np.argsort(row_ids, kind='stable')
+        index.row_ids = row_ids[order]
+        index.texts = np.array(series.to_numpy(dtype=object)[present][order], dtype=text_dtype)
+        return index
+
+    def add(self, row_id, text):
+        """
+        :param row_id: id of the row the text belongs to
+        :param text: string in the row
+        """
+        self.add_many([row_id], [text])
+
+    def remove(self, row_id, text):
+        """
+        :param row_id: id of the row the text belongs to
+        :param text: string in the row
+        """
+        self.remove_many([row_id], [text])
+
+    def add_many(self, row_ids, texts):
+        """
+        :param row_ids: list of ids of the rows
+        :param texts: list of the string in each row, values that are not strings are skipped
+        """
+        pairs = sorted((row_id, text) for row_id, text in zip(row_ids, texts) if isinstance(text, str))
+        if not pairs:
+            return
+        row_ids, texts = [row_id for row_id, _ in pairs], [text for _, text in pairs]
+        self.grams.add_many(row_ids, [trigrams(text) for text in texts])
+        # one insert per array puts every new text at its place by row id
+        positions = np.searchsorted(self.row_ids, row_ids)
+        self.row_ids = np.insert(self.row_ids, positions, row_ids)
+        self.texts = np.insert(self.texts, positions, np.array(texts, dtype=text_dtype))
+        if self.lowered is not None:
+            self.lowered = np.insert(self.lowered, positions, np.array([text.lower() for text in texts],
+                                                                       dtype=text_dtype))
+
+    def remove_many(self, row_ids, texts):
+        """
+        :param row_ids: list of ids of the rows
+        :param texts: list of the string in each row
+        """
+        pairs = [(row_id, text) for row_id, text in zip(row_ids, texts) if isinstance(text, str)]
+        if not pairs:
+            return
+        row_ids = [row_id for row_id, _ in pairs]
+        self.grams.remove_many(row_ids, [trigrams(text) for _, text in pairs])
+        keep = ~np.isin(self.row_ids, row_ids)
+        self.row_ids = self.row_ids[keep]
+        self.texts = self.texts[keep]
+        if self.lowered is not None:
+            self.lowered = self.lowered[keep]
+
+    def copy(self):
+        """
+        :return: index that can be changed without changing this one
+        """
+        # add/remove replace the arrays instead of writing into them, so they can be shared
+        index = TrigramIndex()
+        index.grams = self.grams.copy()
+        index.row_ids, index.texts, index.lowered = self.row_ids, self.texts, self.lowered
+        return index
+
+    def search(self, query, prefix=False, case=True, limit=None):
+        """
+        :param query: substring to find
+        :param prefix: flag for whether the text must start with the query instead of containing it
+        :param case: flag for whether matching is case sensitive
+        :param limit: largest number of row ids to return, None for all of them
+        :return: sorted array of row ids whose text matches
+        """
+        grams = trigrams(query, anchored=prefix)
+        # queries shorter than a gram narrow nothing and fall back to checking every text
+        positions = np.searchsorted(self.row_ids, self.grams.lookup_all(grams)) if grams else None
+        if case:
+            texts = self.texts
+        else:
+            if self.lowered is None:
+                self.lowered = lower_texts(self.texts)
+            texts, query = self.lowered, query.lower()
+        # grams only narrow the candidates, they are verified against their full text a chunk at a time,
+        # so a limited search stops as soon as it has enough matches
+        candidates = len(self.row_ids) if positions is None else len(positions)
+        chunk = max(candidates, 1) if limit is None else max(verify_chunk, limit)
+        matches = []
+        found = 0
+        for start in range(0, candidates, chunk):
+            rows = slice(start, start + chunk) if positions is None else positions[start: start + chunk]
+            matched = texts_starting(texts[rows], query) if prefix else texts_containing(texts[rows], query)
+            matches.append(self.row_ids[rows][matched])
+            found += len(matches[-1])
+            if limit is not None and found >= limit:
+                break
+        if not matches:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(matches)[:limit]
+
+
+# sorted index for equality and range lookups on numeric columns (i.e. budget, rating)
+class SortedIndex:
+    def __init__(self):
+        # values in ascending order, row_ids[i] is the row holding values[i]
+        self.values = np.empty(0, dtype=np.float64)
+        self.row_ids = np.empty(0, dtype=np.int64)
+
+    @classmethod
+    def from_series(cls, series):
+        """
+        :param series: numeric column whose index holds the integer row ids, missing values are not indexed
+        :return: sorted index of the column
+        """
+        index = cls()
+        values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64)
+        present = ~np.isnan(values)
+        values, row_ids = values[present], series.index.to_numpy(dtype=np.int64)[present]
+        order = np.argsort(values, kind='stable')
+        index.values, index.row_ids = values[order], row_ids[order]
+        return index
+
+    def add(self, row_id, value):
+        """
+        :param row_id: id of the row the value belongs to
+        :param value: number in the row, values that are not numbers are skipped
+        """
+        self.add_many([row_id], [value])
+
+    def remove(self, row_id, value):
+        """
+        :param row_id: id of the row the value belongs to
+        :param value: number in the row
+        """
+        self.remove_many([row_id], [value])
+
+    def add_many(self, row_ids, values):
+        """
+        :param row_ids: list of ids of the rows
+        :param values: list of the number in each row, values that are not numbers are skipped
+        """
+        self.values, self.row_ids = merge_sorted(self.values, self.row_ids, row_ids, values)
+
+    def remove_many(self, row_ids, values):
+        """
+        :param row_ids: list of ids of the rows
+        :param values: list of the number in each row
+        """
+        self.values, self.row_ids = drop_rows(self.values, self.row_ids, row_ids)
+
+    def copy(self):
+        """
+        :return: index that can be changed without changing this one
+        """
+        # add/remove replace the arrays instead of writing into them, so they can be shared
+        index = SortedIndex()
+        index.values, index.row_ids = self.values, self.row_ids
+        return index
+
+    def span(self, low=None, high=None):
+        """
+        :param low: smallest value to include, None for no lower bound
+        :param high: largest value to include, None for no upper bound
+        :return: tuple of the start and end positions of the values with low <= value <= high
+        """
+        start = 0 if low is None else int(np.searchsorted(self.values, low, side='left'))
+        end = len(self.values) if high is None else int(np.searchsorted(self.values, high, side='right'))
+        return start, max(start, end)
+
+    def range(self, low=None, high=None):
+        """
+        :param low: smallest value to include, None for no lower bound
+        :param high: largest value to include, None for no upper bound
+        :return: sorted array of row ids with low <= value <= high
+        """
+        start, end = self.span(low, high)
+        return np.sort(self.row_ids[start:end])
+
+    def count(self, low=None, high=None):
+        """
+        :param low: smallest value to include, None for no lower bound
+        :param high: largest value to include, None for no upper bound
+        :return: number of rows with low <= value <= high, without taking their ids
+        """
+        start, end = self.span(low, high)
+        return end - start
+
+    def search(self, query):
+        """
+        :param query: number to find, as a string
+        :return: sorted array of row ids whose value equals the query
+        """
+        value = to_float(query)
+        if value is None:
+            return np.empty(0, dtype=np.int64)
+        return self.range(value, value)
+
+
+# numeric column pre-partitioned at fixed edges (i.e. the marks of a range slider)
+class BucketIndex:
+    def __init__(self, edges):
+        """
+        :param edges: list of bucket boundaries, bucket i + 1 holds edges[i] <= value < edges[i + 1]
+        """
+        # bucket 0 holds values below the first edge and the last bucket values from the last edge up
+        self.edges = np.sort(np.asarray(edges, dtype=np.float64))
+        self.values = [np.empty(0, dtype=np.float64) for _ in range(len(self.edges) + 1)]
+        self.row_ids = [np.empty(0, dtype=np.int64) for _ in range(len(self.edges) + 1)]
+
+    @classmethod
+    def from_series(cls, series, edges):
+        """
+        :param series: numeric column whose index holds the integer row ids, missing values are not indexed
+        :param edges: list of bucket boundaries
+        :return: bucket index of the column
+        """
+        index = cls(edges)
+        values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64)
+        present = ~np.isnan(values)
+        values, row_ids = values[present], series.index.to_numpy(dtype=np.int64)[present]
+        # one sort puts every bucket in a contiguous run, already ordered by value within it
+        order = np.argsort(values, kind='stable')
+        values, row_ids = values[order], row_ids[order]
+        bounds = np.searchsorted(values, index.edges, side='left')
+        index.values = np.split(values, bounds)
+        index.row_ids = np.split(row_ids, bounds)
+        return index
+
+    def bucket(self, value):
+        """
+        :param value: number to place
+        :return: position of the bucket holding value
+        """
+        return int(np.searchsorted(self.edges, value, side='right'))
+
+    def add(self, row_id, value):
+        """
+        :param row_id: id of the row the value belongs to
+        :param value: number in the row, values that are not numbers are skipped
+        """
+        self.add_many([row_id], [value])
+
+    def remove(self, row_id, value):
+        """
+        :param row_id: id of the row the value belongs to
+        :param value: number in the row
+        """
+        self.remove_many([row_id], [value])
+
+    def buckets(self, row_ids, values):
+        """
+        :param row_ids: list of ids of the rows
+        :param values: list of the number in each row
+        :return: dictionary of the position of every bucket holding one of the numbers to the (row ids, values) in it
+        """
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        values = to_floats(values)
+        present = ~np.isnan(values)
+        row_ids, values = row_ids[present], values[present]
+        buckets = np.searchsorted(self.edges, values, side='right')
+        return {int(bucket): (row_ids[buckets == bucket], values[buckets == bucket]) for bucket in np.unique(buckets)}
+
+    def add_many(self, row_ids, values):
+        """
+        :param row_ids: list of ids of the rows
+        :param values: list of the number in each row, values that are not numbers are skipped
+        """
+        for bucket, (bucket_ids, bucket_values) in self.buckets(row_ids, values).items():
+            self.values[bucket], self.row_ids[bucket] = merge_sorted(self.values[bucket], self.row_ids[bucket],
+                                                                     bucket_ids, bucket_values)
+
+    def remove_many(self, row_ids, values):
+        """
+        :param row_ids: list of ids of the rows
+        :param values: list of the number in each row
+        """
+        for bucket, (bucket_ids, _) in self.buckets(row_ids, values).items():
+            self.values[bucket], self.row_ids[bucket] = drop_rows(self.values[bucket], self.row_ids[bucket],
+                                                                  bucket_ids)
+
+    def copy(self):
+        """
+        :return: index that can be changed without changing this one
+        """
+        # add/remove replace a bucket's arrays instead of writing into them, so only the lists are copied
+        index = BucketIndex(self.edges)
+        index.values, index.row_ids = list(self.values), list(self.row_ids)
+        return index
+
+    def range(self, low, high):
+        """
+        :param low: smallest value to include
+        :param high: largest value to include
+        :return: array of row ids with low <= value <= high, ordered by value
+        """
+        first, last = self.bucket(low), self.bucket(high)
+        if first > last:
+            return np.empty(0, dtype=np.int64)
+        # buckets strictly between the bounds are taken whole, only the two end buckets are sliced
+        start = np.searchsorted(self.values[first], low, side='left')
+        end = np.searchsorted(self.values[last], high, side='right')
+        if first == last:
+            return self.row_ids[first][start:end]
+        slices = [self.row_ids[first][start:]] + self.row_ids[first + 1: last] + [self.row_ids[last][:end]]
+        return np.concatenate(slices)
+
+
+def to_float(value):
+    """
+    :param value: number or numeric string
+    :return: value as a float, or None if it is missing or not a number
+    """
+    try:
+        value = float(value)
+    except (ValueError, TypeError):
+        return None
+    return None if np.isnan(value) else value
+
+
+def to_floats(values):
+    """
+    :param values: list of numbers or numeric strings
+    :return: array of the values as floats, NaN where a value is missing or not a number
+    """
+    return pd.to_numeric(pd.Series(list(values), dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+
+
+def merge_sorted(sorted_values, sorted_row_ids, row_ids, values):
+    """
+    :param sorted_values: array of values in ascending order
+    :param sorted_row_ids: array of the row holding each of sorted_values
+    :param row_ids: list of ids of the rows to add
+    :param values: list of the number in each row to add, values that are not numbers are skipped
+    :return: tuple of the values and row ids arrays with the new rows merged in, still in ascending order of value
+    """
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    values = to_floats(values)
+    present = ~np.isnan(values)
+    order = np.argsort(values[present], kind='stable')
+    values, row_ids = values[present][order], row_ids[present][order]
+    # new rows go after the equal values already there, one insert per array
+    positions = np.searchsorted(sorted_values, values, side='right')
+    return np.insert(sorted_values, positions, values), np.insert(sorted_row_ids, positions, row_ids)
+
+
+def drop_rows(sorted_values, sorted_row_ids, row_ids):
+    """
+    :param sorted_values: array of values in ascending order
+    :param sorted_row_ids: array of the row holding each of sorted_values
+    :param row_ids: list of ids of the rows to remove
+    :return: tuple of the values and row ids arrays without the rows
+    """
+    keep = ~np.isin(sorted_row_ids, np.asarray(row_ids, dtype=np.int64))
+    return sorted_values[keep], sorted_row_ids[keep]
+
+
+def build_inverted_indexes(dataframe, columns):
+    """
+    :param dataframe: dataframe object whose index holds the integer row ids
+    :param columns: list of list-valued columns to index
+    :return: dictionary of column name to inverted index
+    """
+    return {column: InvertedIndex.from_series(dataframe[column]) for column in columns}
+
+
+def build_trigram_indexes(dataframe, columns):
+    """
+    :param dataframe: dataframe object whose index holds the integer row ids
+    :param columns: list of text columns to index
+    :return: dictionary of column name to trigram index
+    """
+    return {column: TrigramIndex.from_series(dataframe[column]) for column in columns}
+
+
+def build_sorted_indexes(dataframe, columns):
+    """
+    :param dataframe: dataframe object whose index holds the integer row ids
+    :param columns: list of numeric columns to index
+    :return: dictionary of column name to sorted index
+    """
+    return {column: SortedIndex.from_series(dataframe[column]) for column in columns}
+
+
+def build_bucket_indexes(dataframe, edges):
+    """
+    :param dataframe: dataframe object whose index holds the integer row ids
+    :param edges: dictionary of numeric column name to its list of bucket boundaries
+    :return: dictionary of column name to bucket index
+    """
+    return {column: BucketIndex.from_series(dataframe[column], column_edges) for column, column_edges in edges.items()}
+
+
+# functions to keep every index current after a batch of rows is inserted or deleted, an edit is a delete then an
+# insert, each index merges the whole batch at once
+def index_insert(indexes, rows):
+    """
+    :param indexes: dictionary of column name to index
+    :param rows: dataframe of the inserted rows, indexed by row id
+    """
+    row_ids = rows.index.to_numpy(dtype=np.int64)
+    for column, index in indexes.items():
+        index.add_many(row_ids, rows[column].tolist())
+
+
+def index_delete(indexes, rows):
+    """
+    :param indexes: dictionary of column name to index
+    :param rows: dataframe of the deleted rows as they were, indexed by row id
+    """
+    row_ids = rows.index.to_numpy(dtype=np.int64)
+    for column, index in indexes.items():
+        index.remove_many(row_ids, rows[column].tolist())
@@ -0,0 +1,85 @@
+import threading
+import time
+import traceback
+
+
+# builds the dataset on a background thread so the server can start answering before the data is ready
+class DatasetLoader:
+    def __init__(self, build, on_ready=None):
+        """
+        :param build: function taking a report(phase, progress) callback and returning the loaded dataset
+        :param on_ready: function called with every newly loaded dataset, right after it is swapped in
+        """
+        self.build = build
+        self.on_ready = on_ready
+        self.dataset = None  # replaced in one assignment, so readers see either the old or the new dataset
+        self.phase = 'not started'
+        self.progress = 0.0
+        self.error = None
+        self.loads = 0  # number of datasets swapped in so far
+        self.started = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        :return: flag for whether a load was started, False if one is already running
+        """
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return False
+            self.error = None
+            self.started = time.time()
+            self.report('starting', 0.0)
+            self.thread = threading.Thread(target=self.run, name='dataset-loader', daemon=True)
+            self.thread.start()
+            return True
+
+    def run(self):
+        try:
+            dataset = self.build(self.report)
+        except Exception:
+            # the previous dataset, if any, keeps serving requests
+            self.error = traceback.format_exc()
+            self.report('failed', self.progress)
+            return
+        # on_ready runs first, so nothing sees ready() before the dataset has been handed over
+        if self.on_ready is not None:
+            self.on_ready(dataset)
+        self.dataset = dataset
+        self.loads += 1
+        self.report('ready', 1.0)
+
+    def report(self, phase, progress):
+        """
+        :param phase: name of the step the load is in (i.e. 'loading snapshot', 'building indexes')
+        :param progress: fraction of the load done, between 0 and 1
+        """
+        self.phase = phase
+        self.progress = progress
+
+    def ready(self):
+        return self.dataset is not None
+
+    def wait(self, timeout=None):
+        """
+        :param timeout: number of seconds to wait, None to wait until the load finishes
+        :return: flag for whether a dataset is available
+        """
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.ready()
+
+    def status(self):
+        """
+        :return: dictionary of the readiness, load phase, progress and error of the loader
+        """
+        loading = self.thread is not None and self.thread.is_alive()
+        return {'ready': self.ready(),
+                'loading': loading,
+                'phase': self.phase,
+                'progress': round(self.progress, 3),
+                'seconds': round(time.time() - self.started, 3) if self.started is not None else None,
+                'loads': self.loads,
+                'error': self.error}
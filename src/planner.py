@@ -0,0 +1,246 @@
+import src.columns as columns
+import src.utils as utils
+import src.indexes as indexes
+import numpy as np
+import pandas as pd
+
+
+# compound filter expressions join clauses with '&&' (all must match) and groups of clauses with '||'
+# i.e. "{budget} ge 1e8 && {genres} contains Action || {rating} gt 8"
+
+
+def parse_expression(expression):
+    """
+    :param expression: filter expression of clauses formatted as "{column} operator value"
+    :return: list of OR-ed groups, each a list of AND-ed (column, operator, value) clauses
+    """
+    groups = []
+    for group in expression.split('||'):
+        clauses = []
+        for part in group.split('&&'):
+            column, operator, value = utils.split_filter_part(part.strip())
+            if column is None:
+                raise ValueError("could not parse filter clause: " + part.strip())
+            clauses.append((column, operator, value))
+        groups.append(clauses)
+    return groups
+
+
+def as_text(value):
+    """
+    :param value: value returned by utils.split_filter_part
+    :return: value as a string, whole floats lose their trailing '.0' (i.e. 1995.0 -> '1995')
+    """
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def sorted_bounds(operator, value):
+    """
+    :param operator: operator returned by utils.split_filter_part
+    :param value: value returned by utils.split_filter_part
+    :return: tuple of the (low, high) range of a SortedIndex matching the clause, or None if it isn't a range
+    """
+    value = indexes.to_float(value)
+    if value is None:
+        return None
+    bounds = {'eq': (value, value),
+              'ge': (value, None),
+              'gt': (np.nextafter(value, np.inf), None),
+              'le': (None, value),
+              'lt': (None, np.nextafter(value, -np.inf))}
+    return bounds.get(operator)
+
+
+def index_lookup(index, operator, value):
+    """
+    :param index: index built over the clause's column
+    :param operator: operator returned by utils.split_filter_part
+    :param value: value returned by utils.split_filter_part
+    :return: tuple of (sorted array of row ids, flag for whether the ids are exact), or None if the index can't help
+    """
+    if isinstance(index, indexes.SortedIndex):
+        bounds = sorted_bounds(operator, value)
+        if bounds is None:
+            return None
+        return index.range(*bounds), True
+    if isinstance(index, indexes.InvertedIndex):
+        if operator in ('contains', 'eq'):
+            return index.lookup(as_text(value)), True
+        return None
+    if isinstance(index, indexes.TrigramIndex):
+        if operator == 'contains':
+            return index.search(as_text(value)), True
+        if operator in ('datestartswith', 'eq'):
+            # prefix candidates still need the equality check for 'eq'
+            return index.search(as_text(value), prefix=True), operator == 'datestartswith'
+    return None
+
+
+def estimate(index, operator, value):
+    """
+    :param index: index built over the clause's column
+    :param operator: operator returned by utils.split_filter_part
+    :param value: value returned by utils.split_filter_part
+    :return: estimated number of matching rows, or None if the index can't answer the clause
+    """
+    if isinstance(index, indexes.TrigramIndex):
+        if operator not in ('contains', 'datestartswith', 'eq'):
+            return None
+        # the shortest posting list bounds the result without verifying any text
+        grams = indexes.trigrams(as_text(value), anchored=operator != 'contains')
+        if not grams:
+            return len(index.texts)
+        return min(len(index.grams.lookup(gram)) for gram in grams)
+    if isinstance(index, indexes.SortedIndex):
+        # counted from the two ends of the range, the row ids are only taken by execute
+        bounds = sorted_bounds(operator, value)
+        return None if bounds is None else index.count(*bounds)
+    # an inverted lookup returns the posting list itself, so counting it exactly copies nothing
+    result = index_lookup(index, operator, value)
+    return None if result is None else len(result[0])
+
+
+def clause_mask(dataframe, column, operator, value):
+    """
+    :param dataframe: dataframe object to filter
+    :param column: column name
+    :param operator: operator returned by utils.split_filter_part
+    :param value: value returned by utils.split_filter_part
+    :return: boolean series of the rows matching the clause
+    """
+    series = dataframe[column]
+    if isinstance(series.dtype, columns.ListDtype):
+        # membership in a list column, answered from its codes
+        if operator not in ('contains', 'eq', 'ne'):
+            raise ValueError("operator {} is not supported on list column {}".format(operator, column))
+        mask = pd.Series(series.array.contains_any([as_text(value)]), index=series.index)
+        return ~mask if operator == 'ne' else mask
+    if operator == 'contains':
+        return series.astype(str).str.contains(as_text(value), regex=False)
+    if operator == 'datestartswith':
+        return series.astype(str).str.startswith(as_text(value))
+    if series.dtype.kind == 'M':
+        # a bare number is a year (i.e. {release_date} ge 1995), anything else is read as a date
+        if isinstance(value, float):
+            series = series.dt.year
+        else:
+            value = pd.to_datetime(as_text(value))
+    elif isinstance(value, float):
+        series = pd.to_numeric(series, errors='coerce')
+    else:
+        series = series.astype(str)
+    comparisons = {'eq': series.__eq__, 'ne': series.__ne__, 'ge': series.__ge__,
+                   'gt': series.__gt__, 'le': series.__le__, 'lt': series.__lt__}
+    return comparisons[operator](value)
+
+
+def plan(dataframe, expression, column_indexes):
+    """
+    :param dataframe: dataframe object the indexes were built over
+    :param expression: filter expression of clauses formatted as "{column} operator value"
+    :param column_indexes: dictionary of column name to index
+    :return: list of OR-ed group plans, each a dictionary of the driving clause, its estimate and the residual clauses
+    """
+    plans = []
+    for clauses in parse_expression(expression):
+        best, best_estimate = None, len(dataframe)
+        for clause in clauses:
+            column, operator, value = clause
+            if column not in column_indexes:
+                continue
+            rows = estimate(column_indexes[column], operator, value)
+            # the most selective indexed clause drives the group
+            if rows is not None and rows <= best_estimate:
+                best, best_estimate = clause, rows
+        residual = [clause for clause in clauses if clause is not best]
+        plans.append({'driver': best, 'estimate': best_estimate, 'residual': residual})
+    return plans
+
+
+def execute(dataframe, expression, column_indexes):
+    """
+    :param dataframe: dataframe object the indexes were built over
+    :param expression: filter expression of clauses formatted as "{column} operator value"
+    :param column_indexes: dictionary of column name to index
+    :return: sorted array of row ids matching the expression
+    """
+    results = []
+    for group in plan(dataframe, expression, column_indexes):
+        residual = list(group['residual'])
+        if group['driver'] is None:
+            candidates = dataframe
+        else:
+            column, operator, value = group['driver']
+            row_ids, exact = index_lookup(column_indexes[column], operator, value)
+            if not exact:
+                residual.append(group['driver'])
+            candidates = dataframe.loc[row_ids]
+        # the remaining clauses are evaluated vectorized on the candidate rows only
+        mask = np.ones(len(candidates), dtype=bool)
+        for column, operator, value in residual:
+            if not mask.any():
+                break
+            mask &= clause_mask(candidates, column, operator, value).to_numpy(dtype=bool)
+        results.append(candidates.index.to_numpy(dtype=np.int64)[mask])
+    if not results:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(results))
+
+
+def explain(dataframe, expression, column_indexes):
+    """
+    :param dataframe: dataframe object the indexes were built over
+    :param expression: filter expression of clauses formatted as "{column} operator value"
+    :param column_indexes: dictionary of column name to index
+    :return: readable description of the chosen plan
+    """
+    lines = []
+    for i, group in enumerate(plan(dataframe, expression, column_indexes)):
+        if i > 0:
+            lines.append('UNION')
+        if group['driver'] is None:
+            lines.append('scan all {} rows'.format(len(dataframe)))
+        else:
+            column, operator, value = group['driver']
+            lines.append('index lookup {{{}}} {} {} using {} (~{} rows)'.format(
+                column, operator, as_text(value), type(column_indexes[column]).__name__, group['estimate']))
+            if isinstance(column_indexes[column], indexes.TrigramIndex) and operator == 'eq':
+                lines.append('  filter {{{}}} eq {} (verify prefix candidates)'.format(column, as_text(value)))
+        for column, operator, value in group['residual']:
+            lines.append('  filter {{{}}} {} {} (vectorized)'.format(column, operator, as_text(value)))
+    return '\n'.join(lines)
+
+
+def table_page(dataframe, positions, page_current, page_size, sort_by=None, filter_query=None):
+    """
+    :param dataframe: dataframe object holding the rows
+    :param positions: array of the positions in dataframe of the rows shown in the table, None for every row
+    :param page_current: zero based page number requested by the table
+    :param page_size: number of rows per page
+    :param sort_by: list of {'column_id': ..., 'direction': 'asc' or 'desc'} from the table, applied in order
+    :param filter_query: filter expression from the table formatted as "{column} operator value && ..."
+    :return: tuple of the dataframe of rows on the requested page and the number of pages, raises ValueError for
+             clauses parse_expression can't read
+    """
+    frame = dataframe if positions is None else dataframe.take(positions[positions >= 0])
+    if filter_query:
+        # a row is kept if it matches every clause of any group, like execute
+        mask = np.zeros(len(frame), dtype=bool)
+        for clauses in parse_expression(filter_query):
+            group = np.ones(len(frame), dtype=bool)
+            for column, operator, value in clauses:
+                group &= clause_mask(frame, column, operator, value).to_numpy(dtype=bool)
+            mask |= group
+        frame = frame[mask]
+    order = np.arange(len(frame))
+    if sort_by:
+        columns = [sort['column_id'] for sort in sort_by]
+        ascending = [sort['direction'] == 'asc' for sort in sort_by]
+        # only the sort keys are sorted, the rest of the frame is never copied
+        keys = frame[columns].reset_index(drop=True)
+        order = keys.sort_values(columns, ascending=ascending, kind='mergesort').index.to_numpy()
+    start = page_current * page_size
+    page_count = max(1, -(-len(frame) // page_size))
+    return frame.take(order[start: start + page_size]), page_count
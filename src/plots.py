@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+# above this many points scatter plots are drawn with WebGL instead of SVG
+webgl_threshold = 5000
+# line plots are reduced to at most this many points before they are sent to the browser
+max_line_points = 2000
+
+
+def scatter(data_frame, x, y, **kwargs):
+    """
+    :param data_frame: dataframe object holding the points
+    :param x: column on the x axis
+    :param y: column on the y axis
+    :param kwargs: other arguments passed on to px.scatter (i.e. height, color_discrete_sequence)
+    :return: scatter plot figure, rendered with WebGL when it has more than webgl_threshold points
+    """
+    render_mode = 'webgl' if len(data_frame) > webgl_threshold else 'svg'
+    return px.scatter(data_frame=data_frame, x=x, y=y, render_mode=render_mode, **kwargs)
+
+
+def lttb(x, y, threshold):
+    """
+    :param x: array of x values in ascending order
+    :param y: array of y values
+    :param threshold: number of points to keep
+    :return: array of positions of the kept points, chosen by largest-triangle-three-buckets
+    """
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, length - 1
+    # the points between the first and last are split into threshold - 2 buckets of equal size
+    edges = np.linspace(1, length - 1, threshold - 1).astype(np.int64)
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # the next bucket is represented by its average point, the last bucket by the last point
+        if i + 2 < len(edges):
+            next_x, next_y = x[end: edges[i + 2]].mean(), y[end: edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # keep the point forming the largest triangle with the previous kept point and the next average
+        areas = np.abs((x[previous] - next_x) * (y[start: end] - y[previous]) -
+                       (x[previous] - x[start: end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[i + 1] = previous
+    return kept
+
+
+def line(data_frame, x, y, freq=None, max_points=max_line_points, **kwargs):
+    """
+    :param data_frame: dataframe object holding the points
+    :param x: column on the x axis
+    :param y: column on the y axis
+    :param freq: period to average date x values over (i.e. 'M' for a mean per month), None to average equal x values
+    :param max_points: number of points the line is downsampled to
+    :param kwargs: other arguments passed on to px.line (i.e. color_discrete_sequence)
+    :return: line plot figure of the mean y per x, in x order and with at most max_points points
+    """
+    points = data_frame[[x, y]].dropna()
+    x_values = points[x]
+    if freq is not None:
+        # dates may still be strings, the ones that don't parse are left out of the line
+        x_values = pd.to_datetime(x_values, errors='coerce').dropna()
+        x_values = x_values.dt.to_period(freq).dt.to_timestamp()
+        points = points.loc[x_values.index]
+    # equal x values are averaged so the line never zig-zags between rows sharing an x
+    means = pd.to_numeric(points[y], errors='coerce').groupby(x_values.to_numpy()).mean().dropna()
+    x_axis = means.index.to_numpy()
+    numeric_x = x_axis.astype(np.int64) if x_axis.dtype.kind == 'M' else x_axis
+    kept = lttb(numeric_x, means.to_numpy(), max_points)
+    reduced = pd.DataFrame({x: x_axis[kept], y: means.to_numpy()[kept]})
+    return px.line(data_frame=reduced, x=x, y=y, **kwargs)
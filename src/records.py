@@ -0,0 +1,141 @@
+import ast
+import numpy as np
+import pandas as pd
+
+# columns of a movie in the order utils.load_data returns them, with the type each one is converted to
+movie_schema = [('budget', 'number'),
+                ('original_title', 'text'),
+                ('overview', 'text'),
+                ('release_date', 'date'),
+                ('revenue', 'number'),
+                ('runtime', 'number'),
+                ('tagline', 'text'),
+                ('rating', 'number'),
+                ('vote_count', 'number'),
+                ('genres', 'list'),
+                ('keywords', 'list'),
+                ('production_companies', 'list'),
+                ('production_countries', 'list'),
+                ('spoken_languages', 'list')]
+
+columns = [column for column, _ in movie_schema]
+
+
+def to_number(value):
+    """
+    :param value: number or numeric string
+    :return: value as a float, NaN if it is missing or not a number
+    """
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def to_date(value):
+    """
+    :param value: date or date string
+    :return: value as a timestamp, NaT if it is missing or not a date
+    """
+    return pd.to_datetime(value, errors='coerce')
+
+
+def to_text(value):
+    """
+    :param value: string typed into a form
+    :return: value, NaN if it is missing or empty
+    """
+    if value is None or value == '' or (isinstance(value, float) and np.isnan(value)):
+        return np.nan
+    return str(value)
+
+
+def to_list(value):
+    """
+    :param value: list, python list literal such as "['Drama', 'Comedy']", or comma separated string
+    :return: value as a list of strings, empty if it is missing, raises ValueError if a list literal can't be read
+    """
+    if isinstance(value, list):
+        return value
+    if not isinstance(value, str) or not value.strip():
+        return []
+    value = value.strip()
+    if value.startswith('['):
+        try:
+            items = ast.literal_eval(value)
+        except (SyntaxError, ValueError):
+            raise ValueError("could not read list {}".format(value))
+        if not isinstance(items, (list, tuple)):
+            raise ValueError("could not read list {}".format(value))
+        return [str(item) for item in items]
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+converters = {'number': to_number, 'date': to_date, 'text': to_text, 'list': to_list}
+
+
+# one movie with its fields converted to the types of movie_schema, read by name instead of by position
+class MovieRecord:
+    __slots__ = tuple(columns)
+
+    def __init__(self, values):
+        """
+        :param values: list of already converted values in movie_schema order
+        """
+        for column, value in zip(columns, values):
+            setattr(self, column, value)
+
+    @classmethod
+    def from_inputs(cls, values):
+        """
+        :param values: list of raw values in movie_schema order (i.e. the strings typed into the edit/insert forms),
+                       or dictionary of column name to raw value where missing columns are left empty
+        :return: record with every value converted by the converter of its type
+        """
+        if isinstance(values, dict):
+            values = [values.get(column) for column in columns]
+        return cls([converters[kind](value) for (_, kind), value in zip(movie_schema, values)])
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        :param row: row of metadata (series or dictionary), whose values already have the schema types
+        :return: record of the row, without converting anything
+        """
+        return cls([row[column] for column in columns])
+
+    def to_list(self):
+        """
+        :return: list of the values in movie_schema order
+        """
+        return [getattr(self, column) for column in columns]
+
+    def to_dict(self):
+        """
+        :return: dictionary of column name to value
+        """
+        return {column: getattr(self, column) for column in columns}
+
+    def to_inputs(self):
+        """
+        :return: list of the values as strings to prefill a form with, from_inputs reads them back unchanged
+        """
+        inputs = []
+        for column, kind in movie_schema:
+            value = getattr(self, column)
+            if kind == 'list':
+                inputs.append(str(value))
+            elif pd.isna(value):
+                inputs.append('')
+            elif kind == 'date':
+                inputs.append(value.strftime('%Y-%m-%d'))
+            else:
+                inputs.append(str(value))
+        return inputs
+
+    def __getitem__(self, column):
+        return getattr(self, column)
+
+    def __repr__(self):
+        return 'MovieRecord({})'.format(', '.join('{}={!r}'.format(column, getattr(self, column))
+                                                   for column in columns))
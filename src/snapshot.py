@@ -0,0 +1,324 @@
+import src.utils as utils
+import src.analysis as analysis
+import src.columns as columns
+import src.indexes as indexes
+import fcntl
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import numpy as np
+import pandas as pd
+
+# csv files the dataset is built from, and where the cleaned snapshot of them is kept
+source_files = ["../data/movies_metadata.csv", "../data/keywords.csv"]
+snapshot_dir = "../data/snapshot"
+# snapshot of the movies with every change made in the app, together with the mutation log offset it covers
+backup_dir = "../data/backup"
+
+# bump whenever the layout of the snapshot or the aggregates stored in it changes
+snapshot_format = 8
+
+# text columns searched through a trigram index, whose posting lists are stored in the snapshot
+text_columns = ['original_title', 'overview', 'tagline']
+
+
+def file_hash(filepath, block_size=1 << 20):
+    """
+    :param filepath: location of file to hash
+    :param block_size: number of bytes read at a time
+    :return: sha1 hex digest of the file contents
+    """
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_key(filepaths, previous=None):
+    """
+    :param filepaths: list of source file locations
+    :param previous: key stored with an existing snapshot, its hashes are reused for files whose mtime and size match
+    :return: list of dictionaries of path, mtime, size and sha1 per source file
+    """
+    previous = {source['path']: source for source in previous or []}
+    key = []
+    for filepath in filepaths:
+        stat = os.stat(filepath)
+        source = {'path': filepath, 'mtime': stat.st_mtime, 'size': stat.st_size}
+        old = previous.get(filepath)
+        if old is not None and old['mtime'] == source['mtime'] and old['size'] == source['size']:
+            source['sha1'] = old['sha1']
+        else:
+            # a touched file only invalidates the snapshot if its contents changed
+            source['sha1'] = file_hash(filepath)
+        key.append(source)
+    return key
+
+
+def build_aggregates(metadata):
+    """
+    :param metadata: cleaned dataframe returned by utils.load_data
+    :return: dictionary of the per genre aggregates, the popularity counts, the derived columns and the trigram
+             indexes of the text columns used by app.py
+    """
+    aggregates = {}
+    aggregates['genre_aggregates'] = analysis.GenreAggregates.from_dataframe(metadata, ['revenue', 'rating', 'budget'])
+    # all three popularity counters come out of one pass over the list columns
+    counters = analysis.calculate_pop_feature_counts(metadata, ['genres', 'keywords', 'production_companies'])
+    aggregates['pop_genres_count'] = counters['genres']
+    aggregates['pop_keys_count'] = counters['keywords']
+    aggregates['pop_companies_count'] = counters['production_companies']
+    aggregates['derived'] = analysis.calculate_derived(metadata)
+    # the largest index of every worker, built once here instead of at every start
+    aggregates['text_indexes'] = indexes.build_trigram_indexes(metadata, text_columns)
+    return aggregates
+
+
+def write_snapshot(directory, key, metadata, aggregates, log_offset=None):
+    """
+    :param directory: location of snapshot directory, replaced if it exists
+    :param key: source key returned by source_key
+    :param metadata: cleaned dataframe to store
+    :param aggregates: dictionary of precomputed aggregates to store
+    :param log_offset: position in the mutation log the metadata is up to date with, for backups
+    """
+    # write everything next to the old snapshot first so a crash never leaves a half written one behind
+    staging = directory + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    numeric = [column for column in metadata.columns if metadata[column].dtype.kind in 'biufM']
+    lists = [column for column in metadata.columns if isinstance(metadata[column].dtype, columns.ListDtype)]
+    others = [column for column in metadata.columns if column not in numeric and column not in lists]
+    # numeric columns, the codes and offsets of the list columns, the derived columns and the posting lists of the
+    # trigram indexes are stored as raw arrays and memory-mapped back, so worker processes share their pages. Applied
+    # batches never write to them (see store.FrameOverlay and indexes.InvertedIndex), a worker maps a newer backup to
+    # drop the rows it changed since. Only the distinct feature strings and grams are pickled, the text columns, the
+    # aggregates and the other indexes are private to each worker
+    np.save(os.path.join(staging, 'index.npy'), metadata.index.to_numpy())
+    for i, column in enumerate(numeric):
+        np.save(os.path.join(staging, 'column{}.npy'.format(i)), metadata[column].to_numpy())
+    aggregates = dict(aggregates)
+    derived = aggregates.pop('derived')
+    for i, column in enumerate(derived.columns):
+        np.save(os.path.join(staging, 'derived{}.npy'.format(i)), derived[column].to_numpy())
+    text_indexes = aggregates.pop('text_indexes', {})
+    grams = {}
+    for i, (column, index) in enumerate(text_indexes.items()):
+        grams[column], offsets, rows = index.grams.to_csr()
+        np.save(os.path.join(staging, 'trigram{}.offsets.npy'.format(i)), offsets)
+        np.save(os.path.join(staging, 'trigram{}.rows.npy'.format(i)), rows)
+    categories = {}
+    for i, column in enumerate(lists):
+        list_column = metadata[column].array
+        np.save(os.path.join(staging, 'list{}.codes.npy'.format(i)), list_column.codes)
+        np.save(os.path.join(staging, 'list{}.offsets.npy'.format(i)), list_column.offsets)
+        categories[column] = list_column.categories
+    with open(os.path.join(staging, 'objects.pkl'), 'wb') as file:
+        pickle.dump({'columns': {column: metadata[column].to_numpy(dtype=object) for column in others},
+                     'categories': categories,
+                     'grams': grams,
+                     'aggregates': aggregates}, file, protocol=pickle.HIGHEST_PROTOCOL)
+    # a backup lets the mutation log be compacted, so its files must be on disk before it replaces the old one
+    for name in os.listdir(staging):
+        with open(os.path.join(staging, name), 'rb') as file:
+            os.fsync(file.fileno())
+    # the manifest goes last, a staging directory holding one is complete (see restore_staged)
+    manifest = {'format': snapshot_format, 'sources': key, 'columns': list(metadata.columns), 'numeric': numeric,
+                'lists': lists, 'derived': list(derived.columns), 'trigrams': list(text_indexes),
+                'log_offset': log_offset}
+    with open(os.path.join(staging, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file)
+        file.flush()
+        os.fsync(file.fileno())
+    sync_directory(staging)
+    # the old snapshot is moved aside rather than removed, so there is no moment without a complete one on disk
+    previous = directory + '.old'
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, previous)
+    os.replace(staging, directory)
+    sync_directory(os.path.dirname(os.path.abspath(directory)))
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+def sync_directory(directory):
+    """
+    :param directory: location of a directory whose entries were just changed
+    """
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def restore_staged(directory):
+    """
+    called with the snapshot's lock held exclusively
+    :param directory: location of snapshot directory
+    :return: flag for whether a snapshot left aside by a write_snapshot that crashed mid-swap was moved back in place
+    """
+    if os.path.exists(directory):
+        return False
+    # the staging copy is the newer one, the one moved aside is still complete if the staging copy isn't
+    for candidate in [directory + '.tmp', directory + '.old']:
+        if os.path.exists(os.path.join(candidate, 'manifest.json')):
+            os.replace(candidate, directory)
+            sync_directory(os.path.dirname(os.path.abspath(directory)))
+            shutil.rmtree(directory + '.old', ignore_errors=True)
+            return True
+    return False
+
+
+def read_manifest(directory):
+    """
+    :param directory: location of snapshot directory
+    :return: dictionary stored by write_snapshot, None if the snapshot is missing or of an older format
+    """
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('format') != snapshot_format:
+        return None
+    return manifest
+
+
+def load_snapshot(directory, filepaths):
+    """
+    :param directory: location of snapshot directory
+    :param filepaths: list of source file locations the snapshot must match, None to load it whatever its sources
+    :return: tuple of cleaned dataframe and aggregates, or None if the snapshot is missing or stale
+    """
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return None
+    if filepaths is not None:
+        key = source_key(filepaths, manifest['sources'])
+        if [source['sha1'] for source in key] != [source['sha1'] for source in manifest['sources']]:
+            return None
+    with open(os.path.join(directory, 'objects.pkl'), 'rb') as file:
+        objects = pickle.load(file)
+    # copy-on-write maps so in place edits from the callbacks never touch the files
+    index = np.load(os.path.join(directory, 'index.npy'), mmap_mode='c')
+    data = {}
+    for i, column in enumerate(manifest['numeric']):
+        data[column] = np.load(os.path.join(directory, 'column{}.npy'.format(i)), mmap_mode='c')
+    # list columns are kept as csr (see columns.ListColumn) over the mapped codes and offsets
+    for i, column in enumerate(manifest['lists']):
+        data[column] = columns.ListColumn(objects['categories'][column],
+                                          np.load(os.path.join(directory, 'list{}.codes.npy'.format(i)), mmap_mode='c'),
+                                          np.load(os.path.join(directory, 'list{}.offsets.npy'.format(i)),
+                                                  mmap_mode='c'))
+    data.update(objects['columns'])
+    index = pd.Index(index, copy=False)
+    metadata = pd.DataFrame(data, index=index, columns=manifest['columns'], copy=False)
+    aggregates = dict(objects['aggregates'])
+    aggregates['derived'] = pd.DataFrame({column: np.load(os.path.join(directory, 'derived{}.npy'.format(i)),
+                                                          mmap_mode='c')
+                                          for i, column in enumerate(manifest['derived'])},
+                                         index=index, columns=manifest['derived'], copy=False)
+    # only the texts are taken from metadata again, the grams come from the mapped posting lists
+    aggregates['text_indexes'] = {
+        column: indexes.TrigramIndex.from_series(metadata[column], indexes.InvertedIndex(
+            objects['grams'][column],
+            np.load(os.path.join(directory, 'trigram{}.offsets.npy'.format(i)), mmap_mode='c'),
+            np.load(os.path.join(directory, 'trigram{}.rows.npy'.format(i)), mmap_mode='c')))
+        for i, column in enumerate(manifest['trigrams'])}
+    return metadata, aggregates
+
+
+def load_dataset(directory=snapshot_dir, filepaths=None):
+    """
+    :param directory: location of snapshot directory
+    :param filepaths: list of source file locations, defaults to the files read by utils.load_data
+    :return: dictionary of the cleaned dataframe under 'metadata' and every precomputed aggregate
+    """
+    filepaths = filepaths or source_files
+    snapshot = load_snapshot(directory, filepaths)
+    if snapshot is None:
+        # with several workers starting at once only the first one builds, the others wait and load its files
+        with open(directory + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            snapshot = load_snapshot(directory, filepaths)
+            if snapshot is None:
+                metadata = utils.load_data()
+                aggregates = build_aggregates(metadata)
+                write_snapshot(directory, source_key(filepaths), metadata, aggregates)
+                snapshot = load_snapshot(directory, filepaths)
+    metadata, aggregates = snapshot
+    dataset = dict(aggregates)
+    dataset['metadata'] = metadata
+    return dataset
+
+
+def write_backup(data, offset, directory=backup_dir, filepaths=None):
+    """
+    :param data: store.MovieSnapshot to save
+    :param offset: position in the mutation log the snapshot is up to date with
+    :param directory: location of backup directory
+    :param filepaths: list of source file locations the movies were loaded from, defaults to the files read by
+                      utils.load_data
+    :return: flag for whether the backup was written, False if the existing one is at least as recent
+    """
+    filepaths = filepaths or source_files
+    # workers back up on their own timers, the lock keeps them from writing over each other
+    with open(directory + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        restore_staged(directory)
+        manifest = read_manifest(directory)
+        if manifest is not None and manifest['log_offset'] is not None and manifest['log_offset'] >= offset:
+            return False
+        key = source_key(filepaths, manifest['sources'] if manifest is not None else None)
+        write_snapshot(directory, key, data.metadata, data.aggregates(), log_offset=offset)
+    return True
+
+
+def load_backup(directory=backup_dir):
+    """
+    :param directory: location of backup directory
+    :return: tuple of the dataset in the format of load_dataset and the mutation log offset it is up to date with,
+             or None if there is no backup, raises ValueError if there is one that can't be loaded
+    """
+    # shared lock, so a backup being written can't swap the files between reading the manifest and the data
+    with open(directory + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        if not os.path.exists(directory):
+            # a crash between the two renames of write_snapshot leaves the backup next to its place
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            restore_staged(directory)
+        if not os.path.exists(os.path.join(directory, 'manifest.json')):
+            return None
+        manifest = read_manifest(directory)
+        if manifest is None or manifest.get('log_offset') is None:
+            raise ValueError("backup in {} is unreadable or of another format than {}".format(directory,
+                                                                                          snapshot_format))
+        try:
+            # the backup holds every change made in the app, so it is loaded even if the csv files changed since
+            backup = load_snapshot(directory, None)
+        except (OSError, EOFError, pickle.UnpicklingError) as error:
+            raise ValueError("backup in {} is damaged: {!r}".format(directory, error))
+    metadata, aggregates = backup
+    dataset = dict(aggregates)
+    dataset['metadata'] = metadata
+    return dataset, manifest['log_offset']
+
+
+def backup_offset(directory=backup_dir):
+    """
+    :param directory: location of backup directory
+    :return: mutation log offset the backup covers, None if there is no readable backup
+    """
+    with open(directory + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH)
+        manifest = read_manifest(directory)
+    return None if manifest is None else manifest.get('log_offset')
+
+
+# run once before starting the workers (i.e. from a gunicorn on_starting hook) so none of them has to build it
+if __name__ == '__main__':
+    load_dataset()
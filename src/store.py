@@ -0,0 +1,439 @@
+import src.columns as columns
+import src.utils as utils
+import src.analysis as analysis
+import src.indexes as indexes
+import src.records as records
+import collections
+import concurrent.futures
+import io
+import itertools
+import queue
+import threading
+import numpy as np
+import pandas as pd
+
+# batches touching more than this fraction of the rows rebuild the indexes instead of merging the rows into them
+rebuild_fraction = 0.05
+
+# numbers the loaded datasets, versions restart at 0 with every load so (generation, version) names one state
+generations = itertools.count()
+
+
+# a base frame together with the rows changed since it was loaded, kept next to it instead of copied into it, so the
+# base columns (memory-mapped from a snapshot and shared by every worker process) are never rewritten.
+# never changed once built, readers get the merged rows from frame(), merged once and kept for the overlay's lifetime
+class FrameOverlay:
+    def __init__(self, base, delta=None, slots=None, deleted=None):
+        """
+        :param base: dataframe whose index holds the integer row ids
+        :param delta: dataframe of the current values of the rows edited or inserted since base, with its columns
+        :param slots: array of the position in base of the row each delta row replaces, -1 for inserted rows
+        :param deleted: sorted array of the positions in base of the rows deleted since
+        """
+        self.base = base
+        self.delta = base.iloc[:0] if delta is None else delta
+        self.slots = np.empty(0, dtype=np.int64) if slots is None else slots
+        self.deleted = np.empty(0, dtype=np.int64) if deleted is None else deleted
+        # built on the first frame() call, the writer makes it before publishing so no reader ever merges
+        self.merged = None
+
+    def __len__(self):
+        return len(self.base) - len(self.deleted) + int((self.slots < 0).sum())
+
+    def frame(self):
+        """
+        :return: dataframe of the current rows, edited rows in the place of the row they replace and inserted rows last
+        """
+        if len(self.delta) == 0 and len(self.deleted) == 0:
+            return self.base
+        if self.merged is None:
+            # positions in base followed by delta, edited rows point at their delta row
+            size = len(self.base)
+            sources = np.arange(size)
+            replaced = self.slots >= 0
+            sources[self.slots[replaced]] = size + np.flatnonzero(replaced)
+            order = np.concatenate([np.delete(sources, self.deleted), size + np.flatnonzero(~replaced)])
+            # merged column by column, a frame concat costs more than the copies themselves
+            data = {column: concat_arrays(self.base[column].array, self.delta[column].array).take(order)
+                    for column in self.base.columns}
+            self.merged = pd.DataFrame(data, index=self.base.index.append(self.delta.index).take(order),
+                                       columns=self.base.columns, copy=False)
+        return self.merged
+
+    def present(self, row_ids):
+        """
+        :param row_ids: list of row ids
+        :return: boolean array of the ids of current rows
+        """
+        row_ids = pd.Index(row_ids, dtype=np.int64)
+        positions = self.base.index.get_indexer(row_ids)
+        return row_ids.isin(self.delta.index) | ((positions >= 0) & ~np.isin(positions, self.deleted))
+
+    def rows(self, row_ids):
+        """
+        :param row_ids: list of ids of current rows
+        :return: dataframe of the rows, in the order of row_ids
+        """
+        row_ids = pd.Index(row_ids, dtype=np.int64)
+        changed = row_ids.isin(self.delta.index)
+        unchanged = self.base.take(self.base.index.get_indexer(row_ids[~changed]))
+        if not changed.any():
+            return unchanged
+        return pd.concat([self.delta.loc[row_ids[changed]], unchanged]).loc[row_ids]
+
+    def changed(self, new, deleted_ids):
+        """
+        :param new: dataframe of the final values of the edited and inserted rows, indexed by id, with the columns of
+                    base
+        :param deleted_ids: list of ids of current rows to delete
+        :return: overlay with the rows of new in place of the current ones and without the deleted rows
+        """
+        stay = ~self.delta.index.isin(deleted_ids)
+        replaced = self.delta.index.isin(new.index)
+        added = new.index[~new.index.isin(self.delta.index)]
+        delta = self.delta if stay.all() else self.delta[stay]
+        if replaced.any():
+            # rows already in delta keep their place in it, so an inserted row stays where it was inserted
+            delta = pd.concat([self.delta[stay & ~replaced], new]).loc[self.delta.index[stay].append(added)]
+        elif len(new):
+            delta = pd.concat([delta, new])
+        slots = np.concatenate([self.slots[stay], self.base.index.get_indexer(added)])
+        positions = self.base.index.get_indexer(pd.Index(deleted_ids, dtype=np.int64))
+        deleted = np.union1d(self.deleted, positions[positions >= 0])
+        return FrameOverlay(self.base, delta, slots, deleted)
+
+
+def concat_arrays(first, second):
+    """
+    :param first: pandas array of a column
+    :param second: pandas array of the same dtype
+    :return: pandas array of the values of first followed by those of second
+    """
+    return type(first)._concat_same_type([first, second])
+
+
+# one version of the movie table together with every aggregate and index derived from it,
+# never changed once MovieStore has published it
+class MovieSnapshot:
+    def __init__(self, metadata, derived, genre_aggregates, counters, next_id=None):
+        """
+        :param metadata: cleaned dataframe whose index holds the integer row ids, or a FrameOverlay over one
+        :param derived: dataframe of the derived columns returned by analysis.calculate_derived, or a FrameOverlay
+                        over one
+        :param genre_aggregates: per genre aggregates over metadata
+        :param counters: dictionary of list column to the counter of its features
+        :param next_id: id the next inserted row gets, defaults to one past the largest id in metadata
+        """
+        # applied batches go into the overlays, the frames the snapshot was built from are never copied or written
+        self.metadata_rows = metadata if isinstance(metadata, FrameOverlay) else FrameOverlay(metadata)
+        self.derived_rows = derived if isinstance(derived, FrameOverlay) else FrameOverlay(derived)
+        self.genre_aggregates = genre_aggregates
+        self.counters = counters
+        # groups of indexes (i.e. 'search', 'slider') as dictionaries of column name to index
+        self.indexes = {}
+        # bumped by every applied batch so anything built from older data can tell it is stale
+        self.version = 0
+        self.generation = next(generations)
+        # parts still shared with the snapshot this one was copied from, copied before their first change
+        self.shared = set()
+        # only ever goes up, so a new row never takes the id of a deleted one that a stale page may still show
+        if next_id is None:
+            next_id = int(self.metadata.index.max()) + 1 if len(self.metadata) else 0
+        self.next_id = next_id
+
+    @property
+    def metadata(self):
+        return self.metadata_rows.frame()
+
+    @property
+    def derived(self):
+        return self.derived_rows.frame()
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        """
+        :param dataset: dictionary returned by snapshot.load_dataset
+        :return: snapshot of the dataset, without any indexes
+        """
+        counters = {'genres': dataset['pop_genres_count'],
+                    'keywords': dataset['pop_keys_count'],
+                    'production_companies': dataset['pop_companies_count']}
+        return cls(dataset['metadata'], dataset['derived'], dataset['genre_aggregates'], counters,
+                   dataset.get('next_id'))
+
+    def aggregates(self):
+        """
+        :return: dictionary of the aggregates in the format returned by snapshot.build_aggregates, and the next row id
+        """
+        return {'genre_aggregates': self.genre_aggregates,
+                'pop_genres_count': self.counters['genres'],
+                'pop_keys_count': self.counters['keywords'],
+                'pop_companies_count': self.counters['production_companies'],
+                'derived': self.derived,
+                'text_indexes': {column: index for _, group_indexes in self.indexes.values()
+                                 for column, index in group_indexes.items() if isinstance(index, indexes.TrigramIndex)},
+                'next_id': self.next_id}
+
+    def add_indexes(self, group, builder, built=None):
+        """
+        :param group: name of the index group
+        :param builder: function of the metadata dataframe returning a dictionary of column name to index,
+                        kept so the group can be rebuilt after a large batch
+        :param built: dictionary of column name to index already built over metadata, None to call builder
+        """
+        self.indexes = dict(self.indexes)
+        self.indexes[group] = (builder, builder(self.metadata) if built is None else built)
+
+    def share_indexes(self, other):
+        """
+        :param other: snapshot over the same rows (i.e. of the store this one replaces), whose index groups are taken
+                      over and copied before their first change
+        """
+        self.indexes = other.indexes
+        self.shared.add('indexes')
+
+    def index_group(self, group):
+        """
+        :param group: name of the index group
+        :return: dictionary of column name to index
+        """
+        return self.indexes[group][1]
+
+    def copy(self):
+        """
+        :return: snapshot sharing everything with this one until a part of it is changed
+        """
+        snapshot = MovieSnapshot(self.metadata_rows, self.derived_rows, self.genre_aggregates, self.counters,
+                                 self.next_id)
+        snapshot.indexes = self.indexes
+        snapshot.version = self.version
+        snapshot.generation = self.generation
+        # the overlays are only ever replaced by new ones, the rest is copied on its first change
+        snapshot.shared = {'genre_aggregates', 'counters', 'indexes'}
+        return snapshot
+
+    def unshare(self, part):
+        """
+        :param part: name of the part about to be changed in place
+        """
+        if part not in self.shared:
+            return
+        self.shared.discard(part)
+        if part == 'genre_aggregates':
+            self.genre_aggregates = self.genre_aggregates.copy()
+        elif part == 'counters':
+            self.counters = {column: counter.copy() for column, counter in self.counters.items()}
+        elif part == 'indexes':
+            self.indexes = {group: (builder, {column: index.copy() for column, index in group_indexes.items()})
+                            for group, (builder, group_indexes) in self.indexes.items()}
+
+    def apply(self, batch):
+        """
+        only called by the MovieStore writer, on a copy no reader can see yet
+        :param batch: list of operations applied in order, each a dictionary of
+                      {'op': 'insert', 'row': values}, {'op': 'edit', 'id': row_id, 'row': values}
+                      or {'op': 'delete', 'id': row_id}, where values is a MovieRecord, a list in column order
+                      or a dictionary
+        :return: dictionary of the inserted, edited and deleted row ids
+        """
+        columns = list(self.metadata_rows.base.columns)
+        dtypes = self.metadata_rows.base.dtypes
+        next_id = self.next_id
+        # every id the batch names is looked up at once
+        named = [int(operation['id']) for operation in batch if operation['op'] != 'insert']
+        present = set(itertools.compress(named, self.metadata_rows.present(named)))
+        # final state of every touched row, None for rows that end up deleted
+        changes = collections.OrderedDict()
+        inserted = []
+        for operation in batch:
+            if operation['op'] == 'insert':
+                row_id = next_id
+                next_id += 1
+                inserted.append(row_id)
+            else:
+                row_id = int(operation['id'])
+                if row_id not in changes and row_id not in present:
+                    continue
+                if changes.get(row_id, True) is None:
+                    # a deleted row can't be edited back to life
+                    continue
+            if operation['op'] == 'delete':
+                changes[row_id] = None
+                continue
+            row = operation['row']
+            if isinstance(row, records.MovieRecord):
+                # records are already converted to the schema types
+                changes[row_id] = row.to_list()
+                continue
+            if isinstance(row, dict):
+                row = [row.get(column) for column in columns]
+            changes[row_id] = utils.convert_row(row, dtypes)
+
+        old_ids = [row_id for row_id in changes if row_id in present]
+        new_ids = [row_id for row_id, row in changes.items() if row is not None]
+        old = self.metadata_rows.rows(old_ids)
+        new = pd.DataFrame([changes[row_id] for row_id in new_ids], index=pd.Index(new_ids, dtype=np.int64),
+                           columns=columns)
+        # every column goes back to the dtype of metadata, so the text columns stay str like after a load
+        new = new.astype(dtypes.to_dict())
+
+        # aggregates take the old rows out and the new rows in, one batch call each
+        self.unshare('genre_aggregates')
+        self.unshare('counters')
+        values = self.genre_aggregates.columns
+        self.genre_aggregates.delete_many(old['genres'].tolist(), old[values].to_numpy())
+        self.genre_aggregates.insert_many(new['genres'].tolist(), new[values].to_numpy())
+        for column, counter in self.counters.items():
+            deltas = collections.Counter()
+            deltas.subtract(listed_features(old[column]))
+            deltas.update(listed_features(new[column]))
+            counter.update(deltas)
+
+        # the rows go into the overlays, edited rows keep their place and inserted rows go last
+        # a row inserted and deleted in the same batch never reaches the overlays, and is reported as neither
+        deleted = [row_id for row_id, row in changes.items() if row is None and row_id in present]
+        inserted = [row_id for row_id in inserted if changes[row_id] is not None]
+        self.metadata_rows = self.metadata_rows.changed(new, deleted)
+        self.derived_rows = self.derived_rows.changed(analysis.calculate_derived(new), deleted)
+        # merged once here, every reader of the published snapshot shares these frames
+        metadata = self.metadata_rows.frame()
+        self.derived_rows.frame()
+        # a deleted or edited movie may have held a genre's min/max, those cells are rebuilt before anyone reads them
+        if self.genre_aggregates.stale.any():
+            self.genre_aggregates.recompute_extremes(metadata)
+
+        if len(old_ids) + len(new_ids) > rebuild_fraction * max(len(self.metadata_rows), 1):
+            # rebuilt indexes are new objects, so nothing needs copying first
+            self.indexes = {group: (builder, builder(metadata)) for group, (builder, _) in self.indexes.items()}
+            self.shared.discard('indexes')
+        else:
+            self.unshare('indexes')
+            for _, group_indexes in self.indexes.values():
+                indexes.index_delete(group_indexes, old)
+                indexes.index_insert(group_indexes, new)
+        self.next_id = next_id
+        self.version += 1
+        inserted_ids = set(inserted)
+        return {'inserted': inserted,
+                'edited': [row_id for row_id in new_ids if row_id not in inserted_ids],
+                'deleted': sorted(deleted)}
+
+
+# holds the current snapshot behind one reference, readers take it without locking and a single writer thread
+# publishes every change as a new snapshot
+class MovieStore:
+    def __init__(self, snapshot):
+        """
+        :param snapshot: first published snapshot
+        """
+        self.current = snapshot
+        self.writes = queue.Queue()
+        self.writer = None
+        self.writer_lock = threading.Lock()
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        """
+        :param dataset: dictionary returned by snapshot.load_dataset
+        :return: store over the dataset, without any indexes
+        """
+        return cls(MovieSnapshot.from_dataset(dataset))
+
+    def snapshot(self):
+        """
+        :return: current snapshot, consistent for as long as the caller holds it
+        """
+        return self.current
+
+    def write(self, change):
+        """
+        :param change: function applied to a private copy of the current snapshot before it is published
+        :return: what change returned, once the snapshot it made is the current one
+        """
+        with self.writer_lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.run_writer, name='movie-store-writer', daemon=True)
+                self.writer.start()
+        future = concurrent.futures.Future()
+        self.writes.put((change, future))
+        return future.result()
+
+    def run_writer(self):
+        while True:
+            pending = [self.writes.get()]
+            # every write queued meanwhile goes into the same copy, so a burst of writes publishes once
+            while True:
+                try:
+                    pending.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+            if self.publish(pending) is None:
+                continue
+            # a failed change may have left the copy half applied, so each change is redone on its own copy
+            for change, future in pending:
+                error = self.publish([(change, future)])
+                if error is not None:
+                    future.set_exception(error)
+
+    def publish(self, pending):
+        """
+        :param pending: list of (change, future) applied to one new copy, published only if every change succeeds
+        :return: exception raised by a change, None if the copy was published and the futures resolved
+        """
+        snapshot = self.current.copy()
+        try:
+            results = [change(snapshot) for change, _ in pending]
+        except Exception as error:
+            return error
+        self.current = snapshot
+        for (_, future), result in zip(pending, results):
+            future.set_result(result)
+        return None
+
+    def apply(self, batch):
+        """
+        :param batch: list of operations, in the format of MovieSnapshot.apply
+        :return: dictionary of the inserted, edited and deleted row ids, once the change is visible to readers
+        """
+        return self.write(lambda snapshot: snapshot.apply(batch))
+
+    def add_indexes(self, group, builder, built=None):
+        """
+        :param group: name of the index group
+        :param builder: function of the metadata dataframe returning a dictionary of column name to index
+        :param built: dictionary of column name to index already built over metadata, None to call builder
+        """
+        self.write(lambda snapshot: snapshot.add_indexes(group, builder, built))
+
+    def share_indexes(self, other):
+        """
+        :param other: snapshot over the same rows whose index groups are taken over
+        """
+        self.write(lambda snapshot: snapshot.share_indexes(other))
+
+
+def listed_features(series):
+    """
+    :param series: list-valued column
+    :return: array of every listed feature
+    """
+    return columns.ListColumn.from_series(series).values()
+
+
+def read_batch(text):
+    """
+    :param text: csv of a data drop with an 'op' column ('insert', 'edit' or 'delete'), an 'id' column for
+                 edits and deletes, and the metadata columns, list cells written as python lists
+    :return: list of operations for MovieStore.apply
+    """
+    drop = pd.read_csv(io.StringIO(text), dtype=str, keep_default_na=False)
+    batch = []
+    for record in drop.to_dict('records'):
+        operation = {'op': record.pop('op')}
+        row_id = record.pop('id', '')
+        if row_id != '':
+            operation['id'] = int(float(row_id))
+        if operation['op'] != 'delete':
+            operation['row'] = records.MovieRecord.from_inputs(record)
+        batch.append(operation)
+    return batch
@@ -1,45 +1,89 @@
+import src.columns as columns
 import pandas as pd
+import numpy as np
+import ast
+import functools
 import re
 
 
+# column types applied after tokenizing each csv file
+# numeric and date columns are coerced rather than parsed directly because the raw kaggle files contain a few malformed rows
+metadata_dtypes = {'budget': 'float64',
+                   'id': 'float64',
+                   'popularity': 'float64',
+                   'release_date': 'datetime64[ns]',
+                   'revenue': 'float64',
+                   'runtime': 'float64',
+                   'vote_average': 'float64',
+                   'vote_count': 'float64'}
+
+keywords_dtypes = {'id': 'float64'}
+
+
 # csv parser function
-def parse_csv(filepath, contains_header=False):
+def parse_csv(filepath, contains_header=False, dtypes=None):
     """
     :param filepath: location of csv data file
     :param contains_header: flag for whether csv has headers or not
+    :param dtypes: dictionary of column name to dtype, columns not listed are kept as strings
     :return: dataframe object of csv data
     """
-    # open csv file with open() and call it file
-    with open(filepath, 'r', encoding="utf8") as file:
-        data = []
-        headers = []
-        # case for when file contains headers
-        if contains_header:
-            # reading first line with readline()
-            # splitting line (separated by commas) to get each column header
-            headers = file.readline().strip('\n').split(',')
-        # use for loop to read in rest of file
-        # split data into corresponding columns using regex expression
-        for line in file:
-            line = line.strip('\n')
-            words = re.split(r',(?=(?:[^\"]*\"[^\"]*\")*(?![^\"]*\"))', line)
-            row = []
-            for word in words:
-                if word.replace('.', '', 1).isdigit():
-                    row.append(float(word))
-                else:
-                    row.append(word)
-            data.append(row)
-            # break
-    # case for when file contains header when creating dataframe
-    if contains_header:
-        dataframe = pd.DataFrame(data, columns=headers)
-    else:
-        dataframe = pd.DataFrame(data)
-    # print(dataframe)
+    # pandas' C tokenizer handles quoted commas, so every cell is read as a string in one pass
+    dataframe = pd.read_csv(filepath, header=0 if contains_header else None, dtype=str,
+                            keep_default_na=False, encoding="utf8")
+    return apply_dtypes(dataframe, dtypes)
+
+
+# streaming version of parse_csv to bound peak memory on large files
+def iter_csv(filepath, contains_header=False, dtypes=None, chunksize=50000):
+    """
+    :param filepath: location of csv data file
+    :param contains_header: flag for whether csv has headers or not
+    :param dtypes: dictionary of column name to dtype, columns not listed are kept as strings
+    :param chunksize: number of rows in each chunk
+    :return: generator of dataframe chunks of csv data
+    """
+    reader = pd.read_csv(filepath, header=0 if contains_header else None, dtype=str,
+                         keep_default_na=False, encoding="utf8", chunksize=chunksize)
+    for chunk in reader:
+        yield apply_dtypes(chunk, dtypes)
+
+
+def apply_dtypes(dataframe, dtypes):
+    """
+    :param dataframe: dataframe object with string columns
+    :param dtypes: dictionary of column name to dtype
+    :return: dataframe with the listed columns converted, cells that fail to convert become NaN/NaT
+    """
+    if dtypes is None:
+        return dataframe
+    for column, dtype in dtypes.items():
+        if column not in dataframe.columns:
+            continue
+        if str(dtype).startswith('datetime'):
+            dataframe[column] = pd.to_datetime(dataframe[column], errors='coerce')
+        else:
+            dataframe[column] = pd.to_numeric(dataframe[column], errors='coerce').astype(dtype)
     return dataframe
 
 
+# function to convert the values of one row typed in by the user to the dtypes of the columns they go into
+def convert_row(values, dtypes):
+    """
+    :param values: list of values of one row, in column order
+    :param dtypes: list of the dtype of every column (i.e. dataframe.dtypes)
+    :return: list of values with numbers and dates converted, values that fail to convert become NaN/NaT
+    """
+    row = []
+    for value, dtype in zip(values, dtypes):
+        if dtype.kind == 'M':
+            value = pd.to_datetime(value, errors='coerce')
+        elif dtype.kind in 'iuf':
+            value = pd.to_numeric(value, errors='coerce')
+        row.append(value)
+    return row
+
+
 # declare comparison operators
 operators = [['ge ', '>='],
              ['le ', '<='],
@@ -57,14 +101,19 @@ def split_filter_part(filter_part):
     :param filter_part: string formatted as "column operator value"
     :return: filter_part formatted as list of strings, if contains operator else return empty list
     """
-    # only split if operator is in the search input
+    # only look for the operator right after the column name, so values such as "little" never read as 'le '
+    name_end = filter_part.find('}') + 1
+    rest = filter_part[name_end:].lstrip()
     for operator_type in operators:
         for operator in operator_type:
-            if operator in filter_part:
+            if rest.startswith(operator):
                 # clean up strings
-                name_part, value_part = filter_part.split(operator, 1)
+                name_part, value_part = filter_part[:name_end], rest[len(operator):]
                 name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
                 value_part = value_part.strip()
+                if not value_part:
+                    # an operator without a value, i.e. "{budget} >=" while it is being typed
+                    return [None] * 3
                 v0 = value_part[0]
                 if v0 == value_part[-1] and v0 in ("'", '"', '`'):
                     value = value_part[1: -1].replace('\\' + v0, v0)
@@ -80,8 +129,8 @@ def split_filter_part(filter_part):
 
 
 def load_data():
-    meta = parse_csv("../data/movies_metadata.csv", True).drop_duplicates('id')
-    kwords = parse_csv("../data/keywords.csv", True).drop_duplicates('id')
+    meta = parse_csv("../data/movies_metadata.csv", True, metadata_dtypes).drop_duplicates('id')
+    kwords = parse_csv("../data/keywords.csv", True, keywords_dtypes).drop_duplicates('id')
 
     meta.set_index('id', inplace=True)
     kwords.set_index('id', inplace=True)
@@ -98,52 +147,113 @@ def load_data():
     return meta
 
 
-def clean_dataframe(df, columns):
+# matches the value of every 'name' key in a stringified list of dicts, quoted with either ' or "
+name_pattern = re.compile(r"""'name': (?:'((?:[^'\\]|\\.)*)'|"((?:[^"\\]|\\.)*)")""")
+
+
+# function to pull the names out of a stringified list of dicts without evaluating it
+# results are memoized by the raw string since most genre/company lists repeat across movies
+@functools.lru_cache(maxsize=1 << 16)
+def extract_names(string):
+    """
+    :param string: raw cell such as "[{'id': 16, 'name': 'Animation'}, {'id': 35, 'name': 'Comedy'}]"
+    :return: tuple of names in the order they appear
+    """
+    names = []
+    for single_quoted, double_quoted in name_pattern.findall(string):
+        name = single_quoted or double_quoted
+        if '\\' in name:
+            # only escaped names need the literal parser, i.e. 'Children\'s'
+            quote = "'" if single_quoted else '"'
+            name = ast.literal_eval(quote + name + quote)
+        names.append(name)
+    return tuple(names)
+
+
+def name_cache_stats():
+    """
+    :return: dictionary of hits, misses, size and hit rate of the extract_names cache
+    """
+    info = extract_names.cache_info()
+    lookups = info.hits + info.misses
+    return {'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'hit_rate': info.hits / lookups if lookups else 0.0}
+
+
+def clean_dataframe(df, list_columns):
     """
     :param df: dataframe object to clean
-    :param columns: list of df columns to clean (i.e. keywords, genres)
-    :return: cleaned up version of dataframe
-    """
-    for column in columns:
-        keywords_list = df[column]
-        clean = []
-        for string in keywords_list:
-            new_row = []
-            if string is not None:
-                try:
-                    row = list(eval(string.strip('"')))
-                except SyntaxError:
-                    row = []
-                for dictionary in row:
-                    dictionary_value = dictionary.get('name')
-                    new_row.append(dictionary_value)
-            clean.append(new_row)
-        df.drop(columns=[column], inplace=True)
-        df[column] = pd.Series(clean)
+    :param list_columns: list of df columns to clean (i.e. keywords, genres)
+    :return: cleaned up version of dataframe, the cleaned columns stored as columns.ListColumn
+    """
+    clean = {column: [] for column in list_columns}
+    # walk all of the columns together so the frame is only traversed once
+    for row in zip(*[df[column] for column in list_columns]):
+        for column, string in zip(list_columns, row):
+            clean[column].append(extract_names(string) if isinstance(string, str) else ())
+    # cleaned columns are moved to the end of the frame in the order given
+    df = df.drop(columns=list_columns)
+    for column in list_columns:
+        df[column] = pd.Series(columns.ListColumn.from_lists(clean[column]), index=df.index)
     return df
 
 
-def search(dataframe, query, dropdown_vals):
+def search_positions(dataframe, query, dropdown_vals, indexes=None):
     """
     :param dataframe: dataframe object to perform search on
     :param query: query string to filter
     :param dropdown_vals: list of column headers
-    :return: dataframe of query results
+    :param indexes: dictionary of column name to index built over dataframe, indexed columns skip the row scan
+    :return: sorted array of the unique row positions matching the query in any of the columns
     """
-    result = pd.DataFrame()
+    hits = []
     if query is not None and dropdown_vals is not None:
         for header in dropdown_vals:
+            if indexes is not None and header in indexes:
+                positions = dataframe.index.get_indexer(indexes[header].search(query))
+                hits.append(positions[positions >= 0])
+                continue
+            if isinstance(dataframe[header].dtype, columns.ListDtype):
+                # list columns match whole features joined by '&&' or '||', answered from their codes
+                hits.append(np.flatnonzero(dataframe[header].array.search(query)))
+                continue
             series = dataframe[header].dropna()
-            if isinstance(series[0], list):
-                df_filtered = dataframe[pd.DataFrame(series.tolist()).isin([query]).values]
-                result = result.append(df_filtered)
-            if isinstance(series[0], str) \
+            if series.empty:
+                continue
+            # positions are taken from a copy of the column with a default index so they line up with take()
+            column = pd.Series(dataframe[header].to_numpy())
+            if column.dtype.kind == 'M':
+                # dates match on their text, so '1995' or '1995-07' finds every movie released then
+                dates = column.dt.strftime('%Y-%m-%d')
+                hits.append(np.flatnonzero(dates.str.contains(query, regex=False, na=False).to_numpy(dtype=bool)))
+                continue
+            if isinstance(series.iloc[0], str) \
                     and not query.replace('.', '', 1).isdigit() \
-                    and not series[0].replace('.', '', 1).isdigit():
-                df_filtered = dataframe[series.str.contains(query)]
-                result = result.append(df_filtered)
-            if isinstance(series[0], float) and query.replace('.', '', 1).isdigit():
-                bools = [float(query) == x if x is not None else False for x in dataframe[header]]
-                df_filtered = dataframe[bools]
-                result = result.append(df_filtered)
-    return result
+                    and not series.iloc[0].replace('.', '', 1).isdigit():
+                # a literal substring, as the trigram index matches it
+                hits.append(np.flatnonzero(column.str.contains(query, regex=False, na=False).to_numpy(dtype=bool)))
+            if isinstance(series.iloc[0], float) and query.replace('.', '', 1).isdigit():
+                values = pd.to_numeric(column, errors='coerce').to_numpy()
+                hits.append(np.flatnonzero(values == float(query)))
+    if not hits:
+        return np.empty(0, dtype=np.int64)
+    # a movie matching several columns is only returned once
+    return np.unique(np.concatenate(hits).astype(np.int64))
+
+
+def search(dataframe, query, dropdown_vals, indexes=None, limit=None, offset=0):
+    """
+    :param dataframe: dataframe object to perform search on
+    :param query: query string to filter
+    :param dropdown_vals: list of column headers
+    :param indexes: dictionary of column name to index built over dataframe, indexed columns skip the row scan
+    :param limit: maximum number of rows to return, None for all of them
+    :param offset: number of matching rows to skip before the first returned row
+    :return: dataframe of query results
+    """
+    positions = search_positions(dataframe, query, dropdown_vals, indexes)
+    end = None if limit is None else offset + limit
+    # only the requested page is materialized, in a single take
+    return dataframe.take(positions[offset:end])